@@ -12,7 +12,7 @@ setup(
     description='BPMN workflow based web service framework with advanced '
                 'permissions and extensible CRUD features',
     install_requires=['beaker', 'passlib', 'falcon', 'beaker_extensions', 'lazy_object_proxy',
-                      'redis', 'enum34', 'werkzeug', 'celery', 'SpiffWorkflow', 'pyoko',
+                      'redis>=3.0', 'enum34', 'werkzeug', 'celery', 'SpiffWorkflow', 'pyoko',
                       'tornado', 'pika==0.10.0', 'babel', 'futures',],
     dependency_links=[
         'git+https://github.com/didip/beaker_extensions.git#egg=beaker_extensions',
@@ -16,4 +16,4 @@ ACTIVITY_MODULES_IMPORT_PATHS += ['tests.views']
 WORKFLOW_PACKAGES_PATHS += [os.path.join(BASE_DIR, 'diagrams')]
 
 TRANSLATIONS_DIR = os.path.join(BASE_DIR, 'locale')
-TRANSLATION_DOMAINS['messages'] = 'en'
\ No newline at end of file
+TRANSLATION_DOMAINS['messages'] = 'en'
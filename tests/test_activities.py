@@ -0,0 +1,37 @@
+# -*-  coding: utf-8 -*-
+"""
+"""
+
+# Copyright (C) 2016 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+import pytest
+
+from zengine.lib.activities import ActivityLocations, ActivityRegistry, find_activity
+from zengine.lib.exceptions import ConfigurationError
+from zengine.views.crud import CrudView
+from zengine.views.system import get_tasks
+
+
+def test_find_activity():
+    location, func = find_activity('system.get_tasks', ['zengine.views'])
+    assert location == ('zengine.views.system', 'get_tasks', None)
+    assert func is get_tasks
+    location, func = find_activity('crud.CrudView.list', ['foo', 'zengine.views'])
+    assert location == ('zengine.views.crud', 'CrudView', 'list')
+    with pytest.raises(ConfigurationError) as e:
+        find_activity('crud.NoSuchView', ['foo', 'zengine.views'])
+    assert 'foo.crud' in str(e.value) and 'zengine.views.crud.NoSuchView' in str(e.value)
+
+
+def test_activity_registry():
+    ActivityLocations.flush()
+    activities = ActivityRegistry()
+    assert activities.get('crud.CrudView') is CrudView
+    assert ActivityLocations().get_all()['crud.CrudView'] == ['zengine.views.crud',
+                                                              'CrudView', None]
+    # locations are shared by new registries
+    activities = ActivityRegistry()
+    activities.preload()
+    assert activities._activities['crud.CrudView'] is CrudView
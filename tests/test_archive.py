@@ -0,0 +1,35 @@
+# -*-  coding: utf-8 -*-
+"""
+"""
+
+# Copyright (C) 2016 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+import os
+
+import pytest
+from zengine.lib.archive import JSONLinesArchive
+
+
+def test_write_find_remove(tmpdir):
+    archive = JSONLinesArchive(str(tmpdir))
+    records = [{'key': 'key_%s' % i, 'data': {'step': 'x' * 500}} for i in range(20)]
+    file_name, size = archive.write('WFInstance', records)
+    assert size == archive.size() == archive.size('WFInstance')
+    # repetitive data is compressed
+    assert size < 1000
+    assert list(archive.read(file_name)) == records
+    assert archive.find(file_name, 'key_5') == records[5]
+    assert archive.find(file_name, 'missing') is None
+
+    assert archive.remove(file_name, ['key_5', 'key_6']) == 18
+    assert archive.find(file_name, 'key_5') is None
+    assert archive.remove(file_name, [r['key'] for r in records]) == 0
+    assert not os.path.exists(archive.path(file_name))
+
+
+def test_invalid_file_name(tmpdir):
+    archive = JSONLinesArchive(str(tmpdir))
+    with pytest.raises(ValueError):
+        archive.path('../../etc/passwd')
@@ -0,0 +1,54 @@
+# -*-  coding: utf-8 -*-
+"""
+"""
+
+# Copyright (C) 2016 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+import os
+import pickle
+
+from zengine.lib.camunda_parser import DiagramExtensions, ZopsSerializer
+from zengine.lib.utils import DotDict
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def _read(path):
+    with open(os.path.join(BASE_DIR, path)) as fp:
+        return fp.read()
+
+
+def test_diagram_extensions():
+    ext = DiagramExtensions.from_xml(_read('zengine/diagrams/crud.bpmn'))
+    assert ext.name == 'Crud VIEW'
+    assert ext.get_description('collaboration', 'process') == 'sample crud description'
+    assert ext.wf_properties == {'object': 'other', 'menu_category': 'hidden'}
+    assert ext.get_input_data('delete_object') == {'list': '1'}
+    ext.input_data['delete_object'] = {'nested': {'a': [1]}}
+    ext.get_input_data('delete_object')['nested']['a'].append(2)
+    assert ext.get_input_data('delete_object') == {'nested': {'a': [1]}}
+    DiagramExtensions._cache.clear()
+    assert ext.get_lane_data('delete_object') == {'name': None}
+    # collaboration name precedes participant name
+    assert DiagramExtensions.from_xml(
+        _read('zengine/diagrams/edit_catalog_data.bpmn')).name == 'Edit Catalog Datas'
+
+
+def test_diagram_extensions_lanes_and_cache():
+    content = _read('tests/diagrams/multiuser.bpmn')
+    ext = DiagramExtensions.from_xml(content)
+    assert DiagramExtensions.from_xml(content) is ext
+    assert ext.get_lane_data('assign') == {'name': 'Manager'}
+    assert ext.get_lane_data('perform') == {'name': 'Employee'}
+
+
+def test_spec_pickling():
+    spec = ZopsSerializer().deserialize_workflow_spec(_read('zengine/diagrams/crud.bpmn'), 'crud')
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+        loaded = pickle.loads(pickle.dumps(spec, protocol))
+        assert loaded.wf_name == spec.wf_name
+        assert loaded.wf_properties == spec.wf_properties
+        assert isinstance(loaded.task_specs['delete_object'].data, DotDict)
+        assert loaded.task_specs['delete_object'].data == spec.task_specs['delete_object'].data
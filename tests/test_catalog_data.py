@@ -47,4 +47,20 @@ class TestCase(BaseTestCase):
 
         assert 'canceled' in resp.json['notify']
 
-
+    def test_catalog_data_update(self):
+        from zengine.lib.cache import CatalogNames
+        from zengine.lib.catalog_data import CatalogData, catalog_data_manager
+        CatalogData.CURRENT_LANG_CODE = 'en'
+        catalog_data_manager.preload()
+        catalog_data_manager.update('test catalog', {'0': {'en': 'test_en', 'tr': 'test_tr'}})
+        assert catalog_data_manager('test catalog', 0) == 'test_en'
+        assert catalog_data_manager.get_all_as_dict('test catalog') == {0: 'test_en'}
+        catalog_data_manager.update('test catalog', {'0': {'en': 'updated', 'tr': 'updated'}})
+        catalog_data_manager.process_updates()
+        assert catalog_data_manager('test catalog', 0) == 'updated'
+        assert 'test catalog' in CatalogNames().get_names()
+        # updates may be missed while disconnected
+        CatalogData._subscription.reconnected = True
+        catalog_data_manager.process_updates()
+        assert 'test catalog' not in CatalogData.CACHE['en']
+        assert catalog_data_manager('test catalog', 0) == 'updated'
@@ -9,10 +9,12 @@
 from time import sleep
 
 import pytest
+import six
 
 from zengine.models import Role, Unit
 from zengine.lib.exceptions import FormValidationError
 from zengine.lib.test_utils import BaseTestCase, username
+from zengine.views.crud import SelectBoxCache
 
 RESPONSES = {}
 
@@ -108,3 +110,34 @@ class TestCase(BaseTestCase):
         assert "Username" in resp.json['objects'][0]
         assert len(resp.json['objects']) - 1 == Role.objects.count()
 
+    def test_list_linked_fields(self):
+        """
+        test rendering of linked model values in object lists
+        """
+        list_fields = Role.Meta.list_fields
+        Role.Meta.list_fields = ['user', 'user.username']
+        try:
+            self.prepare_client('/crud', username='super_user')
+            resp = self.client.post(model="Role")
+            for row in resp.json['objects'][1:]:
+                role = Role.objects.get(row['key'])
+                assert row['fields'] == [six.text_type(role.user), role.user.username]
+                assert [a['name'] for a in row['actions'] if 'name' in a] == ['Delete', 'Edit']
+        finally:
+            Role.Meta.list_fields = list_fields
+
+    def test_select_list_search(self):
+        """
+        test substring search of select boxes on search fields
+        """
+        SelectBoxCache.flush('Unit')
+        self.prepare_client('/crud', username='super_user')
+        # searched on db until index is built
+        resp = self.client.post(model='Unit', cmd='select_list', query='Parent')
+        assert 'Test Parent Unit' in [item['value'] for item in resp.json['objects']]
+        assert SelectBoxCache(Unit).build() == Unit.objects.count()
+        resp = self.client.post(model='Unit', cmd='select_list', query='ARENT UN')
+        assert sorted(item['value'] for item in resp.json['objects']) == [
+            'Test Parent Unit', 'Test Parent Unit 2']
+        resp = self.client.post(model='Unit', cmd='select_list', query='xq_not_existing')
+        assert resp.json['objects'] == [0]
@@ -0,0 +1,44 @@
+# -*-  coding: utf-8 -*-
+"""
+"""
+
+# Copyright (C) 2016 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+import base64
+import os
+
+import pytest
+from zengine.lib.file_storage import LocalFileStorage, guess_mime_type
+
+
+def test_store_deduplicates(tmpdir):
+    storage = LocalFileStorage(str(tmpdir), url='/files/')
+    digest, created = storage.store(b'hello world')
+    assert created
+    assert storage.store(b'hello world') == (digest, False)
+    assert storage.store_base64(base64.b64encode(b'hello world').decode()) == (digest, False)
+    with storage.open(digest) as f:
+        assert f.read() == b'hello world'
+    assert storage.size(digest) == 11
+    assert storage.url(digest) == '/files/%s/%s/%s' % (digest[:2], digest[2:4], digest)
+    # no temporary files left behind
+    assert os.listdir(os.path.dirname(storage.path(digest))) == [digest]
+
+
+def test_invalid_digest(tmpdir):
+    storage = LocalFileStorage(str(tmpdir))
+    assert not storage.exists('../../etc/passwd')
+    with pytest.raises(ValueError):
+        storage.open('../../etc/passwd')
+
+
+def test_guess_mime_type():
+    assert guess_mime_type(b'%PDF-1.4\n', 'report.doc') == 'application/pdf'
+    assert guess_mime_type(b'\x89PNG\r\n\x1a\n0000') == 'image/png'
+    assert guess_mime_type(b'PK\x03\x04', 'table.xlsx') == (
+        'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    assert guess_mime_type(b'PK\x03\x04') == 'application/zip'
+    assert guess_mime_type(b'plain text', 'notes.txt') == 'text/plain'
+    assert guess_mime_type(b'\x00\x01') == 'application/octet-stream'
@@ -163,4 +163,32 @@ class TestCase:
         serialized_form = form.serialize()
 
         assert 'name' not in serialized_form['model']
-        assert 'explanation' in serialized_form['model']
\ No newline at end of file
+        assert 'explanation' in serialized_form['model']
+
+    def test_layout_cache(self):
+        JsonForm.layout_cache.invalidate()
+        first = LoginForm().serialize()
+        assert len(JsonForm.layout_cache) == 1
+
+        lf = LoginForm()
+        lf.username = 'cached_user'
+        second = lf.serialize()
+        assert len(JsonForm.layout_cache) == 1
+        assert second['schema'] == first['schema']
+        assert second['form'] == first['form']
+        assert second['model']['username'] == 'cached_user'
+
+        # replacing nodes of a serialized form doesn't leak into the cached layout
+        props = second['schema']['properties']
+        props['username'] = dict(props['username'], widget='filter_interface')
+        second['form'].append('foo')
+        fourth = LoginForm().serialize()
+        assert 'widget' not in fourth['schema']['properties']['username']
+        assert fourth['form'] == first['form']
+
+        lf = LoginForm()
+        lf.foo = fields.String(value='bar')
+        third = lf.serialize()
+        assert len(JsonForm.layout_cache) == 2
+        assert 'foo' in third['schema']['properties']
+        assert third['model']['foo'] == 'bar'
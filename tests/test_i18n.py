@@ -177,3 +177,41 @@ class TestCase(BaseTestCase):
             assert v != ''
             assert 'None' not in v
             assert '123' in v and '456' in v and '789' in v
+
+    def test_lazy_translation_language_switch(self):
+        import copy
+        lazy = translation.gettext_lazy(_MSG_EN)
+        translation.InstalledLocale.install_language('tr')
+        assert lazy == _MSG_TR
+        assert translation.InstalledLocale._active_cache[('messages', _MSG_EN)] == _MSG_TR
+        translation.InstalledLocale.install_language('en')
+        assert lazy == _MSG_EN
+        assert isinstance(copy.deepcopy(lazy), translation.LazyTranslation)
+        translation.InstalledLocale.install_language('tr')
+        assert copy.copy(lazy) == _MSG_TR
+
+    def test_format_many(self):
+        import datetime
+        values = [datetime.datetime(2016, 7, 21, 17, 32), None, datetime.date(2016, 7, 22)]
+        assert translation.format_many(values, 'date', locale='tr') == [
+            translation.format_date(values[0], locale='tr'), None,
+            translation.format_date(values[2], locale='tr')]
+        assert translation.format_many([1.23456], 'decimal', locale='tr') == [_MSG_TR_DECIMAL]
+        assert translation.get_formatter('decimal', locale='tr') is \
+            translation.get_formatter('decimal', locale='tr')
+        # unknown locales fall back to the default language
+        assert translation.format_many([1.23456], 'decimal', locale='xx') == [_MSG_EN_DECIMAL]
+
+    def test_wrapped_formatters(self):
+        import datetime
+        from babel import dates, numbers
+        value = datetime.datetime(2016, 7, 21, 17, 32)
+        # plain calls use the cached formatters, results are the same as Babel's
+        assert translation.format_date(value, 'short', locale='tr') == dates.format_date(
+            value, 'short', locale='tr')
+        assert translation.format_date(None, locale='tr') == dates.format_date(locale='tr')
+        assert translation.format_percent(0.25, locale='tr') == numbers.format_percent(
+            0.25, locale='tr')
+        # calls with extra Babel arguments are passed to Babel
+        assert translation.format_decimal(1.23456, locale='tr', decimal_quantization=False) \
+            == numbers.format_decimal(1.23456, locale='tr', decimal_quantization=False)
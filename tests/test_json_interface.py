@@ -0,0 +1,37 @@
+# -*-  coding: utf-8 -*-
+"""
+"""
+
+# Copyright (C) 2016 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+from datetime import datetime, date
+
+import pytest
+from zengine.lib import json_interface
+
+
+@pytest.mark.parametrize('backend', [name for name, cls in json_interface.BACKENDS])
+def test_backends_roundtrip(backend):
+    codec = json_interface.get_backend(backend)
+    data = {'cmd': 'message', 'content': u'Merhaba dünya', 'items': [1, 2.5, None, True]}
+    assert codec.loads(codec.dumps(data)) == data
+    assert codec.loads(codec.dumps(data).encode('utf-8')) == data
+
+
+def test_datetime_serialization():
+    data = json_interface.loads(json_interface.dumps({'dt': datetime(2016, 7, 21, 17, 32),
+                                                      'd': date(2016, 7, 21)}))
+    assert data == {'dt': '2016-07-21T17:32:00', 'd': '2016-07-21'}
+
+
+def test_stable_dumps():
+    import json
+    data = {'key': 'abc', 'items': [1, u'dünya']}
+    assert json_interface.stable_dumps(data) == json.dumps(data)
+
+
+def test_unknown_type_raises():
+    with pytest.raises(TypeError):
+        json_interface.dumps({'obj': object()})
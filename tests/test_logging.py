@@ -0,0 +1,103 @@
+# -*-  coding: utf-8 -*-
+"""
+"""
+
+# Copyright (C) 2016 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+import io
+import logging
+import os
+
+import pytest
+
+from zengine.tornado_server.get_logger import Payload, PayloadFilter, AsyncLogHandler
+
+
+def _make_logger(name, *filters):
+    stream = io.StringIO()
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.handlers = [logging.StreamHandler(stream)]
+    logger.filters = list(filters)
+    return logger, stream
+
+
+def test_payload_is_lazy():
+    calls = []
+    payload = Payload(lambda: calls.append(1) or {'a': 1})
+    logger, stream = _make_logger('test_payload_is_lazy')
+    logger.setLevel(logging.INFO)
+    logger.debug("%s", payload)
+    assert not calls
+    logger.info("%s", payload)
+    logger.info("%s", payload)
+    assert calls == [1]
+    assert stream.getvalue() == "{'a': 1}\n{'a': 1}\n"
+
+
+def test_payload_filter_truncates_and_samples():
+    logger, stream = _make_logger('test_payload_filter', PayloadFilter(5, 2))
+    for i in range(4):
+        logger.debug("%s %s", i, Payload('x' * 10))
+    logger.debug("not sampled %s", 'x' * 10)
+    assert stream.getvalue().splitlines() == [
+        "0 xxxxx... [5 chars truncated]",
+        "2 xxxxx... [5 chars truncated]",
+        "not sampled xxxxxxxxxx",
+    ]
+
+
+def test_async_handler_writes_and_counts_drops():
+    stream = io.StringIO()
+    handler = AsyncLogHandler(logging.StreamHandler(stream), capacity=10, batch_size=3)
+    logger, _ = _make_logger('test_async_handler')
+    logger.handlers = [handler]
+    data = {'mutated': False}
+    logger.info("data: %s", data)
+    data['mutated'] = True
+    handler.close()
+    assert stream.getvalue().splitlines()[0] == "data: {'mutated': False}"
+    assert handler.stats()['written'] == 1
+    handler.queue.maxsize = 1
+    handler.queue.put(logging.makeLogRecord({'msg': 'fill'}))
+    logger.info("dropped")
+    assert handler.stats()['dropped'] == {'INFO': 1}
+
+
+def test_async_handler_skips_filtered_records():
+    stream = io.StringIO()
+    target = logging.StreamHandler(stream)
+    target.addFilter(lambda record: record.levelno >= logging.INFO)
+    handler = AsyncLogHandler(target)
+    logger, _ = _make_logger('test_async_handler_filtered')
+    logger.handlers = [handler]
+    logger.debug("filtered")
+    logger.info("written")
+    handler.close()
+    assert stream.getvalue() == "written\n"
+    assert handler.stats()['written'] == 1
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="requires fork")
+def test_async_handler_restarts_after_fork(tmpdir):
+    path = str(tmpdir.join('log'))
+    handler = AsyncLogHandler(logging.FileHandler(path))
+    logger, _ = _make_logger('test_async_handler_fork')
+    logger.handlers = [handler]
+    logger.info("parent")
+    pid = os.fork()
+    if not pid:
+        try:
+            logger.info("child")
+            handler.close()
+            os._exit(0 if handler.stats()['written'] == 1 else 1)
+        except BaseException:
+            os._exit(2)
+    _, status = os.waitpid(pid, 0)
+    handler.close()
+    assert status == 0
+    with open(path) as f:
+        assert sorted(f.read().splitlines()) == ['child', 'parent']
@@ -18,11 +18,32 @@ def test_update_permissions():
     ManagementCommands(args=['update_permissions'])
 
 
+def test_update_permissions_cache():
+    from zengine.auth.permissions import WFPermissionCache
+    from zengine.models import BPMNWorkflow
+    ManagementCommands(args=['update_permissions', '--force'])
+    wf = BPMNWorkflow.objects.get(name='crud')
+    cached = WFPermissionCache('crud').get()
+    assert cached['xml_id'] == wf.xml.key
+    assert ['crud', wf.description or 'crud', ''] in cached['permissions']
+
+
 def test_load_load_diagrams():
     ManagementCommands(args=['load_diagrams'])
     # ManagementCommands(args=['load_diagrams', '--wf_path', './diagrams/multi_user2.bpmn'])
 
 
+def test_load_diagrams_spec_cache():
+    from zengine.lib.cache import WFSpecCache
+    from zengine.models import BPMNWorkflow
+    ManagementCommands(args=['load_diagrams', '--force'])
+    wf = BPMNWorkflow.objects.get(name='crud')
+    assert wf.content_hash
+    spec = WFSpecCache('crud').get_spec(wf.content_hash)
+    assert spec is not None
+    assert WFSpecCache('crud').get_spec('outdated') is None
+
+
 def test_check_list():
     ManagementCommands(args=['check_list'])
 
@@ -0,0 +1,31 @@
+# -*-  coding: utf-8 -*-
+"""
+"""
+
+# Copyright (C) 2016 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+from collections import namedtuple
+
+from zengine.views.permissions import PermissionTree
+
+Perm = namedtuple('Perm', 'code name key')
+
+
+def test_permission_tree():
+    tree = PermissionTree.build([Perm('wf..task', 'Task', 'k1'),
+                                 Perm('wf2.lane.task', 'Task 2', 'k2'),
+                                 Perm('wf', 'Workflow', 'k3')])
+    assert tree.codes == ['wf', 'wf..task', 'wf2', 'wf2.lane', 'wf2.lane.task']
+    assert tree.parents == [-1, 0, -1, 2, 3]
+    checked = tree.get_checked(['wf.task', 'wf2.lane.task', 'missing'])
+    assert checked == {1, 4}
+    assert tree.keys == ['k3', 'k1', None, None, 'k2']
+    assert tree.get_checked_keys(['k1', 'k2', 'missing']) == checked
+    assert PermissionTree(**tree.serialize()).get_checked_keys(['k1', 'k2']) == checked
+    assert tree.format(checked) == PermissionTree(**tree.serialize()).format(checked)
+    assert tree.format(checked, depth=1)[1] == {
+        'id': 'wf2', 'name': 'wf2', 'checked': False, 'children': [], 'has_children': True}
+    assert tree.format(checked, tree.get_node('wf2.lane')) == [
+        {'id': 'wf2.lane.task', 'name': 'Task 2', 'checked': True, 'children': []}]
@@ -0,0 +1,65 @@
+# -*-  coding: utf-8 -*-
+"""
+"""
+
+# Copyright (C) 2015 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+from pyoko.conf import settings
+from zengine.lib.cache import RecentMessages, WriteBehindQueue, cache
+from zengine.lib.test_utils import BaseTestCase
+from zengine.messaging.model import Channel, Message
+from zengine.messaging.publisher import MESSAGE_QUEUE
+from zengine.models import User
+
+
+class TestCase(BaseTestCase):
+    def test_write_behind_messages(self):
+        usr = User.objects.get(username='super_user')
+        channel_key = usr.prv_exchange
+        queue = WriteBehindQueue(MESSAGE_QUEUE)
+        settings.MESSAGING_WRITE_BEHIND = True
+        try:
+            Message.save_queued(wait=True)
+            RecentMessages(channel_key).delete()
+
+            msg = Channel.add_message(channel_key, body='write behind', sender=usr,
+                                      receiver=usr)
+            assert queue.is_pending()
+            # queued message is listed, but buffer isn't filled without it
+            assert Channel.get_recent_messages(channel_key)[0]['key'] == msg.key
+            assert RecentMessages(channel_key).get_messages() is None
+
+            # message can be edited right after it's sent
+            self.prepare_client(user=usr)
+            resp = self.client.post(view='_zops_edit_message',
+                                    message={'key': msg.key, 'body': 'edited'})
+            assert resp.json['code'] == 200
+            assert not queue.is_pending()
+            assert Message.objects.get(msg.key).body == 'edited'
+
+            messages = Channel.get_recent_messages(channel_key)
+            assert messages[0]['key'] == msg.key
+            assert messages[0]['content'] == 'edited'
+            assert RecentMessages(channel_key).get_messages() is not None
+        finally:
+            settings.MESSAGING_WRITE_BEHIND = False
+
+    def test_write_behind_dead_letter(self):
+        queue = WriteBehindQueue('test_dead_letter')
+        cache.delete(queue.key, queue.dead_key)
+        queue.push([{'key': 'a'}, {'key': 'bad'}, {'key': 'b'}])
+        saved = []
+
+        def save(items):
+            if any(item['key'] == 'bad' for item in items):
+                raise ValueError("bad item")
+            saved.extend(items)
+
+        # bad item doesn't block the rest of the queue
+        assert queue.drain(save) == 2
+        assert [item['key'] for item in saved] == ['a', 'b']
+        assert [item['key'] for item in queue.get_dead_items()] == ['bad']
+        assert not queue.is_pending()
+        cache.delete(queue.dead_key)
@@ -6,9 +6,14 @@
 #
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
+from multiprocessing import Pool, cpu_count
+
 from SpiffWorkflow.bpmn.specs.UserTask import UserTask
 from SpiffWorkflow.bpmn.specs.ServiceTask import ServiceTask
 
+from zengine.config import settings
+from zengine.lib.cache import Cache
+
 
 class CustomPermission(object):
     """
@@ -44,47 +49,106 @@ class CustomPermission(object):
 PERM_REQ_TASK_TYPES = ('UserTask', 'ServiceTask')
 
 
-def _get_workflows():
-    from zengine.engine import ZEngine, WFCurrent
-    from zengine.models import BPMNWorkflow
+class WFPermissionCache(Cache):
+    """
+    Permissions of a workflow, cached with the key of it's diagram.
+
+    Since a new :class:`~zengine.models.workflow_manager.DiagramXML` is
+    created for each change of the diagram content, the key of the diagram
+    can be used as the content hash.
 
-    workflows = []
-    for wf in BPMNWorkflow.objects.all():
-        engine = ZEngine()
-        engine.current = WFCurrent(workflow_name=wf.name)
-        workflows.append(engine.load_or_create_workflow())
-    return workflows
+    Args:
+        wf_name: Name of the workflow.
+    """
+    PREFIX = 'WFPERM'
 
+    def __init__(self, wf_name):
+        super(WFPermissionCache, self).__init__(wf_name)
+
+
+def get_spec_permissions(wf_name, xml_content):
+    """
+    Parses the diagram and returns permissions of it's workflow, lanes and tasks.
+
+    Args:
+        wf_name: Name of the workflow.
+        xml_content: BPMN diagram.
+
+    Returns:
+        List of (code, name, description) tuples.
+    """
+    from zengine.lib.camunda_parser import ZopsSerializer
+    spec = ZopsSerializer().deserialize_workflow_spec(xml_content, wf_name)
+    wf_name = spec.name
+    wf_description = spec.description or spec.name
+    # Add workflow permission
+    permissions = [(wf_name, wf_description, "")]
+    # Add lane permissions
+    permissions.extend(list(_get_lane_permissions(permissions, spec)))
+    # Add task permissions
+    for name, task_spec in spec.task_specs.items():
+        # Skip spec objects like StartTask, ExclusiveGateway etc.
+        if not isinstance(task_spec, (UserTask, ServiceTask)):
+            continue
+        # `name` field of Modeler is used as `description` by SpiffWorkflow
+        description = task_spec.description
+        lane = task_spec.lane_id or ''
+        permissions.append(
+            # Code
+            ("%s.%s.%s" % (wf_name, lane, name),
+            # Name
+            "%s %s" % (description if description != "" else name, task_spec.__class__.__name__),
+            # Description
+            "")
+        )
+    return permissions
+
+
+def _get_spec_permissions(args):
+    return get_spec_permissions(*args)
 
 
 def _get_workflow_permissions(permission_list=None):
+    """
+    Collects permissions of all workflows.
+
+    Permissions are read from :class:`WFPermissionCache`, only the workflows
+    that have new diagrams are parsed. If there are more than
+    :attr:`~zengine.settings.PARALLEL_PARSE_THRESHOLD` of them,
+    they are parsed in parallel processes.
+    """
+    from zengine.models import BPMNWorkflow, DiagramXML
     # [('code_name', 'name', 'description'),...]
     permissions = permission_list or []
-    for wf in _get_workflows():
-        wf_name = wf.spec.name
-        wf_description = wf.spec.description or wf.spec.name
-        # Add workflow permission
-        permissions.append((wf_name, wf_description, ""))
-        # Add lane permissions
-        permissions.extend(list(_get_lane_permissions(permissions, wf.spec)))
-        # Add task permissions
-        for name, task_spec in wf.spec.task_specs.items():
-            # Skip spec objects like StartTask, ExclusiveGateway etc.
-            if not isinstance(task_spec, (UserTask, ServiceTask)):
-                continue
-            # `name` field of Modeler is used as `description` by SpiffWorkflow
-            description = task_spec.description
-            lane = task_spec.lane_id or ''
-            permissions.append(
-                # Code
-                ("%s.%s.%s" % (wf_name, lane, name),
-                # Name
-                "%s %s" % (description if description != "" else name, task_spec.__class__.__name__),
-                # Description
-                "")
-            )
+    changed = {}
+    for data, key in BPMNWorkflow.objects.all().data():
+        cached = WFPermissionCache(data['name']).get()
+        if cached and cached['xml_id'] == data.get('xml_id'):
+            permissions.extend(tuple(perm) for perm in cached['permissions'])
+        elif data.get('xml_id'):
+            changed[data['xml_id']] = data['name']
+    if not changed:
+        return permissions
+    diagrams = [(changed[key], data['body']) for data, key in
+                DiagramXML.objects.filter(key__in=list(changed)).set_params(
+                    rows=len(changed)).data()]
+    if len(diagrams) >= settings.PARALLEL_PARSE_THRESHOLD:
+        pool = Pool(min(cpu_count(), len(diagrams)))
+        try:
+            results = pool.map(_get_spec_permissions, diagrams)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [get_spec_permissions(*diagram) for diagram in diagrams]
+    xml_ids = dict((name, xml_id) for xml_id, name in changed.items())
+    for (wf_name, _), wf_permissions in zip(diagrams, results):
+        WFPermissionCache(wf_name).set({'xml_id': xml_ids[wf_name],
+                                        'permissions': wf_permissions})
+        permissions.extend(wf_permissions)
     return permissions
 
+
 def _get_lane_permissions(permissions, spec):
     # Using a set to get unique lanes
     return {('{}.{}'.format(spec.name, task.lane_id), task.lane, '')
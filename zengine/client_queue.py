@@ -6,13 +6,11 @@
 #
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
-import json
-
 from pyoko.conf import settings
 import pika
 import time
 from pika.exceptions import ConnectionClosed, ChannelClosed
-from zengine.lib.json_interface import ZEngineJSONEncoder
+from zengine.lib import json_interface
 
 
 BLOCKING_MQ_PARAMS = pika.ConnectionParameters(
@@ -22,7 +20,7 @@ BLOCKING_MQ_PARAMS = pika.ConnectionParameters(
     heartbeat_interval=0,
     credentials=pika.PlainCredentials(settings.MQ_USER, settings.MQ_PASS)
 )
-from zengine.log import log
+from zengine.log import log, Payload
 
 def get_mq_connection():
     connection = pika.BlockingConnection(BLOCKING_MQ_PARAMS)
@@ -67,9 +65,9 @@ class ClientQueue(object):
             sess_id string: Session id
             message dict: Message object.
         """
-        msg = json.dumps(message, cls=ZEngineJSONEncoder)
-        log.debug("Sending following message to %s queue through default exchange:\n%s" % (
-            sess_id, msg))
+        msg = json_interface.dumps(message)
+        log.debug("Sending following message to %s queue through default exchange:\n%s",
+                  sess_id, Payload(msg))
         self.get_channel().publish(exchange='', routing_key=sess_id, body=msg)
 
     def send_to_prv_exchange(self, user_id, message=None):
@@ -82,7 +80,46 @@ class ClientQueue(object):
 
         """
         exchange = 'prv_%s' % user_id.lower()
-        msg = json.dumps(message, cls=ZEngineJSONEncoder)
-        log.debug("Sending following users \"%s\" exchange:\n%s " % (exchange, msg))
+        msg = json_interface.dumps(message)
+        log.debug("Sending following users \"%s\" exchange:\n%s ", exchange, Payload(msg))
         self.get_channel().publish(exchange=exchange, routing_key='', body=msg)
 
+
+
+class JobPublisher(object):
+    """
+    Triggers background jobs which are registered
+    with :func:`~zengine.lib.decorators.bg_job` decorator.
+
+    .. code-block:: python
+
+        JobPublisher.publish('_zops_bulk_subscribe', channel_key=key, members=[...])
+    """
+    mq_connection = None
+    mq_channel = None
+
+    @classmethod
+    def _connect_mq(cls):
+        if cls.mq_connection is None or cls.mq_connection.is_closed:
+            cls.mq_connection, cls.mq_channel = get_mq_connection()
+        return cls.mq_channel
+
+    @classmethod
+    def publish(cls, job, **data):
+        """
+        Publishes the job to workers.
+
+        Args:
+            job (str): Name of the job.
+            **data: JSON serializable job arguments.
+        """
+        data['job'] = job
+        _data = {'exchange': 'input_exc',
+                 'routing_key': '',
+                 'properties': pika.BasicProperties(headers={'_zops_source': 'Internal',
+                                                             '_zops_remote_ip': ''}),
+                 'body': json_interface.dumps({'data': data})}
+        try:
+            cls.mq_channel.basic_publish(**_data)
+        except (AttributeError, ConnectionClosed, ChannelClosed):
+            cls._connect_mq().basic_publish(**_data)
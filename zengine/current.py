@@ -25,7 +25,7 @@ from zengine.config import settings
 from zengine.lib.utils import merge_truthy
 from zengine.lib import translation
 from zengine.lib.cache import Session
-from zengine.log import log
+from zengine.log import log, Payload
 from zengine.models import WFCache
 from zengine.models import WFInstance
 
@@ -73,7 +73,7 @@ class Current(object):
         self.auth = lazy_object_proxy.Proxy(lambda: AuthBackend(self))
         self.user = lazy_object_proxy.Proxy(lambda: self.auth.get_user())
         self.role = lazy_object_proxy.Proxy(lambda: self.auth.get_role())
-        log.debug("\n\nINPUT DATA: %s" % self.input)
+        log.debug("\n\nINPUT DATA: %s", Payload(self.input))
         self.permissions = []
 
     @lazy_property
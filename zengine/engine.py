@@ -10,10 +10,9 @@ Zengine's engine!
 from __future__ import division
 from __future__ import print_function, absolute_import, division
 
-import importlib
+import functools
 import os
 import sys
-import traceback
 import lazy_object_proxy
 from SpiffWorkflow import Task
 from SpiffWorkflow.bpmn.BpmnWorkflow import BpmnWorkflow
@@ -25,10 +24,12 @@ from pyoko.model import super_context
 from zengine.auth.permissions import PERM_REQ_TASK_TYPES
 from zengine.config import settings
 from zengine.current import WFCurrent
+from zengine.lib.activities import ActivityRegistry
+from zengine.lib.cache import WFSpecCache
 from zengine.lib.camunda_parser import ZopsSerializer
 from zengine.lib.exceptions import HTTPError
 from zengine.lib import translation
-from zengine.log import log
+from zengine.log import log, Payload
 from zengine.models import BPMNWorkflow, ObjectDoesNotExist
 from zengine.models.workflow_manager import TaskInvitation, WFCache
 
@@ -57,7 +58,7 @@ class ZEngine(object):
     def __init__(self):
         self.use_compact_serializer = True
         # self.current = None
-        self.wf_activities = {}
+        self.activities = ActivityRegistry()
         self.wf_state = {}
         self.workflow = BpmnWorkflow
         self.workflow_spec_cache = {}
@@ -70,7 +71,7 @@ class ZEngine(object):
         are_we = False
         if self.current.task:
             are_we = self.current.task.workflow.name != self.current.workflow.name
-        self.current.log.debug("Are We in subprocess: %s" % are_we)
+        self.current.log.debug("Are We in subprocess: %s", are_we)
         return are_we
 
     def save_workflow_to_cache(self, serialized_wf_instance):
@@ -98,7 +99,7 @@ class ZEngine(object):
         if self.current.lane_id:
             self.current.pool[self.current.lane_id] = self.current.role.key
         self.wf_state['pool'] = self.current.pool
-        self.current.log.debug("POOL Content before WF Save: %s" % self.current.pool)
+        self.current.log.debug("POOL Content before WF Save: %s", Payload(self.current.pool))
         self.current.wf_cache.save(self.wf_state)
 
     def get_pool_context(self):
@@ -194,12 +195,14 @@ class ZEngine(object):
     def get_worfklow_spec(self):
         """
         Generates and caches the workflow spec package from
-        BPMN diagrams that read from disk
+        BPMN diagrams that read from DB.
+
+        Specs are cached in-process and in the shared
+        :class:`~zengine.lib.cache.WFSpecCache`.
 
         Returns:
             SpiffWorkflow Spec object.
         """
-        # TODO: convert from in-process to redis based caching
         if self.current.workflow_name not in self.workflow_spec_cache:
             # path = self.find_workflow_path()
             # spec_package = InMemoryPackager.package_in_memory(self.current.workflow_name, path)
@@ -211,8 +214,15 @@ class ZEngine(object):
                 self.current.wf_object = BPMNWorkflow.objects.get(name='not_found')
                 self.current.task_data['non-existent-wf'] = self.current.workflow_name
                 self.current.workflow_name = 'not_found'
-            xml_content = self.current.wf_object.xml.body
-            spec = ZopsSerializer().deserialize_workflow_spec(xml_content, self.current.workflow_name)
+            content_hash = self.current.wf_object.content_hash
+            spec_cache = WFSpecCache(self.current.workflow_name)
+            spec = spec_cache.get_spec(content_hash)
+            if spec is None:
+                xml_content = self.current.wf_object.xml.body
+                spec = ZopsSerializer().deserialize_workflow_spec(xml_content,
+                                                                  self.current.workflow_name)
+                if content_hash:
+                    spec_cache.set_spec(content_hash, spec)
 
             spec.wf_id = self.current.wf_object.key
             self.workflow_spec_cache[self.current.workflow_name] = spec
@@ -277,41 +287,73 @@ class ZEngine(object):
             WFInit = get_object_from_path(settings.WF_INITIAL_VALUES)()
             WFInit.assign_wf_initial_values(self.current)
 
-        log_msg = ("\n\n::::::::::: ENGINE STARTED :::::::::::\n"
-                   "\tWF: %s (Possible) TASK:%s\n"
-                   "\tCMD:%s\n"
-                   "\tSUBCMD:%s" % (
-                       self.workflow.name,
-                       self.workflow.get_tasks(Task.READY),
-                       self.current.input.get('cmd'), self.current.input.get('subcmd')))
-        log.debug(log_msg)
-        sys._zops_wf_state_log = log_msg
+        # ready tasks are taken now, workflow advances before an error report is rendered.
+        # summary is formatted only if it's logged or needed for an error report
+        sys._zops_wf_state_log = Payload(functools.partial(
+            self.generate_start_log, self.workflow.name,
+            repr(self.workflow.get_tasks(Task.READY)),
+            self.current.input.get('cmd'), self.current.input.get('subcmd')))
+        log.debug("%s", sys._zops_wf_state_log)
         self.current.workflow = self.workflow
 
-    def generate_wf_state_log(self):
+    @staticmethod
+    def generate_start_log(wf_name, ready_tasks, cmd, subcmd):
+        """
+        Summarizes the workflow and input at the beginning of the request.
+        """
+        return ("\n\n::::::::::: ENGINE STARTED :::::::::::\n"
+                "\tWF: %s (Possible) TASK:%s\n"
+                "\tCMD:%s\n"
+                "\tSUBCMD:%s" % (
+                    wf_name, ready_tasks, cmd, subcmd))
+
+    def get_wf_state(self):
+        """
+        Snapshot of the fields logged by :meth:`generate_wf_state_log`.
+        """
+        return {
+            'workflow_name': self.current.workflow_name,
+            'wf_name': self.current.workflow.name,
+            'task_name': self.current.task_name,
+            'task_type': self.current.task_type,
+            # shallow copy, values are formatted later
+            'task_data': dict(self.current.task_data),
+            'activity': self.current.activity,
+            'pool': dict(self.current.pool),
+            'in_external': self.wf_state['in_external'],
+            'lane_name': self.current.lane_name,
+            'token': self.current.token,
+        }
+
+    def generate_wf_state_log(self, state=None):
         """
         Logs the state of workflow and content of task_data.
+
+        Args:
+            state (dict): Snapshot taken by :meth:`get_wf_state`. Current state
+                is used if not given.
         """
+        state = state or self.get_wf_state()
         output = '\n- - - - - -\n'
-        output += "WORKFLOW: %s ( %s )" % (self.current.workflow_name.upper(),
-                                           self.current.workflow.name)
+        output += "WORKFLOW: %s ( %s )" % (state['workflow_name'].upper(), state['wf_name'])
 
-        output += "\nTASK: %s ( %s )\n" % (self.current.task_name, self.current.task_type)
+        output += "\nTASK: %s ( %s )\n" % (state['task_name'], state['task_type'])
         output += "DATA:"
-        for k, v in self.current.task_data.items():
+        for k, v in state['task_data'].items():
             if v:
                 output += "\n\t%s: %s" % (k, v)
         output += "\nCURRENT:"
-        output += "\n\tACTIVITY: %s" % self.current.activity
-        output += "\n\tPOOL: %s" % self.current.pool
-        output += "\n\tIN EXTERNAL: %s" % self.wf_state['in_external']
-        output += "\n\tLANE: %s" % self.current.lane_name
-        output += "\n\tTOKEN: %s" % self.current.token
-        sys._zops_wf_state_log = output
+        output += "\n\tACTIVITY: %s" % state['activity']
+        output += "\n\tPOOL: %s" % state['pool']
+        output += "\n\tIN EXTERNAL: %s" % state['in_external']
+        output += "\n\tLANE: %s" % state['lane_name']
+        output += "\n\tTOKEN: %s" % state['token']
         return output
 
     def log_wf_state(self):
-        log.debug(self.generate_wf_state_log() + "\n= = = = = =\n")
+        sys._zops_wf_state_log = Payload(functools.partial(self.generate_wf_state_log,
+                                                           self.get_wf_state()))
+        log.debug("%s\n= = = = = =\n", sys._zops_wf_state_log)
 
     def switch_from_external_to_main_wf(self):
 
@@ -576,71 +618,9 @@ class ZEngine(object):
         """
         activity = self.current.activity
         if activity:
-            if activity not in self.wf_activities:
-                self._load_activity(activity)
-            self.current.log.debug(
-                "Calling Activity %s from %s" % (activity, self.wf_activities[activity]))
-            self.wf_activities[self.current.activity](self.current)
-
-    def _import_object(self, path, look_for_cls_method):
-        """
-        Imports the module that contains the referenced method.
-
-        Args:
-            path: python path of class/function
-            look_for_cls_method (bool): If True, treat the last part of path as class method.
-
-        Returns:
-            Tuple. (class object, class name, method to be called)
-
-        """
-        last_nth = 2 if look_for_cls_method else 1
-        path = path.split('.')
-        module_path = '.'.join(path[:-last_nth])
-        class_name = path[-last_nth]
-        module = importlib.import_module(module_path)
-        if look_for_cls_method and path[-last_nth:][0] == path[-last_nth]:
-            class_method = path[-last_nth:][1]
-        else:
-            class_method = None
-        return getattr(module, class_name), class_name, class_method
-
-    def _load_activity(self, activity):
-        """
-        Iterates trough the all enabled `~zengine.settings.ACTIVITY_MODULES_IMPORT_PATHS` to find the given path.
-        """
-        fpths = []
-        full_path = ''
-        errors = []
-        paths = settings.ACTIVITY_MODULES_IMPORT_PATHS
-        number_of_paths = len(paths)
-        for index_no in range(number_of_paths):
-            full_path = "%s.%s" % (paths[index_no], activity)
-            for look4kls in (0, 1):
-                try:
-                    self.current.log.info("try to load from %s[%s]" % (full_path, look4kls))
-                    kls, cls_name, cls_method = self._import_object(full_path, look4kls)
-                    if cls_method:
-                        self.current.log.info("WILLCall %s(current).%s()" % (kls, cls_method))
-                        self.wf_activities[activity] = lambda crnt: getattr(kls(crnt), cls_method)()
-                    else:
-                        self.wf_activities[activity] = kls
-                    return
-                except (ImportError, AttributeError):
-                    fpths.append(full_path)
-                    errmsg = "{activity} not found under these paths:\n\n >>> {paths} \n\n" \
-                             "Error Messages:\n {errors}"
-                    errors.append("\n========================================================>\n"
-                                  "| PATH | %s"
-                                  "\n========================================================>\n\n"
-                                  "%s" % (full_path, traceback.format_exc()))
-                    assert index_no != number_of_paths - 1, errmsg.format(activity=activity,
-                                                                          paths='\n >>> '.join(
-                                                                              set(fpths)),
-                                                                          errors='\n\n'.join(errors)
-                                                                          )
-                except:
-                    self.current.log.exception("Cannot found the %s" % activity)
+            func = self.activities.get(activity)
+            self.current.log.debug("Calling Activity %s from %s", activity, func)
+            func(self.current)
 
     def check_for_authentication(self):
         """
@@ -670,14 +650,14 @@ class ZEngine(object):
         """
         # TODO: Cache lane_data in app memory
         if self.current.lane_permission:
-            log.debug("HAS LANE PERM: %s" % self.current.lane_permission)
+            log.debug("HAS LANE PERM: %s", self.current.lane_permission)
             perm = self.current.lane_permission
             if not self.current.has_permission(perm):
                 raise HTTPError(403, "You don't have required lane permission: %s" % perm)
 
         if self.current.lane_relations:
             context = self.get_pool_context()
-            log.debug("HAS LANE RELS: %s" % self.current.lane_relations)
+            log.debug("HAS LANE RELS: %s", self.current.lane_relations)
             try:
                 cond_result = eval(self.current.lane_relations, context)
             except:
@@ -703,7 +683,7 @@ class ZEngine(object):
             permission = "%s.%s.%s" % (self.current.workflow_name, lane, self.current.task_name)
         else:
             permission = self.current.workflow_name
-        log.debug("CHECK PERM: %s" % permission)
+        log.debug("CHECK PERM: %s", permission)
 
         if (self.current.task_type not in PERM_REQ_TASK_TYPES or
                 permission.startswith(tuple(settings.ANONYMOUS_WORKFLOWS)) or
@@ -711,7 +691,7 @@ class ZEngine(object):
             return
         # FIXME:needs hardening
 
-        log.debug("REQUIRE PERM: %s" % permission)
+        log.debug("REQUIRE PERM: %s", permission)
         if not self.current.has_permission(permission):
             raise HTTPError(403, "You don't have required permission: %s" % permission)
 
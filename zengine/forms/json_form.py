@@ -15,15 +15,21 @@ three main goals:
 #
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
+from collections import OrderedDict
 from uuid import uuid4
 import six
+from pyoko import ListNode
+from pyoko.lib.utils import un_camel_id
 from pyoko.model import Model
 from pyoko.fields import BaseField
+from zengine.config import settings
 from zengine.forms.fields import Button
 from zengine.lib.cache import Cache
+from zengine.lib.catalog_data import CatalogData
 from zengine.lib.exceptions import FormValidationError
 from .model_form import ModelForm
 from datetime import datetime
+from zengine.lib.translation import InstalledLocale
 
 
 class FormCache(Cache):
@@ -43,6 +49,99 @@ class FormCache(Cache):
         super(FormCache, self).__init__(form_id)
 
 
+class _Identity(object):
+    """
+    Hashes and compares the wrapped object by it's identity.
+
+    Keeps a reference to the object, so it's id can't be
+    reused by another object while it's part of a cache key.
+    """
+    __slots__ = ('obj',)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __hash__(self):
+        return id(self.obj)
+
+    def __eq__(self, other):
+        return isinstance(other, _Identity) and other.obj is self.obj
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class FormLayout(object):
+    """
+    Static, value independent parts of a serialized form.
+
+    Attributes:
+        result (dict): Serialized form without "model" and help text.
+        items (list): (name, type, date format, source, field name) tuples
+            to read values of form items.
+        links (list): (name, model name) tuples of linked model items.
+        catalogs (set): Catalog data keys used as choices.
+        cacheable (bool): False if any choices are generated by a callable.
+    """
+
+    def __init__(self):
+        self.result = {
+            "schema": {
+                "properties": {},
+                "required": []
+            },
+            "form": [],
+        }
+        self.items = []
+        self.links = []
+        self.catalogs = set()
+        self.cacheable = True
+
+
+class FormLayoutCache(object):
+    """
+    In-process LRU cache of compiled form layouts.
+
+    Size of the cache is controlled by
+    :attr:`~zengine.settings.FORM_LAYOUT_CACHE_SIZE` setting.
+    """
+
+    def __init__(self):
+        self._layouts = OrderedDict()
+
+    def get(self, key):
+        layout = self._layouts.pop(key, None)
+        if layout is not None:
+            self._layouts[key] = layout
+        return layout
+
+    def set(self, key, layout):
+        max_size = settings.FORM_LAYOUT_CACHE_SIZE
+        if not max_size:
+            return
+        self._layouts[key] = layout
+        while len(self._layouts) > max_size:
+            self._layouts.popitem(last=False)
+
+    def invalidate(self, catalog=None):
+        """
+        Removes compiled layouts from cache.
+
+        Args:
+            catalog (str): Only remove the layouts which use this catalog data
+                as choices. If not given, all layouts will be removed.
+        """
+        if catalog is None:
+            self._layouts.clear()
+            return
+        for key, layout in list(self._layouts.items()):
+            if catalog in layout.catalogs:
+                del self._layouts[key]
+
+    def __len__(self):
+        return len(self._layouts)
+
+
 class JsonForm(ModelForm):
     """
     A base class for building customizable forms with pyoko fields and models.
@@ -76,6 +175,10 @@ class JsonForm(ModelForm):
                          'allow_add_listnode',
                          'allow_actions']
 
+    #: Compiled layouts of all forms. Only values are re-read
+    #: on each serialization of an already compiled form.
+    layout_cache = FormLayoutCache()
+
     def __init__(self, *args, **kwargs):
         self.context = kwargs.get('current')
         # Fake method to emulate pyoko model API.
@@ -223,81 +326,134 @@ class JsonForm(ModelForm):
                     }
                   }
                 }
-        """
-        result = {
-            "schema": {
-                "title": self.title,
-                "type": "object",
-                "properties": {},
-                "required": []
-            },
-            "form": [
-                {
-                    "type": "help",
-                    "helpvalue": self.help_text
-                }
-            ],
-            "model": {}
-        }
-        for itm in self.META_TO_FORM_ROOT:
-            if itm in self.Meta.__dict__:
-                result[itm] = self.Meta.__dict__[itm]
 
-        if self._model.is_in_db():
-            result["model"]['object_key'] = self._model.key
-            result["model"]['model_type'] = self._model.__class__.__name__
-            result["model"]['unicode'] = six.text_type(self._model)
-
-        # if form intentionally marked as fillable from task data by assigning False to always_blank
-        # field in Meta class, form_data is retrieved from task_data if exist in else None
-        form_data = None
-        if not self.Meta.always_blank:
-            form_data = self.context.task_data.get(self.__class__.__name__, None)
-
-        for itm in self._serialize():
-            item_props = {'type': itm['type'], 'title': itm['title']}
+        Static parts of the form are compiled once and kept in
+        :attr:`layout_cache`, only the values are read on each call.
 
-            if not itm.get('value') and 'kwargs' in itm and 'value' in itm['kwargs']:
-                itm['value'] = itm['kwargs'].pop('value')
+        Note:
+            Schema properties and form entries are shared with the cached
+            layout. To change one of them, replace it with a modified copy,
+            e.g. ``props['foo'] = dict(props['foo'], widget='bar')``.
+        """
+        self.process_form()
+        key = self._get_layout_key()
+        layout = self.layout_cache.get(key)
+        if layout is None:
+            layout = self._compile_layout()
+            if layout.cacheable:
+                self.layout_cache.set(key, layout)
+        result = self._fill_layout(layout)
+        self._cache_form_details(result)
+        return result
 
-            if 'kwargs' in itm and 'widget' in itm['kwargs']:
-                item_props['widget'] = itm['kwargs'].pop('widget')
+    def _get_layout_key(self):
+        """
+        Builds a hashable key from everything that shapes the static parts of
+        the serialized form: form and model classes, active languages, titles,
+        include / exclude lists, instance level fields, choices and
+        unpermitted fields of the model.
 
-            if form_data:
-                if form_data[itm['name']] and (itm['type'] == 'date' or itm['type'] == 'datetime'):
-                    value_to_serialize = datetime.strptime(
-                        form_data[itm['name']], itm['format'])
-                else:
-                    value_to_serialize = form_data[itm['name']]
-                value = self._serialize_value(value_to_serialize)
-                if itm['type'] == 'button':
-                    value = None
-            # if form_data is empty, value will be None, so it is needed to fill the form from model
-            # or leave empty
+        Returns:
+            Tuple.
+        """
+        fields = []
+        for name, field in self._ordered_fields:
+            if name in self.__dict__:
+                # instance level fields may differ between form instances
+                sig = (name, field.__class__, six.text_type(field.title), field.required,
+                       tuple(sorted((k, repr(v)) for k, v in field.kwargs.items()
+                                    if k != 'value')))
             else:
-                # if itm['value'] is not None returns itm['value']
-                # else itm['default']
-                if itm['value'] is not None:
-                    value = itm['value']
-                else:
-                    value = itm['default']
+                sig = name
+            choices = getattr(field, 'choices', None)
+            if isinstance(choices, (list, tuple)):
+                choices = _Identity(choices)
+            fields.append((sig, choices))
+        links = tuple(sorted((k, v.__class__) for k, v in self.__dict__.items()
+                             if isinstance(v, Model) and not k.startswith('_model')))
+        unpermitted = ()
+        if (isinstance(self._model, Model) and self._model._context and
+                getattr(self._model.Meta, 'field_permissions', None)):
+            unpermitted = tuple(self._model.get_unpermitted_fields())
+        return (self.__class__,
+                self._model.__class__,
+                InstalledLocale.language,
+                CatalogData.CURRENT_LANG_CODE,
+                six.text_type(self.title),
+                six.text_type(self.help_text),
+                tuple(self.exclude),
+                tuple(self.include),
+                tuple(sorted(self.customize_types.items())),
+                tuple(self._config.get(k) for k in ('fields', 'nodes', 'models', 'list_nodes')),
+                tuple(fields),
+                links,
+                unpermitted)
+
+    def _compile_layout(self):
+        """
+        Builds the static parts of the serialized form (schema, form layout,
+        required fields) and records where the value of each item
+        will be read from.
+
+        Returns:
+            :class:`FormLayout` instance.
+        """
+        layout = FormLayout()
+        for itm in self.META_TO_FORM_ROOT:
+            if itm in self.Meta.__dict__:
+                layout.result[itm] = self.Meta.__dict__[itm]
+
+        link_fields = {}
+        for source, obj in (('model', self._model), ('form', self)):
+            for lnk in obj.get_links(is_set=False):
+                link_fields[(source, un_camel_id(lnk['field']))] = lnk['field']
+
+        # _get_nodes creates an item in empty list nodes to read their schema.
+        empty_list_nodes = [name for name in self._model._nodes
+                            if isinstance(getattr(self._model, name), ListNode) and
+                            not len(getattr(self._model, name))]
+
+        # get_choices records the choice sources of compiled layout
+        self._compiling_layout = layout
+        try:
+            self._compile_items(layout, link_fields)
+        finally:
+            self._compiling_layout = None
+
+        for name in empty_list_nodes:
+            getattr(self._model, name).clear()
+        return layout
+
+    def _compile_items(self, layout, link_fields):
+        result = layout.result
+        for source, itm in self._serialize_items():
+            name = itm['name']
+            kwargs = itm.get('kwargs', {})
+            item_props = {'type': itm['type'], 'title': itm['title']}
 
-            result["model"][itm['name']] = value
+            if 'widget' in kwargs:
+                item_props['widget'] = kwargs['widget']
 
             if itm['type'] == 'model':
                 item_props['model_name'] = itm['model_name']
+                layout.items.append((name, itm['type'], None, source + '_link',
+                                     link_fields.get((source, name))))
+                layout.links.append((name, itm['model_name']))
+            else:
+                layout.items.append((name, itm['type'], itm.get('format'), source, name))
 
             if itm['type'] not in ['ListNode', 'model', 'Node']:
-                if 'hidden' in itm['kwargs']:
+                if 'hidden' in kwargs:
                     # we're simulating HTML's hidden form fields
                     # by just setting it in "model" dict and bypassing other parts
                     continue
                 else:
-                    item_props.update(itm['kwargs'])
+                    item_props.update((k, v) for k, v in kwargs.items()
+                                      if k not in ('value', 'widget'))
             if itm.get('choices'):
                 self._handle_choices(itm, item_props, result)
             else:
-                result["form"].append(itm['name'])
+                result["form"].append(name)
 
             if 'help_text' in itm:
                 item_props['help_text'] = itm['help_text']
@@ -305,35 +461,127 @@ class JsonForm(ModelForm):
             if 'schema' in itm:
                 item_props['schema'] = itm['schema']
 
-            # this adds default directives for building
-            # add and list views of linked models
-            if item_props['type'] == 'model':
-                # this control for passing test.
-                # object gets context but do not use it. why is it for?
-                if self.context:
-                    if self.context.has_permission("%s.select_list" % item_props['model_name']):
-                        item_props.update({
-                            'list_cmd': 'select_list',
-                            'wf': 'crud',
-                        })
-                    if self.context.has_permission("%s.add_edit_form" % item_props['model_name']):
-                        item_props.update({
-                            'add_cmd': 'add_edit_form',
-                            'wf': 'crud',
-                        })
+            result["schema"]["properties"][name] = item_props
+
+            if itm['required']:
+                result["schema"]["required"].append(name)
+
+    def _fill_layout(self, layout):
+        """
+        Creates the serialized form from a compiled layout
+        by filling in the values of current form / model instance
+        and the permission dependent link directives.
+
+        Args:
+            layout (:class:`FormLayout`): Compiled form layout.
+
+        Returns:
+            Dict. Serialized form.
+        """
+        cached = layout.result
+        # nodes of the cached layout are shared by all serialized forms.
+        # only the containers are copied, nodes are replaced with a copy when they're changed
+        properties = dict(cached["schema"]["properties"])
+        result = dict(cached)
+        result["schema"] = {
+            "title": self.title,
+            "type": "object",
+            "properties": properties,
+            "required": list(cached["schema"]["required"])
+        }
+        result["form"] = [{"type": "help", "helpvalue": self.help_text}] + cached["form"]
+        result["model"] = {}
+
+        if self._model.is_in_db():
+            result["model"]['object_key'] = self._model.key
+            result["model"]['model_type'] = self._model.__class__.__name__
+            result["model"]['unicode'] = six.text_type(self._model)
+
+        # if form intentionally marked as fillable from task data by assigning False to always_blank
+        # field in Meta class, form_data is retrieved from task_data if exist in else None
+        form_data = None
+        if not self.Meta.always_blank:
+            form_data = self.context.task_data.get(self.__class__.__name__, None)
+
+        for name, typ, fmt, source, ref in layout.items:
+            if form_data:
+                if form_data[name] and (typ == 'date' or typ == 'datetime'):
+                    value_to_serialize = datetime.strptime(form_data[name], fmt)
                 else:
+                    value_to_serialize = form_data[name]
+                value = self._serialize_value(value_to_serialize)
+                if typ == 'button':
+                    value = None
+            # if form_data is empty, value will be None, so it is needed to fill the form from model
+            # or leave empty
+            else:
+                value = self._get_item_value(source, ref)
+            result["model"][name] = value
+
+        # this adds default directives for building
+        # add and list views of linked models
+        for name, model_name in layout.links:
+            item_props = properties[name] = dict(properties[name])
+            # this control for passing test.
+            # object gets context but do not use it. why is it for?
+            if self.context:
+                if self.context.has_permission("%s.select_list" % model_name):
                     item_props.update({
                         'list_cmd': 'select_list',
+                        'wf': 'crud',
+                    })
+                if self.context.has_permission("%s.add_edit_form" % model_name):
+                    item_props.update({
                         'add_cmd': 'add_edit_form',
-                        'wf': 'crud'
+                        'wf': 'crud',
                     })
-            result["schema"]["properties"][itm['name']] = item_props
+            else:
+                item_props.update({
+                    'list_cmd': 'select_list',
+                    'add_cmd': 'add_edit_form',
+                    'wf': 'crud'
+                })
+        return result
+
+    def _get_item_value(self, source, ref):
+        """
+        Reads the current value of a form item.
 
+        Args:
+            source (str): Source of the item, see :meth:`_serialize_items`.
+                Linked models have "_link" suffix.
+            ref (str): Name of the field, link or node.
 
-            if itm['required']:
-                result["schema"]["required"].append(itm['name'])
-        self._cache_form_details(result)
-        return result
+        Returns:
+            Serialized value.
+        """
+        if source == 'node':
+            instance_node = getattr(self._model, ref)
+            if isinstance(instance_node, ListNode):
+                return self._node_data(instance_node, ref) if len(instance_node) else None
+            if self._model.is_in_db():
+                return self._node_data([instance_node], ref)[0]
+            return None
+        obj = self if source.startswith('form') else self._model
+        if source.endswith('_link'):
+            return getattr(obj, ref).key
+        field = obj._fields[ref]
+        value = self._serialize_value(getattr(obj, ref))
+        if not value and 'value' in field.kwargs:
+            value = field.kwargs['value']
+        if value is None:
+            value = field.default() if callable(field.default) else field.default
+        return value
+
+    def get_choices(self, choices):
+        layout = getattr(self, '_compiling_layout', None)
+        if layout is not None:
+            if callable(choices):
+                # can't know when the result of a callable changes
+                layout.cacheable = False
+            elif not isinstance(choices, (list, tuple)):
+                layout.catalogs.add(choices)
+        return super(JsonForm, self).get_choices(choices)
 
     def deserialize(self, form_data, do_validation=True):
         if form_data and do_validation:
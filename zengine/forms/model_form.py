@@ -222,6 +222,20 @@ class ModelForm(object):
                   'type': 'boolean',
                   'value': True}]
         """
+        return [itm for source, itm in self._serialize_items(readable)]
+
+    def _serialize_items(self, readable=False):
+        """
+        Works like :meth:`_serialize` but pairs each item with
+        the name of it's source object.
+
+        Args:
+            readable (bool): creates human readable output.
+
+        Returns:
+            List of (source, item) tuples. Source is one of
+            ``'model'`` (self._model), ``'form'`` (self) or ``'node'``.
+        """
         self.process_form()
         self.readable = readable
         result = []
@@ -229,6 +243,7 @@ class ModelForm(object):
             self._get_fields(result, self._model)
         if self._config['models']:
             self._get_models(result, self._model)
+        sources = ['model'] * len(result)
         if self is not self._model:  # to allow additional fields
             try:
                 self._get_fields(result, self)
@@ -237,11 +252,13 @@ class ModelForm(object):
             except AttributeError:
                 # TODO: all "forms" of world, unite!
                 pass
+        sources.extend(['form'] * (len(result) - len(sources)))
 
         if self._config['nodes'] or self._config['list_nodes']:
             self._get_nodes(result)
+        sources.extend(['node'] * (len(result) - len(sources)))
 
-        return result
+        return list(zip(sources, result))
 
     def _filter_out(self, name):
         """
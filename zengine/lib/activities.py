@@ -0,0 +1,185 @@
+# -*-  coding: utf-8 -*-
+"""
+Activity dispatch table of workflow engine.
+
+Activities (``service_class`` references of workflow tasks) are searched under
+:attr:`~zengine.settings.ACTIVITY_MODULES_IMPORT_PATHS` only once. Found
+locations are kept in redis, so restarted workers import them directly
+instead of trying every import path.
+
+.. code-block:: python
+
+    from zengine.lib.activities import ActivityRegistry
+
+    activities = ActivityRegistry()
+    activities.preload()
+    activities.get('crud.CrudView')(current)
+
+:meth:`ActivityRegistry.register_specs` resolves all activities of
+given workflow specs at once, e.g. while loading diagrams.
+"""
+
+# Copyright (C) 2015 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+import hashlib
+import importlib
+
+import six
+
+from zengine.config import settings
+from zengine.lib import json_interface
+from zengine.lib.cache import Cache, cache
+from zengine.lib.exceptions import ConfigurationError
+from zengine.log import log
+
+
+class ActivityLocations(Cache):
+    """
+    Activity name -> (module path, attribute name, class method name) locations,
+    stored as a redis hash.
+
+    Key includes the digest of import paths, since locations depend on them.
+    """
+    PREFIX = 'ACTLOC'
+
+    def __init__(self, import_paths=None):
+        digest = hashlib.sha1(','.join(import_paths or settings.ACTIVITY_MODULES_IMPORT_PATHS)
+                              .encode('utf-8')).hexdigest()[:10]
+        super(ActivityLocations, self).__init__(digest)
+
+    def get_all(self):
+        return dict((k.decode('utf-8') if isinstance(k, bytes) else k, json_interface.loads(v))
+                    for k, v in cache.hgetall(self.key).items())
+
+    def add(self, activity, location):
+        cache.hset(self.key, activity, json_interface.dumps(location))
+
+    def remove(self, activity):
+        cache.hdel(self.key, activity)
+
+
+def get_spec_activities(spec):
+    """
+    Activities of a workflow spec.
+
+    Args:
+        spec: SpiffWorkflow spec object.
+
+    Returns:
+        Set of ``service_class`` references.
+    """
+    return set(task_spec.service_class for task_spec in spec.task_specs.values()
+               if getattr(task_spec, 'service_class', None))
+
+
+def import_activity(module_path, name, method=None):
+    """
+    Imports an activity from it's location.
+
+    Args:
+        module_path (str): Python path of the module.
+        name (str): Name of the function or class.
+        method (str): Method to be called on class instance, if any.
+
+    Returns:
+        Callable which takes the ``current`` object.
+    """
+    obj = getattr(importlib.import_module(module_path), name)
+    if method:
+        if not isinstance(obj, six.class_types):
+            raise AttributeError("%s is not a class" % name)
+        getattr(obj, method)
+        return lambda current: getattr(obj(current), method)()
+    return obj
+
+
+def find_activity(activity, import_paths=None):
+    """
+    Searches the activity under each import path, first as a function or
+    class, then as a class method.
+
+    Args:
+        activity (str): ``service_class`` reference, e.g. "crud.CrudView".
+        import_paths (list): Defaults to ACTIVITY_MODULES_IMPORT_PATHS.
+
+    Returns:
+        (location, callable) tuple.
+
+    Raises:
+        ConfigurationError: If activity can't be found.
+    """
+    errors = []
+    for import_path in import_paths or settings.ACTIVITY_MODULES_IMPORT_PATHS:
+        parts = ("%s.%s" % (import_path, activity)).split('.')
+        for location in (('.'.join(parts[:-1]), parts[-1], None),
+                         ('.'.join(parts[:-2]), parts[-2], parts[-1])):
+            try:
+                return location, import_activity(*location)
+            except (ImportError, AttributeError, ValueError) as e:
+                errors.append("%s%s: %s" % ('.'.join(location[:2]),
+                                            '.%s()' % location[2] if location[2] else '', e))
+    raise ConfigurationError("%s not found. Tried:\n >>> %s" % (activity, '\n >>> '.join(errors)))
+
+
+class ActivityRegistry(object):
+    """
+    In-process activity name -> callable dispatch table,
+    backed by :class:`ActivityLocations`.
+    """
+
+    def __init__(self):
+        self._activities = {}
+        self._locations = ActivityLocations()
+
+    def preload(self):
+        """
+        Imports all activities with known locations.
+        Outdated locations are dropped, they will be searched on first use.
+        """
+        outdated = []
+        for activity, location in self._locations.get_all().items():
+            try:
+                self._activities[activity] = import_activity(*location)
+            except (ImportError, AttributeError, ValueError):
+                outdated.append(activity)
+                self._locations.remove(activity)
+        if outdated:
+            log.warning("Locations of activities are outdated: %s", ', '.join(outdated))
+
+    def get(self, activity):
+        """
+        Returns the callable of the activity, searches for it if needed.
+
+        Raises:
+            ConfigurationError: If activity can't be found.
+        """
+        try:
+            return self._activities[activity]
+        except KeyError:
+            location, func = find_activity(activity)
+            self._locations.add(activity, location)
+            self._activities[activity] = func
+            return func
+
+    def register_specs(self, specs):
+        """
+        Resolves all activities of given workflow specs.
+
+        Args:
+            specs: SpiffWorkflow spec objects.
+
+        Raises:
+            ConfigurationError: With a single report of all activities that can't be found.
+        """
+        errors = []
+        for spec in specs:
+            for activity in sorted(get_spec_activities(spec)):
+                try:
+                    self.get(activity)
+                except ConfigurationError as e:
+                    errors.append("[%s] %s" % (spec.name, e))
+        if errors:
+            raise ConfigurationError("%s activities cannot be found:\n\n%s" % (
+                len(errors), '\n\n'.join(errors)))
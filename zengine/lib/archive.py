@@ -0,0 +1,164 @@
+# -*-  coding: utf-8 -*-
+"""
+Compressed JSON lines archive on local file system.
+
+Records are dicts with a "key" item. Each :meth:`JSONLinesArchive.write`
+call creates a new gzip compressed file under ``root/<name>/``, one
+JSON document per line.
+
+.. code-block:: python
+
+    from zengine.lib.archive import JSONLinesArchive
+
+    archive = JSONLinesArchive('/var/archive')
+    file_name, size = archive.write('WFInstance', records)
+    record = archive.find(file_name, key)
+    archive.remove(file_name, [key])
+
+Like :mod:`zengine.lib.file_storage`, this module has no db dependencies.
+"""
+
+# Copyright (C) 2016 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+import gzip
+import os
+import re
+import tempfile
+from datetime import datetime
+from uuid import uuid4
+
+from zengine.lib import json_interface
+
+__all__ = ['JSONLinesArchive']
+
+#: Default root directory of archives
+DEFAULT_ROOT = os.environ.get('ARCHIVE_ROOT', 'archive')
+
+FILE_NAME_RE = re.compile(r'^\w+/\d{14}_[0-9a-f]{8}\.jsonl\.gz$')
+
+
+class JSONLinesArchive(object):
+    """
+    Args:
+        root (str): Archive directory. Defaults to ARCHIVE_ROOT env. variable.
+    """
+
+    def __init__(self, root=None):
+        self.root = os.path.abspath(root or DEFAULT_ROOT)
+
+    def path(self, file_name):
+        """
+        Absolute path of an archive file.
+
+        Args:
+            file_name (str): File name returned from :meth:`write`.
+        """
+        if not FILE_NAME_RE.match(file_name or ''):
+            raise ValueError("Invalid archive file name: %r" % file_name)
+        return os.path.join(self.root, *file_name.split('/'))
+
+    def _write_file(self, path, records):
+        """
+        Writes records to a temporary file first,
+        then moves it to it's place.
+
+        Returns:
+            Size of the file.
+        """
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:  # created by another process
+                if not os.path.isdir(directory):
+                    raise
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp_')
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as f:
+                for record in records:
+                    f.write(json_interface.dumps(record).encode('utf-8'))
+                    f.write(b'\n')
+            os.rename(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return os.path.getsize(path)
+
+    def write(self, name, records):
+        """
+        Writes records to a new archive file.
+
+        Args:
+            name (str): Archive name, e.g. model name.
+            records (list): JSON serializable dicts with "key" items.
+
+        Returns:
+            (file name, compressed size) tuple.
+        """
+        file_name = '%s/%s_%s.jsonl.gz' % (name, datetime.now().strftime('%Y%m%d%H%M%S'),
+                                           uuid4().hex[:8])
+        return file_name, self._write_file(self.path(file_name), records)
+
+    def read(self, file_name):
+        """
+        Iterates over records of an archive file.
+
+        Args:
+            file_name (str): File name returned from :meth:`write`.
+        """
+        with gzip.open(self.path(file_name), 'rb') as f:
+            for line in f:
+                if line.strip():
+                    yield json_interface.loads(line)
+
+    def find(self, file_name, key):
+        """
+        Finds a record in an archive file.
+
+        Returns:
+            Record dict or None.
+        """
+        for record in self.read(file_name):
+            if record['key'] == key:
+                return record
+
+    def remove(self, file_name, keys):
+        """
+        Removes records from an archive file.
+        File is deleted when no records left.
+
+        Args:
+            file_name (str): File name returned from :meth:`write`.
+            keys (list): Keys of records.
+
+        Returns:
+            Number of remaining records.
+        """
+        keys = set(keys)
+        records = [record for record in self.read(file_name) if record['key'] not in keys]
+        path = self.path(file_name)
+        if records:
+            self._write_file(path, records)
+        else:
+            os.remove(path)
+        return len(records)
+
+    def size(self, name=None):
+        """
+        Total size of archive files.
+
+        Args:
+            name (str): Only count the files of this archive.
+
+        Returns:
+            Size in bytes.
+        """
+        root = os.path.join(self.root, name) if name else self.root
+        total = 0
+        for directory, _, files in os.walk(root):
+            total += sum(os.path.getsize(os.path.join(directory, f))
+                         for f in files if f.endswith('.jsonl.gz'))
+        return total
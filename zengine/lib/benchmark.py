@@ -0,0 +1,44 @@
+# -*-  coding: utf-8 -*-
+"""
+Helpers for micro benchmark management commands.
+"""
+
+# Copyright (C) 2015 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+import timeit
+
+
+def measure(func, number=1000, repeat=3):
+    """
+    Measures the average run time of given function.
+
+    Args:
+        func: Function to be called without any arguments.
+        number (int): Number of calls per round.
+        repeat (int): Number of rounds, best one will be used.
+
+    Returns:
+        Float. Microseconds per call.
+    """
+    best = min(timeit.repeat(func, number=number, repeat=repeat))
+    return best / number * 1000000
+
+
+def print_table(headers, rows):
+    """
+    Prints a plain text table.
+
+    Args:
+        headers (list): Column titles.
+        rows (list): List of row tuples.
+    """
+    rows = [[('%.2f' % c) if isinstance(c, float) else str(c) for c in row] for row in rows]
+    widths = [max(len(str(h)), *[len(r[i]) for r in rows]) if rows else len(str(h))
+              for i, h in enumerate(headers)]
+    line = '  '.join('%%-%ds' % w for w in widths)
+    print(line % tuple(headers))
+    print(line % tuple('-' * w for w in widths))
+    for row in rows:
+        print(line % tuple(row))
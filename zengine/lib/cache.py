@@ -7,11 +7,13 @@ Base Cache object and some builtin subclasses of it.
 #
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
-import json
-
 import time
 
+from six.moves import cPickle as pickle
+
 from zengine.config import settings
+from zengine.lib import json_interface
+from zengine.log import log
 from redis import Redis
 
 redis_host, redis_port = settings.REDIS_SERVER.split(':')
@@ -27,6 +29,63 @@ return keys
 
 _remove_keys = cache.register_script(REMOVE_SCRIPT)
 
+# KEYS[1]: list, ARGV: message key, message json, max length, expire time, update only flag
+RECENT_MESSAGES_PUT_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 0 then
+    return 0
+end
+local items = redis.call('lrange', KEYS[1], 0, -1)
+for i, item in ipairs(items) do
+    if item ~= '' and cjson.decode(item)['key'] == ARGV[1] then
+        redis.call('lset', KEYS[1], i - 1, ARGV[2])
+        return 1
+    end
+end
+if ARGV[5] == '1' then
+    return 0
+end
+redis.call('lpush', KEYS[1], ARGV[2])
+-- one extra slot for the end marker
+redis.call('ltrim', KEYS[1], 0, tonumber(ARGV[3]))
+redis.call('expire', KEYS[1], ARGV[4])
+return 1
+"""
+
+# KEYS[1]: list, ARGV[1]: message key
+RECENT_MESSAGES_REMOVE_SCRIPT = """
+local items = redis.call('lrange', KEYS[1], 0, -1)
+for i, item in ipairs(items) do
+    if item ~= '' and cjson.decode(item)['key'] == ARGV[1] then
+        return redis.call('lrem', KEYS[1], 1, item)
+    end
+end
+return 0
+"""
+
+# KEYS[1]: list, ARGV: expire time, message jsons (newest first)
+RECENT_MESSAGES_FILL_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return 0
+end
+for i = 2, #ARGV do
+    redis.call('rpush', KEYS[1], ARGV[i])
+end
+redis.call('expire', KEYS[1], ARGV[1])
+return 1
+"""
+
+# KEYS[1]: list, ARGV[1]: number of items
+POP_MANY_SCRIPT = """
+local items = redis.call('lrange', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+redis.call('ltrim', KEYS[1], #items, -1)
+return items
+"""
+
+_put_recent_message = cache.register_script(RECENT_MESSAGES_PUT_SCRIPT)
+_pop_many = cache.register_script(POP_MANY_SCRIPT)
+_remove_recent_message = cache.register_script(RECENT_MESSAGES_REMOVE_SCRIPT)
+_fill_recent_messages = cache.register_script(RECENT_MESSAGES_FILL_SCRIPT)
+
 
 class Cache(object):
     """
@@ -84,7 +143,7 @@ class Cache(object):
         :return: cached value
         """
         d = cache.get(self.key)
-        return ((json.loads(d.decode('utf-8')) if self.serialize else d)
+        return ((json_interface.loads(d) if self.serialize else d)
                 if d is not None
                 else default)
 
@@ -97,7 +156,7 @@ class Cache(object):
         :return: val
         """
         cache.set(self.key,
-                  (json.dumps(val) if self.serialize else val),
+                  (json_interface.dumps(val) if self.serialize else val),
                   lifetime or settings.DEFAULT_CACHE_EXPIRE_TIME)
         return val
 
@@ -150,7 +209,7 @@ class Cache(object):
         Returns:
             Cache backend response.
         """
-        return cache.lpush(self.key, json.dumps(val) if self.serialize else val)
+        return cache.lpush(self.key, json_interface.stable_dumps(val) if self.serialize else val)
 
     def get_all(self):
         """
@@ -160,7 +219,7 @@ class Cache(object):
             Cache backend response.
         """
         result = cache.lrange(self.key, 0, -1)
-        return (json.loads(item.decode('utf-8')) for item in result if
+        return (json_interface.loads(item) for item in result if
                 item) if self.serialize else result
 
     def remove_all(self):
@@ -182,7 +241,7 @@ class Cache(object):
         Returns:
             Cache backend response.
         """
-        return cache.lrem(self.key, json.dumps(val))
+        return cache.lrem(self.key, 0, json_interface.stable_dumps(val))
 
     @classmethod
     def flush(cls, *args):
@@ -214,6 +273,294 @@ class CatalogCache(Cache):
         super(CatalogCache, self).__init__(lang_code, key)
 
 
+class CatalogNames(Cache):
+    """
+    Names of catalogs, stored as a redis set.
+
+    Catalogs are added when they are fetched from db, so workers
+    can preload them without listing the keys of the catalog bucket.
+    """
+    PREFIX = 'CTNAMES'
+
+    def __init__(self):
+        super(CatalogNames, self).__init__('all')
+
+    def add_name(self, name):
+        return cache.sadd(self.key, name)
+
+    def remove_name(self, name):
+        return cache.srem(self.key, name)
+
+    def get_names(self):
+        return [name.decode('utf-8') if isinstance(name, bytes) else name
+                for name in cache.smembers(self.key)]
+
+
+class RecentMessages(Cache):
+    """
+    Ring buffer of the latest serialized messages of a channel, newest first.
+
+    Buffer only exists after it's filled from db with :meth:`fill`.
+    Until then, new messages are not cached, so an existing
+    buffer always holds the latest messages of the channel.
+
+    An empty item at the end of the list marks that buffer
+    holds all messages of the channel.
+
+    Args:
+        channel_key: Channel key
+    """
+    PREFIX = 'RCNTMSG'
+
+    def __init__(self, channel_key):
+        super(RecentMessages, self).__init__(channel_key)
+
+    @property
+    def size(self):
+        return settings.MESSAGING_RECENT_MESSAGES_SIZE
+
+    def put(self, msg, update_only=False):
+        """
+        Adds a new message to the top of the buffer or replaces the
+        existing one with the same key.
+
+        Args:
+            msg (dict): Serialized message.
+            update_only (bool): Don't add the message if it's not already in the buffer.
+
+        Returns:
+            Cache backend response. 1 if buffer is modified.
+        """
+        return _put_recent_message(keys=[self.key],
+                                   args=[msg['key'], json_interface.dumps(msg), self.size,
+                                         settings.DEFAULT_CACHE_EXPIRE_TIME,
+                                         int(update_only)])
+
+    def remove(self, msg_key):
+        """
+        Removes the message from buffer.
+
+        Args:
+            msg_key: Message key.
+
+        Returns:
+            Cache backend response.
+        """
+        return _remove_recent_message(keys=[self.key], args=[msg_key])
+
+    def fill(self, messages, complete):
+        """
+        Creates the buffer, if it's not already created.
+
+        Args:
+            messages (list): Serialized messages, newest first.
+            complete (bool): Given messages are all the messages of the channel.
+
+        Returns:
+            Cache backend response. 1 if buffer is created.
+        """
+        items = [json_interface.dumps(msg) for msg in messages[:self.size]]
+        if complete:
+            items.append('')
+        return _fill_recent_messages(keys=[self.key],
+                                     args=[settings.DEFAULT_CACHE_EXPIRE_TIME] + items)
+
+    def get_messages(self):
+        """
+        Get messages from buffer.
+
+        Returns:
+            (messages, complete) tuple. Messages are newest first.
+            None if buffer doesn't exist.
+        """
+        result = cache.lrange(self.key, 0, -1)
+        if not result:
+            return None
+        return [json_interface.loads(item) for item in result if item], not result[-1]
+
+
+class WriteBehindQueue(Cache):
+    """
+    FIFO queue of model data waiting to be saved to db.
+
+    Only one worker drains a queue at a time, so objects
+    are saved in the same order they are pushed.
+    Items which can't be saved are moved to a dead-letter list.
+
+    Args:
+        name: Queue name.
+    """
+    PREFIX = 'WBQ'
+    LOCK_TIMEOUT = 60  # sec
+
+    def __init__(self, name):
+        super(WriteBehindQueue, self).__init__(name)
+        self.lock_key = '%s:lock' % self.key
+        self.job_key = '%s:job' % self.key
+        self.dead_key = '%s:dead' % self.key
+
+    def push(self, items):
+        """
+        Appends items to the end of the queue.
+
+        Args:
+            items (list): JSON serializable items.
+
+        Returns:
+            Length of the queue before the push.
+        """
+        return cache.rpush(self.key, *[json_interface.dumps(item) for item in items]) - len(items)
+
+    def pop(self, count):
+        """
+        Removes and returns items from the head of the queue.
+
+        Args:
+            count (int): Maximum number of items.
+
+        Returns:
+            List of items.
+        """
+        return [json_interface.loads(item) for item in _pop_many(keys=[self.key], args=[count])]
+
+    def get_items(self):
+        """
+        Items waiting in the queue, without removing them.
+
+        Returns:
+            List of items, oldest first.
+        """
+        return [json_interface.loads(item) for item in cache.lrange(self.key, 0, -1)]
+
+    def get_dead_items(self):
+        """
+        Items which couldn't be saved.
+
+        Returns:
+            List of items.
+        """
+        return [json_interface.loads(item) for item in cache.lrange(self.dead_key, 0, -1)]
+
+    def __len__(self):
+        return cache.llen(self.key)
+
+    def is_pending(self):
+        """
+        Whether some items are waiting in the queue or being saved.
+
+        Returns:
+            bool
+        """
+        return bool(len(self) or cache.exists(self.lock_key))
+
+    def schedule(self):
+        """
+        Marks that a drain job is requested. Marker is cleared when draining starts
+        or expires after :attr:`LOCK_TIMEOUT`, so a lost job is requested again.
+
+        Returns:
+            True if caller should trigger a new drain job.
+        """
+        return bool(cache.set(self.job_key, 1, ex=self.LOCK_TIMEOUT, nx=True))
+
+    def _save_each(self, save, items):
+        """
+        Saves items one by one after a failed batch.
+        Items which still can't be saved are moved to the dead-letter list.
+        """
+        saved = 0
+        for item in items:
+            try:
+                save([item])
+                saved += 1
+            except Exception:
+                log.exception("Item of %s couldn't be saved, moved to %s: %s",
+                              self.key, self.dead_key, item.get('key'))
+                cache.rpush(self.dead_key, json_interface.dumps(item))
+        return saved
+
+    def drain(self, save, batch_size=100, wait=False):
+        """
+        Pops and saves all items of the queue in batches.
+
+        If a batch can't be saved, it's items are saved one by one and
+        the failing ones are moved to the dead-letter list, so a bad item
+        doesn't block the queue.
+
+        Args:
+            save (callable): Called with the list of items of each batch.
+                Saves should be idempotent.
+            batch_size (int): Number of items per batch.
+            wait (bool): If the queue is being drained by another worker, wait for it
+                instead of returning immediately. All items pushed before the call
+                are saved when it returns.
+
+        Returns:
+            Number of saved items.
+        """
+        saved = 0
+        while True:
+            if not cache.set(self.lock_key, 1, ex=self.LOCK_TIMEOUT, nx=True):
+                if not wait:
+                    break
+                time.sleep(0.05)
+                continue
+            cache.delete(self.job_key)
+            try:
+                while True:
+                    items = self.pop(batch_size)
+                    if not items:
+                        break
+                    try:
+                        save(items)
+                        saved += len(items)
+                    except Exception:
+                        log.exception("Batch of %s couldn't be saved, "
+                                      "saving items one by one", self.key)
+                        saved += self._save_each(save, items)
+                    cache.expire(self.lock_key, self.LOCK_TIMEOUT)
+            finally:
+                cache.delete(self.lock_key)
+            # items pushed after the last pop and before the lock release
+            if not len(self):
+                break
+        return saved
+
+
+class LaneChangeVersion(Cache):
+    """
+    Number of lane changes of a workflow instance. Background jobs of
+    a lane change are skipped if a later lane change happened.
+
+    Args:
+        wfi_key: Workflow instance key.
+    """
+    PREFIX = 'LNCHG'
+    SERIALIZE = False
+
+    def __init__(self, wfi_key):
+        super(LaneChangeVersion, self).__init__(wfi_key)
+
+    def increment(self):
+        """
+        Records a new lane change.
+
+        Returns:
+            Version of the new lane change.
+        """
+        pipe = cache.pipeline()
+        pipe.incr(self.key)
+        pipe.expire(self.key, settings.DEFAULT_CACHE_EXPIRE_TIME)
+        return pipe.execute()[0]
+
+    def get_version(self):
+        """
+        Returns:
+            Version of the last lane change, 0 if there's none.
+        """
+        return int(self.get(0))
+
+
 class UserSessionID(Cache):
     """
     Cache object for the User -> Active Session ID.
@@ -303,7 +650,7 @@ class Session(object):
         self.key = self._make_key(sessid)
 
     def _j_load(self, val):
-        return json.loads(val.decode())
+        return json_interface.loads(val)
 
     def __getitem__(self, key):
         val = self.get(key)
@@ -318,7 +665,7 @@ class Session(object):
 
     def __setitem__(self, key, value):
         key = self._make_key(key)
-        cache.set(key, json.dumps(value))
+        cache.set(key, json_interface.dumps(value))
 
     def __contains__(self, item):
         try:
@@ -375,3 +722,54 @@ class WFSpecNames(Cache):
     def refresh(self):
         self.delete()
         self.get_or_set()
+
+
+class WFSpecCache(Cache):
+    """
+    Compiled workflow specs shared by all workers.
+
+    Specs are pickled together with the content hash of their diagram,
+    so the spec of an outdated diagram is never returned.
+    Warmed by ``load_diagrams`` management command.
+
+    Args:
+        wf_name (str): Name of the workflow.
+    """
+    PREFIX = "WFSPEC"
+    SERIALIZE = False
+
+    def __init__(self, wf_name):
+        super(WFSpecCache, self).__init__(wf_name)
+
+    def get_spec(self, content_hash):
+        """
+        Args:
+            content_hash (str): Content hash of the current diagram of the workflow.
+
+        Returns:
+            Cached spec object or None.
+        """
+        data = self.get()
+        if not data or not content_hash:
+            return None
+        stored_hash, _, spec = data.partition(b'\n')
+        if stored_hash != content_hash.encode('ascii'):
+            return None
+        try:
+            return pickle.loads(spec)
+        except Exception:  # cached by an incompatible version
+            return None
+
+    def set_spec(self, content_hash, spec):
+        """
+        Args:
+            content_hash (str): Content hash of the diagram of the spec.
+            spec: SpiffWorkflow spec object.
+        """
+        try:
+            data = pickle.dumps(spec, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            log.warning("Spec of %s can't be pickled, it's not cached" % self.key, exc_info=True)
+        else:
+            self.set(content_hash.encode('ascii') + b'\n' + data)
+        return spec
@@ -8,10 +8,16 @@ This BPMN parser module takes the following extension elements from Camunda's ou
 #
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
-from SpiffWorkflow.bpmn.parser.util import full_attr, BPMN_MODEL_NS, ATTRIBUTE_NS
+import copy
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+
+from SpiffWorkflow.bpmn.parser.util import full_attr
 from SpiffWorkflow.bpmn.storage.BpmnSerializer import BpmnSerializer
 from SpiffWorkflow.bpmn.storage.Packager import Packager
 from SpiffWorkflow.storage.Serializer import Serializer
+import six
 from six import StringIO
 import xml.etree.ElementTree as ET
 __author__ = "Evren Esat Ozkan"
@@ -22,123 +28,118 @@ from zengine.lib.utils import DotDict
 from zengine.log import log
 
 
+def _local_name(tag):
+    # comments and processing instructions have non-string tags
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, six.string_types) else ''
 
 
-class CamundaBMPNParser(BpmnParser):
+def content_hash(xml_content):
     """
-    Parser object to override PROCESS_PARSER_CLASS
+    SHA-1 digest of a BPMN diagram.
+
+    Args:
+        xml_content (str): BPMN diagram.
+
+    Returns:
+        Hex digest string.
     """
-    def __init__(self):
-        super(CamundaBMPNParser, self).__init__()
-        self.PROCESS_PARSER_CLASS = CamundaProcessParser
+    return hashlib.sha1(xml_content.encode('utf-8') if not isinstance(xml_content, bytes)
+                        else xml_content).hexdigest()
 
 
-# noinspection PyBroadException
-class CamundaProcessParser(ProcessParser):
+class DiagramExtensions(object):
     """
-    Custom process parser with various extra features.
+    Zengine extensions of a BPMN diagram, extracted in a single pass over the XML tree.
+
+    Shared by :meth:`~zengine.models.workflow_manager.BPMNWorkflow.set_xml` and
+    spec loading through :class:`ZopsSerializer`. Extensions of recently used
+    diagrams are cached per process, keyed by their content.
+
+    Attributes:
+        name (str): WF name from 'process' or 'collaboration'.
+        wf_properties (dict): Camunda properties of 'participant', 'collaboration' and 'process'.
+        lanes (dict): Lane name -> camunda properties of the lane.
+        node_lanes (dict): Node id -> lane name.
+        input_data (dict): Node id -> parsed camunda inputOutput parameters.
     """
-    def __init__(self, *args, **kwargs):
-        super(CamundaProcessParser, self).__init__(*args, **kwargs)
-        self.spec.wf_name = self.get_name()
-        self.spec.wf_description = self._get_description()
-        self.spec.wf_properties = self._get_wf_properties()
+    CACHE_SIZE = 100
+    _cache = OrderedDict()
+    _cache_lock = Lock()
+    WF_TAGS = ('participant', 'collaboration', 'process')
+
+    def __init__(self, root):
+        self.lanes = {}
+        self.node_lanes = {}
+        self.input_data = {}
+        self._descriptions = {}
+        names = {}
+        properties = {tag: {} for tag in self.WF_TAGS}
+        for parent in root.iter():
+            tag = _local_name(parent.tag)
+            if tag == 'lane':
+                self._add_lane(parent)
+            for child in parent:
+                child_tag = _local_name(child.tag)
+                if child_tag == 'extensionElements':
+                    for ext in child:
+                        ext_tag = _local_name(ext.tag)
+                        if ext_tag == 'inputOutput':
+                            self.input_data[parent.get('id')] = self._parse_input_data(ext)
+                        elif ext_tag == 'properties' and tag in properties:
+                            properties[tag].update(self._parse_properties(ext))
+                elif child_tag == 'documentation' and tag in self.WF_TAGS:
+                    self._descriptions.setdefault(tag, child.text)
+            if tag in self.WF_TAGS:
+                names.setdefault(tag, parent.get('name'))
+        self.name = names.get('process') or names.get('collaboration')
+        self.wf_properties = {}
+        for tag in self.WF_TAGS:
+            self.wf_properties.update(properties[tag])
 
-    def parse_node(self, node):
+    @classmethod
+    def from_xml(cls, xml_content, root=None):
         """
-        Overrides ProcessParser.parse_node
-        Parses and attaches the inputOutput tags that created by Camunda Modeller
+        Returns cached extensions of the diagram or extracts them.
 
         Args:
-            node: xml task node
-        Returns:
-             TaskSpec
-        """
-        spec = super(CamundaProcessParser, self).parse_node(node)
-        spec.data = self._parse_input_data(node)
-        spec.data['lane_data'] = self._get_lane_properties(node)
-        spec.defines = spec.data
-        service_class = node.get(full_attr('assignee'))
-        if service_class:
-            self.parsed_nodes[node.get('id')].service_class = node.get(full_attr('assignee'))
-        return spec
+            xml_content (str): BPMN diagram.
+            root: Already parsed XML root element of the diagram, if any.
 
-    def _get_description(self):
-        """
-        Tries to get WF description from 'collabration' or 'process' or 'pariticipant'
         Returns:
-
-        """
-        ns = {'ns': '{%s}' % BPMN_MODEL_NS}
-        desc = (
-            self.doc_xpath('.//{ns}collaboration/{ns}documentation'.format(**ns)) or
-            self.doc_xpath('.//{ns}process/{ns}documentation'.format(**ns)) or
-            self.doc_xpath('.//{ns}collaboration/{ns}participant/{ns}documentation'.format(**ns))
-        )
-        if desc:
-            return desc[0].findtext('.')
-
-    def _get_wf_properties(self):
-        ns = {'ns': '{%s}' % BPMN_MODEL_NS,
-              'as': '{%s}' % ATTRIBUTE_NS}
-        wf_data = {}
-        for path in ('.//{ns}collaboration/*/*/{as}property',
-                     './/{ns}process/*/*/{as}property'):
-            for a in self.doc_xpath(path.format(**ns)):
-                wf_data[a.attrib['name']] = a.attrib['value'].strip()
-        return wf_data
-
-    def get_name(self):
+            DiagramExtensions object.
         """
-        Tries to get WF name from 'process' or 'collobration' or 'pariticipant'
-
-        Returns:
-            str. WF name.
+        digest = content_hash(xml_content)
+        with cls._cache_lock:
+            if digest in cls._cache:
+                ext = cls._cache.pop(digest)
+                cls._cache[digest] = ext
+                return ext
+        if root is None:
+            root = ET.fromstring(xml_content)
+        ext = cls(root)
+        with cls._cache_lock:
+            cls._cache[digest] = ext
+            while len(cls._cache) > cls.CACHE_SIZE:
+                cls._cache.popitem(last=False)
+        return ext
+
+    def get_description(self, *tags):
         """
-        ns = {'ns': '{%s}' % BPMN_MODEL_NS}
-        for path in ('.//{ns}process',
-                     './/{ns}collaboration',
-                     './/{ns}collaboration/{ns}participant/'):
-            tag = self.doc_xpath(path.format(**ns))
-            if tag:
-                name = tag[0].get('name')
-                if name:
-                    return name
-        return self.get_id()
+        WF description from documentation of the first of given tags that has one.
 
-    def _parse_input_data(self, node):
-        """
-        Parses inputOutput part camunda modeller extensions.
         Args:
-            node: SpiffWorkflow Node object.
+            *tags: 'participant', 'collaboration' or 'process', in order of precedence.
 
         Returns:
-            Data dict.
+            str: WF description.
         """
-        data = DotDict()
-        try:
-            for nod in self._get_input_nodes(node):
-                data.update(self._parse_input_node(nod))
-        except Exception as e:
-            log.exception("Error while processing node: %s" % node)
-        return data
+        for tag in tags:
+            if self._descriptions.get(tag):
+                return self._descriptions[tag]
 
-    @staticmethod
-    def _get_input_nodes(node):
-        for child in node.getchildren():
-            if child.tag.endswith("extensionElements"):
-                for gchild in child.getchildren():
-                    if gchild.tag.endswith("inputOutput"):
-                        children = gchild.getchildren()
-                        return children
-        return []
-
-    def _get_lane_properties(self, node):
+    def get_lane_data(self, node_id):
         """
-        Parses the given XML node
-
-        Args:
-            node (xml): XML node.
+        Lane properties of the node.
 
         .. code-block:: xml
 
@@ -151,14 +152,58 @@ class CamundaProcessParser(ProcessParser):
             </bpmn2:lane>
 
         Returns:
-            {'perms': 'foo,bar'}
+            {'name': 'Lane 8', 'perms': 'foo,bar'}
         """
-        lane_name = self.get_lane(node.get('id'))
+        lane_name = self.node_lanes.get(node_id)
         lane_data = {'name': lane_name}
-        for a in self.xpath(".//bpmn:lane[@name='%s']/*/*/" % lane_name):
-            lane_data[a.attrib['name']] = a.attrib['value'].strip()
+        lane_data.update(self.lanes.get(lane_name, {}))
         return lane_data
 
+    def get_input_data(self, node_id):
+        """
+        Parsed inputOutput parameters of the node.
+
+        Returns:
+            A new DotDict. Nested lists and maps are copied too,
+            since extensions are shared by all specs of the diagram.
+        """
+        return DotDict(copy.deepcopy(self.input_data.get(node_id, {})))
+
+    def _add_lane(self, lane):
+        name = lane.get('name')
+        properties = self.lanes.setdefault(name, {})
+        for child in lane:
+            child_tag = _local_name(child.tag)
+            if child_tag == 'flowNodeRef' and name:
+                self.node_lanes[child.text.strip()] = name
+            elif child_tag == 'extensionElements':
+                for ext in child:
+                    properties.update(self._parse_properties(ext))
+
+    @staticmethod
+    def _parse_properties(elm):
+        return dict((prop.get('name'), prop.get('value').strip())
+                    for prop in elm if prop.get('name') and prop.get('value') is not None)
+
+    @classmethod
+    def _parse_input_data(cls, elm):
+        """
+        Parses inputOutput part camunda modeller extensions.
+
+        Args:
+            elm: inputOutput element.
+
+        Returns:
+            Data dict.
+        """
+        data = {}
+        try:
+            for node in elm:
+                data.update(cls._parse_input_node(node))
+        except Exception:
+            log.exception("Error while processing node: %s" % elm)
+        return data
+
     @classmethod
     def _parse_input_node(cls, node):
         """
@@ -166,36 +211,103 @@ class CamundaProcessParser(ProcessParser):
         :return: dict
         """
         data = {}
-        child = node.getchildren()
+        child = list(node)
+        val = None
         if not child and node.get('name'):
             val = node.text
         elif child:  # if tag = "{http://activiti.org/bpmn}script" then data_typ = 'script'
-            data_typ = child[0].tag.split('}')[1]
+            data_typ = _local_name(child[0].tag)
             val = getattr(cls, '_parse_%s' % data_typ)(child[0])
         data[node.get('name')] = val
         return data
 
     @classmethod
     def _parse_map(cls, elm):
-        return dict([(item.get('key'), item.text) for item in elm.getchildren()])
+        return dict([(item.get('key'), item.text) for item in elm])
 
     @classmethod
     def _parse_list(cls, elm):
-        return [item.text for item in elm.getchildren()]
+        return [item.text for item in elm]
 
     @classmethod
     def _parse_script(cls, elm):
         return elm.get('scriptFormat'), elm.text
 
+
+class CamundaBMPNParser(BpmnParser):
+    """
+    Parser object to override PROCESS_PARSER_CLASS
+    """
+    def __init__(self, extensions=None):
+        super(CamundaBMPNParser, self).__init__()
+        self.PROCESS_PARSER_CLASS = CamundaProcessParser
+        self.extensions = extensions
+
+    def add_bpmn_xml(self, bpmn, svg=None, filename=None):
+        """
+        Extracts zengine extensions of the diagram unless they're already given.
+        """
+        if self.extensions is None:
+            self.extensions = DiagramExtensions(bpmn.getroot())
+        super(CamundaBMPNParser, self).add_bpmn_xml(bpmn, svg=svg, filename=filename)
+        # diagrams added with further calls should have their own extensions
+        self.extensions = None
+
+
+# noinspection PyBroadException
+class CamundaProcessParser(ProcessParser):
+    """
+    Custom process parser with various extra features.
+
+    Extensions are read from :class:`DiagramExtensions` of
+    the parser instead of querying the XML tree for each node.
+    """
+    def __init__(self, p, *args, **kwargs):
+        self.extensions = p.extensions
+        super(CamundaProcessParser, self).__init__(p, *args, **kwargs)
+        self.spec.wf_name = self.get_name()
+        self.spec.wf_description = self.extensions.get_description('collaboration', 'process',
+                                                                   'participant')
+        self.spec.wf_properties = dict(self.extensions.wf_properties)
+
+    def parse_node(self, node):
+        """
+        Overrides ProcessParser.parse_node
+        Parses and attaches the inputOutput tags that created by Camunda Modeller
+
+        Args:
+            node: xml task node
+        Returns:
+             TaskSpec
+        """
+        spec = super(CamundaProcessParser, self).parse_node(node)
+        node_id = node.get('id')
+        spec.data = self.extensions.get_input_data(node_id)
+        spec.data['lane_data'] = self.extensions.get_lane_data(node_id)
+        spec.defines = spec.data
+        service_class = node.get(full_attr('assignee'))
+        if service_class:
+            self.parsed_nodes[node_id].service_class = service_class
+        return spec
+
+    def get_name(self):
+        """
+        Tries to get WF name from 'process' or 'collobration' or 'pariticipant'
+
+        Returns:
+            str. WF name.
+        """
+        return self.extensions.name or self.get_id()
+
+
 class ZopsSerializer(Serializer):
     """
     Deserialize direct XML -> Spec
     """
 
     def deserialize_workflow_spec(self, xml_content, filename):
-
-        parser = CamundaBMPNParser()
         bpmn = ET.parse(StringIO(xml_content))
+        parser = CamundaBMPNParser(DiagramExtensions.from_xml(xml_content, bpmn.getroot()))
         parser.add_bpmn_xml(bpmn, svg=None, filename='%s' % filename)
         return parser.get_spec(filename)
 
@@ -10,14 +10,35 @@ Catalog Data module.
 from collections import defaultdict
 
 import six
+from redis.client import PubSub
+from redis.exceptions import ConnectionError as RedisConnectionError
 
 from zengine.config import settings
-from zengine.lib.cache import Cache, CatalogCache
+from zengine.lib.cache import Cache, CatalogCache, CatalogNames, cache
+from zengine.log import log
+
+
+class UpdateSubscription(PubSub):
+    """
+    Subscription to catalog updates which notes reconnections,
+    since updates published while disconnected are missed.
+    """
+    reconnected = False
+
+    def on_connect(self, connection):
+        if self.channels or self.patterns:
+            self.reconnected = True
+        super(UpdateSubscription, self).on_connect(connection)
 
 
 class CatalogData(object):
     """
     Manager object for the user updatable multi language texts
+
+    Catalogs known by :class:`~zengine.lib.cache.CatalogNames` are loaded with
+    a single bulk fetch by :meth:`preload` when the worker starts. Updates made
+    by :meth:`update` are published over redis, other workers drop their local
+    copies in :meth:`process_updates`.
     """
 
     # this will be set by langua_support middleware
@@ -31,12 +52,22 @@ class CatalogData(object):
     # ['tr']['country']['tr'] = 'Turkey'
     ITEM_CACHE = defaultdict(dict)
 
+    #: Redis channel of updated catalog names
+    UPDATE_CHANNEL = 'CTDT_UPDATES'
+
+    _subscription = None
+    _preloaded = False
+
     def _get_lang(self):
         return self.CURRENT_LANG_CODE or settings.DEFAULT_LANG
 
-    def _get_from_db(self, cat):
+    @staticmethod
+    def _get_bucket():
         from pyoko.db.connection import client
-        data = client.bucket_type('catalog').bucket('ulakbus_settings_fixtures').get(cat).data
+        return client.bucket_type('catalog').bucket('ulakbus_settings_fixtures')
+
+    def _get_from_db(self, cat):
+        data = self._get_bucket().get(cat).data
         return self._parse_db_data(data, cat)
 
     def _parse_db_data(self, data, cat):
@@ -48,13 +79,99 @@ class CatalogData(object):
                     k = int(k)
                 except:
                     pass
-                # self.ITEM_CACHE[lang_code][cat][k] = lang_val
                 lang_dict[lang_code].append({'value': k, "name": lang_val})
+        CatalogNames().add_name(cat)
         for lang_code, lang_set in lang_dict.items():
             CatalogCache(lang_code, cat).set(lang_set)
             self.CACHE[lang_code][cat] = lang_set
+            self.ITEM_CACHE[lang_code][cat] = dict((i['value'], i['name']) for i in lang_set)
         return lang_dict[self._get_lang()]
 
+    def preload(self):
+        """
+        Fetches all known catalogs from db at once and caches them for all languages.
+        Other catalogs are fetched on first use.
+
+        Also subscribes to catalog updates of other workers.
+        Does nothing if catalogs are already preloaded in this process.
+        """
+        if CatalogData._preloaded:
+            return
+        self.subscribe()
+        bucket = self._get_bucket()
+        for obj in bucket.multiget(CatalogNames().get_names()):
+            if isinstance(obj, tuple):
+                # (bucket_type, bucket, key, exception) of failed fetches
+                log.warning("Catalog data %s cannot be fetched: %s", obj[2], obj[3])
+                continue
+            try:
+                self._parse_db_data(obj.data, obj.key)
+            except (AssertionError, AttributeError):
+                log.warning("Catalog data %s is empty or malformed", obj.key)
+                if not obj.exists:
+                    CatalogNames().remove_name(obj.key)
+        CatalogData._preloaded = True
+
+    @classmethod
+    def subscribe(cls):
+        """
+        Subscribes to :attr:`UPDATE_CHANNEL`, if not already subscribed.
+        """
+        if cls._subscription is None:
+            cls._subscription = UpdateSubscription(cache.connection_pool,
+                                                   ignore_subscribe_messages=True)
+            cls._subscription.subscribe(cls.UPDATE_CHANNEL)
+
+    @classmethod
+    def process_updates(cls):
+        """
+        Drops the local copies of catalogs which are updated by other workers.
+        After a reconnection, all local copies are dropped.
+
+        Does not block, should be called before handling each message.
+        """
+        if cls._subscription is None:
+            return
+        try:
+            message = cls._subscription.get_message()
+            while message:
+                cat = message['data']
+                cls._drop_local_cache(cat.decode('utf-8') if isinstance(cat, bytes) else cat)
+                message = cls._subscription.get_message()
+        except RedisConnectionError:
+            log.exception("Catalog data updates cannot be read")
+            cls._subscription.reconnected = True
+        else:
+            if cls._subscription.reconnected:
+                cls._subscription.reconnected = False
+                for cat in set(cat for lang_caches in (cls.CACHE, cls.ITEM_CACHE)
+                               for lang_cache in lang_caches.values() for cat in lang_cache):
+                    cls._drop_local_cache(cat)
+
+    @classmethod
+    def _drop_local_cache(cls, cat):
+        from zengine.forms.json_form import JsonForm
+        for lang_caches in (cls.CACHE, cls.ITEM_CACHE):
+            for lang_cache in lang_caches.values():
+                lang_cache.pop(cat, None)
+        # drop compiled forms which use this catalog as choices
+        JsonForm.layout_cache.invalidate(catalog=cat)
+
+    def update(self, cat, data):
+        """
+        Caches updated catalog data and notifies all workers.
+        Data should be already saved to db.
+
+        Args:
+            cat (str): Catalog name.
+            data (dict): Catalog data, e.g. {'1': {'en': 'Turkey', 'tr': 'Türkiye'}}
+        """
+        for lang_code in set(settings.TRANSLATIONS) | set(self.CACHE.keys()):
+            CatalogCache(lang_code, cat).delete()
+        self._drop_local_cache(cat)
+        self._parse_db_data(data, cat)
+        cache.publish(self.UPDATE_CHANNEL, cat)
+
     def get_all(self, cat):
         """
         if data can't found in cache then it will be fetched from db,
@@ -104,11 +221,13 @@ class CatalogData(object):
 
     def __call__(self, catalog, key):
         if isinstance(catalog, six.string_types):
-            return self.ITEM_CACHE.get(catalog, {}).get(key) or self._fill_get_item_cache(catalog, key)
+            items = self.ITEM_CACHE[self._get_lang()].get(catalog)
+            if items is None:
+                return self._fill_get_item_cache(catalog, key)
+            return items.get(key)
         elif callable(catalog):
             return self._get_from_static_tuple(catalog(), key)
         else:
             return self._get_from_static_tuple(catalog, key)
 
 catalog_data_manager = CatalogData()
-
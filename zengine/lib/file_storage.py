@@ -0,0 +1,194 @@
+# -*-  coding: utf-8 -*-
+"""
+Content addressed file storage on local file system.
+
+Files are stored under the SHA-256 digest of their content, so identical
+uploads are stored only once and the digest can be used to reference the
+file from messages and models.
+
+.. code-block:: python
+
+    from zengine.lib.file_storage import LocalFileStorage
+
+    storage = LocalFileStorage('/var/files')
+    digest, created = storage.store(content)
+    with storage.open(digest) as f:
+        ...
+
+Like :mod:`zengine.lib.json_interface`, this module has no zengine
+dependencies, so files can be uploaded directly to the tornado gateway.
+Gateway and workers should share the same storage root.
+"""
+
+# Copyright (C) 2015 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+import base64
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+
+__all__ = ['LocalFileStorage', 'guess_mime_type']
+
+#: Default root directory of stored files
+DEFAULT_ROOT = os.environ.get('FILE_STORAGE_ROOT', 'files')
+
+#: Default URL prefix of stored files
+DEFAULT_URL = os.environ.get('FILE_STORAGE_URL', '/files/')
+
+#: Number of bytes needed by :func:`guess_mime_type`
+HEADER_SIZE = 16
+
+DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+MAGIC_NUMBERS = (
+    (b'%PDF', 'application/pdf'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+    # zip based formats (xlsx, docx, odt...) and ole2 based formats (xls, doc)
+    # can only be told apart by their names.
+    (b'PK\x03\x04', 'application/zip'),
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'application/x-ole-storage'),
+)
+
+
+def guess_mime_type(header, name=None):
+    """
+    Guesses mime type of a file from it's first bytes and name.
+
+    Args:
+        header (bytes): First :attr:`HEADER_SIZE` bytes of file.
+        name (str): File name.
+
+    Returns:
+        Mime type string.
+    """
+    by_name = mimetypes.guess_type(name)[0] if name else None
+    for magic, mime_type in MAGIC_NUMBERS:
+        if header.startswith(magic):
+            if mime_type in ('application/zip', 'application/x-ole-storage') and by_name:
+                return by_name
+            return mime_type
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp'
+    return by_name or 'application/octet-stream'
+
+
+class LocalFileStorage(object):
+    """
+    Stores files under ``root/ab/cd/abcd...`` where "abcd..." is the
+    SHA-256 digest of file content.
+
+    Args:
+        root (str): Storage directory. Defaults to FILE_STORAGE_ROOT env. variable.
+        url (str): URL prefix of stored files. Defaults to FILE_STORAGE_URL env. variable.
+    """
+
+    def __init__(self, root=None, url=None):
+        self.root = os.path.abspath(root or DEFAULT_ROOT)
+        self.base_url = url or DEFAULT_URL
+
+    @staticmethod
+    def digest(content):
+        return hashlib.sha256(content).hexdigest()
+
+    @staticmethod
+    def is_digest(digest):
+        return bool(DIGEST_RE.match(digest or ''))
+
+    def _relative_path(self, digest):
+        if not self.is_digest(digest):
+            raise ValueError("Invalid file digest: %r" % digest)
+        return os.path.join(digest[:2], digest[2:4], digest)
+
+    def path(self, digest):
+        """
+        Absolute path of stored file.
+        """
+        return os.path.join(self.root, self._relative_path(digest))
+
+    def url(self, digest):
+        """
+        Public URL of stored file.
+        """
+        return self.base_url + self._relative_path(digest).replace(os.sep, '/')
+
+    def exists(self, digest):
+        return self.is_digest(digest) and os.path.exists(self.path(digest))
+
+    def store(self, content):
+        """
+        Stores the content if it's not already stored.
+
+        Content is written to a temporary file first, then moved to it's place,
+        so readers never see partially written files.
+
+        Args:
+            content (bytes): File content.
+
+        Returns:
+            (digest, created) tuple. created is False for duplicate files.
+        """
+        digest = self.digest(content)
+        path = self.path(digest)
+        if os.path.exists(path):
+            return digest, False
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:  # created by another process
+                if not os.path.isdir(directory):
+                    raise
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp_')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.rename(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest, True
+
+    def store_base64(self, content):
+        """
+        Stores base64 encoded content. Data URI prefixes are ignored.
+
+        Args:
+            content (str): Base64 encoded file content.
+
+        Returns:
+            (digest, created) tuple.
+        """
+        if ',' in content[:100] and content.startswith('data:'):
+            content = content.split(',', 1)[1]
+        return self.store(base64.b64decode(content))
+
+    def open(self, digest):
+        """
+        Opens stored file for reading in binary mode.
+        """
+        return open(self.path(digest), 'rb')
+
+    def size(self, digest):
+        return os.path.getsize(self.path(digest))
+
+    def read_header(self, digest, size=HEADER_SIZE):
+        """
+        Reads first bytes of the file.
+        """
+        with self.open(digest) as f:
+            return f.read(size)
+
+    def guess_mime_type(self, digest, name=None):
+        """
+        Guesses mime type of stored file from it's content and given name.
+        """
+        return guess_mime_type(self.read_header(digest), name)
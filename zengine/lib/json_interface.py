@@ -1,5 +1,25 @@
 # -*-  coding: utf-8 -*-
 """
+JSON codec used for all queue, cache and gateway serialization.
+
+On import, the fastest available backend is selected in the following order:
+
+- orjson
+- ujson (only versions that support the ``default`` hook)
+- json (standard library)
+
+Set ``ZENGINE_JSON_BACKEND`` environment variable to one of these names
+to force a specific backend.
+
+This module intentionally has no zengine dependencies, so it can be
+imported by the standalone tornado gateway as well.
+
+.. code-block:: python
+
+    from zengine.lib.json_interface import dumps, loads
+
+    body = dumps({'cmd': 'message', 'title': gettext_lazy('Hello')})
+    data = loads(body)
 """
 
 # Copyright (C) 2015 ZetaOps Inc.
@@ -7,15 +27,146 @@
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
 
-
 import json
-from zengine.lib.translation import LazyProxy
+import os
+from datetime import date, datetime, time
+
+try:
+    text_type = unicode
+except NameError:  # Python 3
+    text_type = str
+
+try:
+    from babel.support import LazyProxy
+except ImportError:  # standalone gateway doesn't need babel
+    LazyProxy = None
+
+__all__ = ['dumps', 'loads', 'stable_dumps', 'BACKEND_NAME', 'ZEngineJSONEncoder']
+
+
+def _encode_default(o):
+    """
+    Converts non-JSON types to their serializable counterparts.
+
+    Lazy translations are translated at this point,
+    date and time objects are converted to ISO 8601 strings.
+    """
+    if LazyProxy is not None and isinstance(o, LazyProxy):
+        return text_type(o)
+    if isinstance(o, (datetime, date, time)):
+        return o.isoformat()
+    raise TypeError("%r is not JSON serializable" % o)
 
 
 class ZEngineJSONEncoder(json.JSONEncoder):
     def default(self, o):
-        # If the object is a deferred translation, do the translation now
-        if isinstance(o, LazyProxy):
-            return str(o)
-        # Otherwise, let the default encoder handle the serialization
-        return json.JSONEncoder.default(self, o)
+        try:
+            return _encode_default(o)
+        except TypeError:
+            # Otherwise, let the default encoder handle the serialization
+            return json.JSONEncoder.default(self, o)
+
+
+def _to_text(s):
+    return s.decode('utf-8') if isinstance(s, bytes) else s
+
+
+class StdlibBackend(object):
+    """
+    Standard library json module. Always available.
+    """
+    name = 'json'
+    # default separators, so the output is the same as json.dumps
+    _encoder = ZEngineJSONEncoder()
+    _decoder = json.JSONDecoder()
+
+    @classmethod
+    def dumps(cls, obj):
+        return cls._encoder.encode(obj)
+
+    @classmethod
+    def loads(cls, s):
+        return cls._decoder.decode(_to_text(s))
+
+
+class UJSONBackend(object):
+    """
+    ujson backend. Older ujson versions which don't support
+    ``default`` hook can't serialize lazy translations, so they are not used.
+    """
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        ujson.dumps(0, default=_encode_default)  # raises TypeError on old versions
+        self._ujson = ujson
+
+    def dumps(self, obj):
+        return self._ujson.dumps(obj, default=_encode_default)
+
+    def loads(self, s):
+        return self._ujson.loads(s)
+
+
+class ORJSONBackend(object):
+    """
+    orjson backend. Serializes date and time objects natively,
+    only lazy translations go through the ``default`` hook.
+    """
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+        self._option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj):
+        return self._orjson.dumps(obj, default=_encode_default,
+                                  option=self._option).decode('utf-8')
+
+    def loads(self, s):
+        return self._orjson.loads(s)
+
+
+BACKENDS = (
+    ('orjson', ORJSONBackend),
+    ('ujson', UJSONBackend),
+    ('json', StdlibBackend),
+)
+
+
+def get_backend(name=None):
+    """
+    Returns a codec backend.
+
+    Args:
+        name (str): Backend name. If not given or "auto",
+            first importable backend of BACKENDS will be returned.
+
+    Returns:
+        Codec backend object which have ``dumps``, ``loads`` methods and ``name`` attribute.
+    """
+    for backend_name, backend_class in BACKENDS:
+        if name and name != 'auto' and name != backend_name:
+            continue
+        try:
+            return backend_class()
+        except (ImportError, TypeError):
+            continue
+    return StdlibBackend()
+
+
+_backend = get_backend(os.environ.get('ZENGINE_JSON_BACKEND'))
+
+#: Name of the active backend
+BACKEND_NAME = _backend.name
+
+#: Serializes given object to JSON string
+dumps = _backend.dumps
+
+#: Deserializes given JSON string (or bytes) to python object
+loads = _backend.loads
+
+#: Serializes given object exactly as ``json.dumps`` does, whatever the backend is.
+#: Used where stored values are matched by their serialized form, e.g. list items in redis.
+stable_dumps = StdlibBackend.dumps
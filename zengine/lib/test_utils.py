@@ -4,6 +4,8 @@ from time import sleep
 import json
 import os
 
+import pika
+
 from pyoko.conf import settings
 from pyoko.manage import FlushDB, LoadData
 from pyoko.lib.utils import pprnt
@@ -130,10 +132,7 @@ class BaseTestClient(Worker):
                                    'current_lane': self.current.task.parent.task_spec.lane,
                                    'current_step': self.current.task.parent.task_spec.name}
 
-        post_data = {'data': data,
-                     '_zops_remote_ip': '127.0.0.1',
-                     '_zops_source': 'Remote',
-                     }
+        post_data = {'data': data}
         log.info("PostData : %s" % post_data)
         print("PostData : %s" % post_data)
         return post_data
@@ -141,7 +140,10 @@ class BaseTestClient(Worker):
     def post(self, wf_meta=True, **data):
         post_data = json.dumps(self._prepare_post(wf_meta, data))
         fake_method = type('FakeMethod', (object,), {'routing_key': self.sess_id})
-        self.handle_message(None, fake_method, None, post_data)
+        properties = pika.BasicProperties(headers={'_zops_sess_id': self.sess_id,
+                                                   '_zops_remote_ip': '127.0.0.1',
+                                                   '_zops_source': 'Remote'})
+        self.handle_message(None, fake_method, properties, post_data)
         # update client token from response
         self.token = self.response_wrapper.token
         return self.response_wrapper
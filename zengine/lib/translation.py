@@ -7,7 +7,8 @@
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
 
-from datetime import datetime
+import functools
+from datetime import date, datetime
 from collections import defaultdict
 import gettext as gettextlib
 from babel import Locale, UnknownLocaleError, dates, numbers, lists
@@ -84,6 +85,9 @@ class InstalledLocale(object):
     # just show untranslated messages for everything
     _active_catalogs = defaultdict(gettextlib.NullTranslations)
     _translation_catalogs = _load_translations()
+    # (domain, message) -> translation caches of languages
+    _active_cache = {}
+    _translation_caches = {'': _active_cache}
 
     @classmethod
     def install_language(cls, language_code):
@@ -105,6 +109,7 @@ class InstalledLocale(object):
             log.warning('Unknown language %s, falling back to %s', language_code, default)
             cls._active_catalogs = cls._translation_catalogs[default]
             cls.language = default
+        cls._active_cache = cls._translation_caches.setdefault(cls.language, {})
 
     @classmethod
     def install_locale(cls, locale_code, locale_type):
@@ -177,11 +182,48 @@ def gettext(message, domain=DEFAULT_DOMAIN):
     Returns:
         unicode: The translated message.
     """
-
+    cache = InstalledLocale._active_cache
+    try:
+        return cache[(domain, message)]
+    except KeyError:
+        pass
     if six.PY2:
-        return InstalledLocale._active_catalogs[domain].ugettext(message)
+        translated = InstalledLocale._active_catalogs[domain].ugettext(message)
     else:
-        return InstalledLocale._active_catalogs[domain].gettext(message)
+        translated = InstalledLocale._active_catalogs[domain].gettext(message)
+    if len(cache) < settings.TRANSLATION_CACHE_SIZE:
+        cache[(domain, message)] = translated
+    return translated
+
+
+class LazyTranslation(LazyProxy):
+    """
+    Lazy string which is translated once per installed language.
+
+    Unlike a LazyProxy with disabled cache, the translation is kept until
+    another language gets installed.
+    """
+    __slots__ = ['_translation']
+
+    def __init__(self, func, *args, **kwargs):
+        super(LazyTranslation, self).__init__(func, *args, **kwargs)
+        object.__setattr__(self, '_translation', (None, None))
+
+    @property
+    def value(self):
+        language, value = self._translation
+        if language != InstalledLocale.language:
+            language = InstalledLocale.language
+            value = self._func(*self._args, **self._kwargs)
+            object.__setattr__(self, '_translation', (language, value))
+        return value
+
+    def __copy__(self):
+        return LazyTranslation(self._func, *self._args, **self._kwargs)
+
+    def __deepcopy__(self, memo):
+        # messages are immutable
+        return self.__copy__()
 
 
 def gettext_lazy(message, domain=DEFAULT_DOMAIN):
@@ -216,7 +258,7 @@ def gettext_lazy(message, domain=DEFAULT_DOMAIN):
             the text is actually used.
 
     """
-    return LazyProxy(gettext, message, domain=domain, enable_cache=False)
+    return LazyTranslation(gettext, message, domain=domain)
 
 
 def ngettext(singular, plural, n, domain=DEFAULT_DOMAIN):
@@ -285,7 +327,7 @@ def ngettext_lazy(singular, plural, n, domain=DEFAULT_DOMAIN):
         unicode: The correct pluralization, with the translation being
                  delayed until the message is used.
     """
-    return LazyProxy(ngettext, singular, plural, n, domain=domain, enable_cache=False)
+    return LazyTranslation(ngettext, singular, plural, n, domain=domain)
 
 
 def markonly(message):
@@ -325,9 +367,44 @@ def markonly(message):
     return message
 
 
-def _wrap_locale_formatter(fn, locale_type):
+_locales = {}
+
+
+def get_locale(locale_code):
+    """Get the Babel `Locale` for `locale_code`.
+
+    Locales are parsed once per process. If Babel doesn't recognise the locale,
+    the locale of the default language is returned.
+
+    Args:
+        locale_code (str): Locale identifier such as 'tr_TR', or a `Locale` instance.
+    Returns:
+        babel.Locale: The locale.
+    """
+    if isinstance(locale_code, Locale):
+        return locale_code
+    try:
+        return _locales[locale_code]
+    except KeyError:
+        pass
+    try:
+        locale = Locale.parse(locale_code)
+    except (UnknownLocaleError, ValueError, TypeError):
+        log.warning("Can't do formatting for language code {locale}, "
+                    "falling back to default {default}".format(locale=locale_code,
+                                                               default=settings.DEFAULT_LANG))
+        locale = Locale.parse(settings.DEFAULT_LANG)
+    _locales[locale_code] = locale
+    return locale
+
+
+def _wrap_locale_formatter(fn, locale_type, format_type=None):
     """Wrap a Babel data formatting function to automatically format
-    for currently installed locale."""
+    for currently installed locale.
+
+    If `format_type` is given, calls with only a value, a format and a locale
+    use the cached formatter of `get_formatter` instead of the Babel function.
+    """
 
     def wrapped_locale_formatter(*args, **kwargs):
         """A Babel formatting function, wrapped to automatically use the
@@ -341,41 +418,130 @@ def _wrap_locale_formatter(fn, locale_type):
         To learn more about this function, check the documentation of Babel for the function of
         the same name.
         """
-        # Get the current locale from the class
-        kwargs_ = {'locale': getattr(InstalledLocale, locale_type)}
-        # By creating a dict then updating it, we allow locale to be overridden
-        kwargs_.update(kwargs)
-        try:
-            formatted = fn(*args, **kwargs_)
-        except UnknownLocaleError:
-            log.warning(
-                """Can\'t do formatting for language code {locale},
-                           falling back to default {default}""".format(
-                    locale=kwargs_['locale'],
-                    default=settings.DEFAULT_LANG)
-            )
-            kwargs_['locale'] = settings.DEFAULT_LANG
-            formatted = fn(*args, **kwargs_)
-        return formatted
+        if format_type and len(args) <= 2 and set(kwargs) <= {'format', 'locale'}:
+            value = args[0] if args else None
+            format = args[1] if len(args) > 1 else kwargs.get('format')
+            return get_formatter(format_type, format, kwargs.get('locale'))(value)
+        kwargs['locale'] = get_locale(kwargs.get('locale') or getattr(InstalledLocale, locale_type))
+        return fn(*args, **kwargs)
 
     return wrapped_locale_formatter
 
 
+def _compile_date_formatter(locale, format):
+    if format in ('full', 'long', 'medium', 'short'):
+        format = dates.get_date_format(format, locale=locale)
+    pattern = dates.parse_pattern(format)
+
+    def format_date_value(value):
+        # same as Babel, None is formatted as the current date
+        if value is None:
+            value = date.today()
+        elif isinstance(value, datetime):
+            value = value.date()
+        return pattern.apply(value, locale)
+
+    return format_date_value
+
+
+def _compile_number_formatter(formats_attr):
+    def compile_number_formatter(locale, format):
+        pattern = numbers.parse_pattern(format or getattr(locale, formats_attr).get(None))
+        return lambda value: pattern.apply(value, locale)
+
+    return compile_number_formatter
+
+
+def _compile_babel_formatter(fn):
+    def compile_babel_formatter(locale, format):
+        return functools.partial(fn, format=format, locale=locale)
+
+    return compile_babel_formatter
+
+
+# format type -> (formatter compiler, locale type, default format)
+_FORMAT_TYPES = {
+    'date': (_compile_date_formatter, 'datetime', 'medium'),
+    # time zone handling of these is left to Babel
+    'datetime': (_compile_babel_formatter(dates.format_datetime), 'datetime', 'medium'),
+    'time': (_compile_babel_formatter(dates.format_time), 'datetime', 'medium'),
+    'decimal': (_compile_number_formatter('decimal_formats'), 'number', None),
+    'percent': (_compile_number_formatter('percent_formats'), 'number', None),
+    'scientific': (_compile_number_formatter('scientific_formats'), 'number', None),
+}
+
+_formatters = {}
+
+
+def get_formatter(format_type, format=None, locale=None):
+    """Get a formatting function of a single value, for the currently installed locale.
+
+    Locale data and format patterns are resolved once per (locale, format type, pattern),
+    so the returned function is much faster than the Babel functions when many values
+    are formatted. The wrapped ``format_date``, ``format_datetime``, ``format_time``,
+    ``format_decimal``, ``format_percent`` and ``format_scientific`` functions use these
+    formatters too, unless they are called with extra Babel arguments.
+
+    .. code-block:: python
+
+        from zengine.lib.translation import get_formatter
+        format_date = get_formatter('date', 'short')
+        [format_date(d) for d in dates]
+
+    Args:
+        format_type (str): One of 'date', 'datetime', 'time', 'decimal', 'percent'
+            and 'scientific'.
+        format (str): Format name ('short', 'medium', 'long', 'full') or pattern for dates,
+            pattern for numbers. Defaults to 'medium' for dates and to the default
+            pattern of the locale for numbers.
+        locale (str): Overrides the installed locale.
+    Returns:
+        function: Formatter that takes a value and returns the formatted unicode string.
+    """
+    compiler, locale_type, default_format = _FORMAT_TYPES[format_type]
+    key = (locale or getattr(InstalledLocale, locale_type), format_type,
+           format or default_format)
+    try:
+        return _formatters[key]
+    except KeyError:
+        formatter = compiler(get_locale(key[0]), key[2])
+        _formatters[key] = formatter
+        return formatter
+
+
+def format_many(values, format_type, format=None, locale=None):
+    """Format a list of values with the same formatter, e.g. a column of a list view.
+
+    Unlike the single value functions, `None` values are not formatted (i.e. they
+    are not replaced with the current date), they are returned as `None`.
+
+    Args:
+        values (list): Values to be formatted.
+        format_type (str): Type of the values, see `get_formatter`.
+        format (str): Format name or pattern, see `get_formatter`.
+        locale (str): Overrides the installed locale.
+    Returns:
+        list: Formatted unicode strings.
+    """
+    formatter = get_formatter(format_type, format, locale)
+    return [None if value is None else formatter(value) for value in values]
+
+
 # Date and Time
-format_date = _wrap_locale_formatter(dates.format_date, 'datetime')
-format_datetime = _wrap_locale_formatter(dates.format_datetime, 'datetime')
+format_date = _wrap_locale_formatter(dates.format_date, 'datetime', 'date')
+format_datetime = _wrap_locale_formatter(dates.format_datetime, 'datetime', 'datetime')
 format_interval = _wrap_locale_formatter(dates.format_interval, 'datetime')
-format_time = _wrap_locale_formatter(dates.format_time, 'datetime')
+format_time = _wrap_locale_formatter(dates.format_time, 'datetime', 'time')
 format_timedelta = _wrap_locale_formatter(dates.format_timedelta, 'datetime')
 get_timezone_name = _wrap_locale_formatter(dates.get_timezone_name, 'datetime')
 get_day_names = _wrap_locale_formatter(dates.get_day_names, 'datetime')
 get_month_names = _wrap_locale_formatter(dates.get_month_names, 'datetime')
 
 # Number
-format_decimal = _wrap_locale_formatter(numbers.format_decimal, 'number')
+format_decimal = _wrap_locale_formatter(numbers.format_decimal, 'number', 'decimal')
 format_number = _wrap_locale_formatter(numbers.format_number, 'number')
-format_scientific = _wrap_locale_formatter(numbers.format_scientific, 'number')
-format_percent = _wrap_locale_formatter(numbers.format_percent, 'number')
+format_scientific = _wrap_locale_formatter(numbers.format_scientific, 'number', 'scientific')
+format_percent = _wrap_locale_formatter(numbers.format_percent, 'number', 'percent')
 format_currency = _wrap_locale_formatter(numbers.format_currency, 'number')
 format_list = _wrap_locale_formatter(lists.format_list, 'number')
 
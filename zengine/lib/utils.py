@@ -10,6 +10,9 @@ class DotDict(dict):
     """
 
     def __getattr__(self, attr):
+        # special method lookups (e.g. __getnewargs__ of pickle) shouldn't return None
+        if attr.startswith('__') and attr.endswith('__'):
+            raise AttributeError(attr)
         return self.get(attr, None)
 
     __setattr__ = dict.__setitem__
@@ -7,6 +7,6 @@
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
 from zengine.config import settings
-from zengine.tornado_server.get_logger import get_logger
+from zengine.tornado_server.get_logger import get_logger, Payload
 
 log = get_logger(settings)
@@ -15,7 +15,6 @@ import tempfile
 from distutils.errors import DistutilsError
 
 from pyoko.db.adapter.db_riak import BlockSave, BlockDelete
-from pyoko.exceptions import ObjectDoesNotExist
 from pyoko.lib.utils import get_object_from_path
 from pyoko.manage import *
 from zengine.views.crud import SelectBoxCache
@@ -34,47 +33,47 @@ class UpdatePermissions(Command):
 
     Args:
         dry: Dry run. Do nothing, just list.
+        force: Ignore cached permissions of workflows.
     """
     CMD_NAME = 'update_permissions'
     HELP = 'Syncs permissions with DB'
     PARAMS = [
         {'name': 'dry', 'action': 'store_true', 'help': 'Dry run, just list new found permissions'},
+        {'name': 'force', 'action': 'store_true',
+         'help': 'Parse all workflow diagrams, even if they are not changed since last run'},
     ]
 
     def run(self):
         """
         Creates new permissions.
+
+        Existing permission codes are fetched with a single query,
+        new permissions are saved in a block. Permissions of unchanged
+        workflow diagrams are read from
+        :class:`~zengine.auth.permissions.WFPermissionCache`.
         """
         from pyoko.lib.utils import get_object_from_path
+        from zengine.auth.permissions import WFPermissionCache
         from zengine.config import settings
         model = get_object_from_path(settings.PERMISSION_MODEL)
         perm_provider = get_object_from_path(settings.PERMISSION_PROVIDER)
-        existing_perms = []
-        new_perms = []
+        if self.manager.args.force:
+            WFPermissionCache.flush()
+        existing_codes = set(model.objects.all().values_list('code'))
+        existing_perms = set()
+        new_perms = {}
         for code, name, desc in perm_provider():
             code = six.text_type(code)
-            if self.manager.args.dry:
-                exists = model.objects.filter(code=code, name=name)
-                if exists:
-                    perm = exists[0]
-                    new = False
-                else:
-                    new = True
-                    perm = model(code=code, name=name)
-            else:
-                try:
-                    perm = model.objects.get(code)
-                    existing_perms.append(perm)
-                except ObjectDoesNotExist:
-                    perm = model(description=desc, code=code, name=name)
-                    perm.key = code
+            if code in existing_codes:
+                existing_perms.add(code)
+            elif code not in new_perms:
+                new_perms[code] = model(description=desc, code=code, name=name)
+                new_perms[code].key = code
+        new_perms = list(new_perms.values())
+        if new_perms and not self.manager.args.dry:
+            with BlockSave(model):
+                for perm in new_perms:
                     perm.save()
-                    new_perms.append(perm)
-                    # perm, new = model.objects.get_or_create({'description': desc}, code=code, name=name)
-                    # if new:
-                    #     new_perms.append(perm)
-                    # else:
-                    #     existing_perms.append(perm)
 
         report = "\n\n%s permission(s) were found in DB. " % len(existing_perms)
         if new_perms:
@@ -84,7 +83,9 @@ class UpdatePermissions(Command):
 
         if new_perms:
             if not self.manager.args.dry:
+                from zengine.views.permissions import PermissionTreeCache
                 SelectBoxCache.flush(model.__name__)
+                PermissionTreeCache.flush()
             report += 'Total %s perms exists.' % (len(existing_perms) + len(new_perms))
             report = "\n + " + "\n + ".join([p.name or p.code for p in new_perms]) + report
         if self.manager.args.dry:
@@ -427,9 +428,30 @@ class ListSysViews(Command):
                 print("  |_   %s" % view)
 
 
+def _compile_diagram(args):
+    """
+    Process pool worker of :class:`LoadDiagrams`.
+
+    Returns:
+        (spec, error message) tuple.
+    """
+    from zengine.lib.camunda_parser import ZopsSerializer
+    wf_name, content = args
+    try:
+        return ZopsSerializer().deserialize_workflow_spec(content, wf_name), None
+    except Exception as e:
+        return None, "%s: %s" % (type(e).__name__, e)
+
+
 class LoadDiagrams(Command, BaseThreadedCommand):
     """
     Loads wf diagrams from disk to DB
+
+    Content hashes of all workflows are fetched with a single query,
+    unchanged diagrams are skipped. Changed diagrams are compiled in
+    parallel processes and their specs are stored in
+    :class:`~zengine.lib.cache.WFSpecCache`. Activities of compiled
+    specs are resolved and cached by :class:`~zengine.lib.activities.ActivityRegistry`.
     """
 
     CMD_NAME = 'load_diagrams'
@@ -465,28 +487,108 @@ class LoadDiagrams(Command, BaseThreadedCommand):
 
         self.count = 0
 
-        self.do_with_submit(self.load_diagram, paths, threads=self.manager.args.threads)
+        diagrams = []
+        for wf_name, content, spec, error in self.compile_diagrams(
+                self.get_changed_diagrams(paths)):
+            if error:
+                print("%s cannot be loaded: %s" % (wf_name.upper(), error))
+            else:
+                diagrams.append((wf_name, content, spec))
+
+        self.do_with_submit(self.load_diagram, diagrams, threads=self.manager.args.threads)
 
         WFSpecNames().refresh()
 
         print("%s BPMN file loaded" % self.count)
+        self.check_activities([spec for wf_name, content, spec in diagrams])
+
+    @staticmethod
+    def check_activities(specs):
+        """
+        Resolves and caches the activities of specs, so workers don't need to
+        search them under ACTIVITY_MODULES_IMPORT_PATHS.
+        Prints the activities that can't be found.
+        """
+        from zengine.lib.activities import ActivityRegistry
+        from zengine.lib.exceptions import ConfigurationError
+        try:
+            ActivityRegistry().register_specs(specs)
+        except ConfigurationError as e:
+            print(e)
+
+    def get_changed_diagrams(self, paths):
+        """
+        Compares content hashes of diagrams with the hashes of loaded workflows.
+
+        Args:
+            paths: (wf name, xml content) tuples.
+
+        Returns:
+            List of (wf name, xml content) tuples of new or updated diagrams.
+        """
+        from zengine.lib.camunda_parser import content_hash
+        from zengine.models.workflow_manager import BPMNWorkflow
+        hashes = {}
+        if not self.manager.args.force:
+            hashes = dict((data['name'], data.get('content_hash'))
+                          for data, key in BPMNWorkflow.objects.all().data())
+        changed = []
+        for wf_name, content in paths:
+            content = self._tmp_fix_diagram(content)
+            if hashes.get(wf_name) != content_hash(content):
+                changed.append((wf_name, content))
+        return changed
+
+    @staticmethod
+    def compile_diagrams(diagrams):
+        """
+        Compiles workflow specs of diagrams. If there are more than
+        :attr:`~zengine.settings.PARALLEL_PARSE_THRESHOLD` of them,
+        they are compiled in parallel processes.
+
+        Args:
+            diagrams: (wf name, xml content) tuples.
+
+        Returns:
+            List of (wf name, xml content, spec, error message) tuples.
+        """
+        from multiprocessing import Pool, cpu_count
+        from zengine.config import settings
+        if len(diagrams) >= settings.PARALLEL_PARSE_THRESHOLD:
+            pool = Pool(min(cpu_count(), len(diagrams)))
+            try:
+                results = pool.map(_compile_diagram, diagrams)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_compile_diagram(diagram) for diagram in diagrams]
+        return [(wf_name, content, spec, error)
+                for (wf_name, content), (spec, error) in zip(diagrams, results)]
 
-    def load_diagram(self, paths):
+    def load_diagram(self, diagram):
+        from zengine.lib.cache import WFSpecCache
+        from zengine.lib.camunda_parser import content_hash
         from zengine.models.workflow_manager import DiagramXML, BPMNWorkflow, RunningInstancesExist
 
-        wf_name, content = paths
+        wf_name, content, spec = diagram
         key = 'bpmn_workflow_%s' % wf_name
         wf, wf_is_new = BPMNWorkflow.objects.get_or_create(name=wf_name, key=key)
-        content = self._tmp_fix_diagram(content)
         diagram, diagram_is_updated = DiagramXML.get_or_create_by_content(wf_name, content)
         if wf_is_new or diagram_is_updated or self.manager.args.force:
-            self.count+=1
+            self.count += 1
             print("%s created or updated" % wf_name.upper())
             try:
                 wf.set_xml(diagram, self.manager.args.force)
             except RunningInstancesExist as e:
                 print(e.message)
                 print("Give \"--force\" parameter to enforce")
+                return
+        else:
+            # loaded before content hashes were recorded
+            wf.content_hash = content_hash(content)
+            wf.save()
+        WFSpecCache(wf_name).set_spec(wf.content_hash, spec)
 
     def _clear_models(self):
         from zengine.models.workflow_manager import DiagramXML, BPMNWorkflow, WFInstance, \
@@ -501,7 +603,8 @@ class LoadDiagrams(Command, BaseThreadedCommand):
         c = len(TaskInvitation.objects.delete())
         print("%s TaskInvitation object deleted" % c)
 
-    def _tmp_fix_diagram(self, content):
+    @staticmethod
+    def _tmp_fix_diagram(content):
         # Temporary solution for easier transition from old to new xml format
         # TODO: Will be removed after all diagrams converted.
         return content.replace(
@@ -685,3 +788,382 @@ class ClearCache(Command):
                     print("All objects deleted from cache ")
         else:
             print("\"%s\" not a legal argument!" % prefix_name)
+
+
+class BenchmarkJSON(Command):
+    """
+    Compares available JSON codec backends over representative payloads.
+    """
+    CMD_NAME = 'benchmark_json'
+    HELP = 'Measures serialization speed of JSON codec backends'
+    PARAMS = [
+        {'name': 'number', 'default': 2000, 'help': 'Number of calls per measurement'},
+    ]
+
+    def run(self):
+        from zengine.lib import json_interface
+        from zengine.lib.benchmark import measure, print_table
+        number = int(self.manager.args.number)
+        backends = []
+        for name, backend_class in json_interface.BACKENDS:
+            try:
+                backends.append(backend_class())
+            except (ImportError, TypeError):
+                print("%s backend is not available" % name)
+        print("Active backend: %s\n" % json_interface.BACKEND_NAME)
+        rows = []
+        for payload_name, payload in self._get_payloads():
+            for backend in backends:
+                encoded = backend.dumps(payload)
+                rows.append((payload_name, backend.name, len(encoded),
+                             measure(lambda: backend.dumps(payload), number),
+                             measure(lambda: backend.loads(encoded), number)))
+        print_table(['payload', 'backend', 'bytes', 'dumps (us)', 'loads (us)'], rows)
+
+    @staticmethod
+    def _get_payloads():
+        from datetime import datetime
+        from uuid import uuid4
+        from zengine.lib.translation import gettext_lazy as __
+        wf_state = {
+            'step': [[[str(i), 'UserTask_%s' % i, 16, {}] for i in range(40)], 1],
+            'data': {'object_id': uuid4().hex, 'cmd': 'save', 'flow': None,
+                     'ListForm': {'name': 'x' * 40, 'surname': 'y' * 40}},
+            'name': 'crud', 'wf_id': uuid4().hex, 'pool': {'lane1': uuid4().hex},
+            'in_external': False, 'finished': False, 'role_id': uuid4().hex,
+        }
+        form_output = {
+            'forms': {
+                'schema': {'title': __(u'Workflow'), 'type': 'object', 'required': [],
+                           'properties': dict(('field_%s' % i, {
+                               'type': 'string', 'title': __(u'Name'), 'default': None,
+                               'value': '', 'required': True}) for i in range(30))},
+                'form': ['field_%s' % i for i in range(30)],
+                'model': dict(('field_%s' % i, 'value %s' % i) for i in range(30)),
+            },
+            'token': uuid4().hex, 'reply_timestamp': 1476887447.0,
+        }
+        message_list = {
+            'messages': [{'content': u'Merhaba dünya ' * 5, 'type': 2,
+                          'updated_at': datetime.now(), 'timestamp': datetime.now(),
+                          'is_update': False, 'attachments': [], 'title': '', 'url': '',
+                          'sender_name': 'John Doe', 'sender_key': uuid4().hex,
+                          'channel_key': uuid4().hex, 'cmd': 'message',
+                          'avatar_url': 'http://example.com/a.jpg',
+                          'key': uuid4().hex} for _ in range(20)],
+            'cmd': 'channel_history',
+        }
+        return [('wf_state', wf_state), ('form_output', form_output),
+                ('message_list', message_list)]
+
+
+class BenchmarkLogging(Command):
+    """
+    Measures per request logging overhead of eagerly formatted log messages
+    against lazy :class:`~zengine.log.Payload` arguments, with DEBUG level off and on.
+    """
+    CMD_NAME = 'benchmark_logging'
+    HELP = 'Measures logging overhead of a simulated request with DEBUG off and on'
+    PARAMS = [
+        {'name': 'number', 'default': 2000, 'help': 'Number of simulated requests'},
+    ]
+
+    def run(self):
+        import io
+        import logging
+        from pprint import pformat
+        from zengine.lib.benchmark import measure, print_table
+        from zengine.tornado_server.get_logger import Payload, PayloadFilter
+        number = int(self.manager.args.number)
+        input_data = {'data': {'wf': 'crud', 'token': 'x' * 32, 'cmd': 'save',
+                               'form': dict(('field_%s' % i, 'value %s' % i) for i in range(50))}}
+        output = {'forms': {'model': dict(('field_%s' % i, 'value %s' % i) for i in range(50)),
+                            'form': ['field_%s' % i for i in range(50)]}, 'token': 'x' * 32}
+        task_data = dict(('key_%s' % i, list(range(20))) for i in range(20))
+        logger = logging.getLogger('zengine_benchmark_logging')
+        logger.propagate = False
+        logger.addHandler(logging.StreamHandler(io.StringIO()))
+        logger.addFilter(PayloadFilter(max_length=settings.LOG_PAYLOAD_MAX_LENGTH))
+
+        def eager_request():
+            logger.debug("\n\nINPUT DATA: %s" % input_data)
+            for i in range(3):
+                logger.debug("DATA: %s" % pformat(task_data))
+            logger.info("OUTPUT for %s: %s" % ('sess_id', output))
+
+        def lazy_request():
+            logger.debug("\n\nINPUT DATA: %s", Payload(input_data))
+            for i in range(3):
+                logger.debug("DATA: %s", Payload(task_data, pretty=True))
+            logger.info("OUTPUT for %s: %s", 'sess_id', Payload(output))
+
+        rows = []
+        for level_name, level in (('WARNING', logging.WARNING),
+                                  ('INFO', logging.INFO),
+                                  ('DEBUG', logging.DEBUG)):
+            logger.setLevel(level)
+            rows.append((level_name,
+                         measure(eager_request, number),
+                         measure(lazy_request, number)))
+        print_table(['level', 'eager (us/request)', 'lazy (us/request)'], rows)
+
+
+class BenchmarkTranslation(Command):
+    """
+    Compares lazy translations with disabled cache (the former
+    ``gettext_lazy`` implementation) to cached :class:`~zengine.lib.translation.LazyTranslation`
+    objects, over the field titles of all models.
+    """
+    CMD_NAME = 'benchmark_translation'
+    HELP = 'Measures speed and memory usage of lazy translations'
+    PARAMS = [
+        {'name': 'language', 'default': 'tr', 'help': 'Language to be installed'},
+        {'name': 'number', 'default': 100, 'help': 'Number of calls per measurement'},
+    ]
+
+    def run(self):
+        from importlib import import_module
+        from babel.support import LazyProxy
+        from pyoko.model import model_registry
+        from zengine.lib import translation
+        from zengine.lib.benchmark import measure, print_table
+        number = int(self.manager.args.number)
+        import_module(settings.MODELS_MODULE)
+        messages = set()
+        for model in model_registry.get_base_models():
+            for field_name, field in model._fields.items():
+                messages.add(six.text_type(field.title or field_name))
+        messages = sorted(messages)
+        translation.InstalledLocale.install_language(self.manager.args.language)
+        catalogs = translation.InstalledLocale._active_catalogs
+        if six.PY2:
+            lookup = lambda msg, domain: catalogs[domain].ugettext(msg)
+        else:
+            lookup = lambda msg, domain: catalogs[domain].gettext(msg)
+        proxies = [LazyProxy(lookup, msg, translation.DEFAULT_DOMAIN, enable_cache=False)
+                   for msg in messages]
+        lazies = [translation.gettext_lazy(msg) for msg in messages]
+
+        def render(items):
+            for item in items:
+                six.text_type(item)
+
+        render(lazies)
+        cache_size = sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in
+                         translation.InstalledLocale._active_cache.items())
+        rows = [
+            ('LazyProxy (no cache)', measure(lambda: render(proxies), number),
+             sum(sys.getsizeof(p) for p in proxies), 0),
+            ('LazyTranslation', measure(lambda: render(lazies), number),
+             sum(sys.getsizeof(p) + sys.getsizeof(p._translation) for p in lazies),
+             cache_size),
+        ]
+        print("%s messages\n" % len(messages))
+        print_table(['implementation', 'render all (us)', 'objects (bytes)', 'cache (bytes)'],
+                    rows)
+
+
+class MessagingStats(Command):
+    """
+    Displays fan-out size and publish latency of messages per channel type,
+    as recorded by :class:`~zengine.messaging.publisher.MessagePublisher`.
+    """
+    CMD_NAME = 'messaging_stats'
+    HELP = 'Displays message publish statistics per channel type'
+    PARAMS = [
+        {'name': 'reset', 'action': 'store_true', 'help': 'Reset the statistics after display'},
+    ]
+
+    def run(self):
+        from zengine.lib.benchmark import print_table
+        from zengine.messaging.lib import PublishStats
+        from zengine.messaging.model import CHANNEL_TYPES
+        rows = []
+        for typ, name in CHANNEL_TYPES:
+            stats = PublishStats(typ).get_stats()
+            if not stats.get('messages'):
+                continue
+            rows.append((name, stats['messages'],
+                         stats['avg_fanout'], stats['max_fanout'],
+                         stats['avg_latency_us'], stats['max_latency_us']))
+        print_table(['channel type', 'messages', 'avg fanout', 'max fanout',
+                     'avg latency (us)', 'max latency (us)'], rows)
+        if self.manager.args.reset:
+            PublishStats.flush()
+
+
+class RebuildTaskIndex(Command):
+    """
+    Rebuilds the prefix search index of task invitations.
+    """
+    CMD_NAME = 'rebuild_task_index'
+    HELP = 'Rebuilds the search index of task invitations'
+    PARAMS = []
+
+    def run(self):
+        from zengine.models import TaskSearchIndex
+        print("%s task invitations indexed" % TaskSearchIndex.rebuild())
+
+
+class BuildSelectBoxIndex(Command):
+    """
+    Builds the search index of select boxes for models with search fields.
+    """
+    CMD_NAME = 'build_select_box_index'
+    HELP = 'Builds the search index of select boxes'
+    PARAMS = [
+        {'name': 'model', 'default': None,
+         'help': 'Model name. Defaults to all models with search fields'},
+    ]
+
+    def run(self):
+        from pyoko.modelmeta import model_registry
+        if self.manager.args.model:
+            models = [model_registry.get_model(self.manager.args.model)]
+        else:
+            models = [model for model in model_registry.get_base_models()
+                      if model.Meta.search_fields]
+        for model in models:
+            print("%s: %s objects indexed" % (model.__name__, SelectBoxCache(model).build()))
+
+
+class ArchiveWorkflows(Command):
+    """
+    Moves finished workflow instances and task invitations
+    older than retention period to compressed archive files.
+    Reports the reduction in number and size of db records.
+    """
+    CMD_NAME = 'archive_workflows'
+    HELP = 'Archives old finished workflow instances and task invitations'
+    PARAMS = [
+        {'name': 'days', 'type': int, 'default': None,
+         'help': 'Retention period in days. Defaults to WF_ARCHIVE_RETENTION_DAYS'},
+        {'name': 'dry', 'action': 'store_true', 'help': 'Only measure what will be archived'},
+    ]
+
+    def run(self):
+        from zengine.lib.benchmark import print_table
+        from zengine.models import WFInstance, TaskInvitation, WorkflowArchiver
+        before = (WFInstance.objects.count(), TaskInvitation.objects.count())
+        stats = WorkflowArchiver(retention_days=self.manager.args.days).archive(
+            dry=self.manager.args.dry)
+        rows = [('WFInstance', before[0], stats['instances']),
+                ('TaskInvitation', before[1], stats['invitations'])]
+        print_table(['model', 'records', 'archived'], rows)
+        print("\nArchived data: %s bytes, %s bytes compressed" % (stats['raw_bytes'],
+                                                                  stats['archive_bytes']))
+
+
+class RestoreWorkflow(Command):
+    """
+    Restores an archived workflow instance with it's task invitations,
+    or an archived task invitation.
+    """
+    CMD_NAME = 'restore_workflow'
+    HELP = 'Restores an archived workflow instance or task invitation'
+    PARAMS = [
+        {'name': 'key', 'required': True, 'help': 'Key of WFInstance or TaskInvitation'},
+    ]
+
+    def run(self):
+        from zengine.models import WorkflowArchiver
+        obj = WorkflowArchiver().restore(self.manager.args.key)
+        if obj is None:
+            print("%s not found in archive" % self.manager.args.key)
+        else:
+            print("%s restored" % obj)
+
+
+class BenchmarkWFParse(Command):
+    """
+    Measures parse time and memory usage of workflow diagrams
+    found under WORKFLOW_PACKAGES_PATHS (which includes zengine's own diagrams).
+    """
+    CMD_NAME = 'benchmark_wf_parse'
+    HELP = 'Measures parse time and memory usage of workflow diagrams'
+    PARAMS = [
+        {'name': 'number', 'default': 20, 'help': 'Number of parses per measurement'},
+    ]
+
+    def run(self):
+        import xml.etree.ElementTree as ET
+        from zengine.lib.benchmark import measure, print_table
+        from zengine.lib.camunda_parser import DiagramExtensions, ZopsSerializer
+        try:
+            import tracemalloc
+        except ImportError:  # Python 2
+            tracemalloc = None
+        number = int(self.manager.args.number)
+        rows = []
+        for pth in settings.WORKFLOW_PACKAGES_PATHS:
+            for path in sorted(glob.glob("%s/*.bpmn" % pth)):
+                wf_name = os.path.basename(os.path.splitext(path)[0])
+                with open(path) as fp:
+                    content = LoadDiagrams._tmp_fix_diagram(fp.read())
+
+                def load_spec():
+                    DiagramExtensions._cache.clear()
+                    ZopsSerializer().deserialize_workflow_spec(content, wf_name)
+
+                memory = 'n/a'
+                if tracemalloc:
+                    tracemalloc.start()
+                    load_spec()
+                    memory = tracemalloc.get_traced_memory()[1] // 1024
+                    tracemalloc.stop()
+                rows.append((wf_name, len(content) // 1024,
+                             measure(lambda: ET.fromstring(content), number),
+                             measure(lambda: DiagramExtensions(ET.fromstring(content)), number),
+                             measure(load_spec, number),
+                             memory))
+        print_table(['workflow', 'size (KB)', 'xml parse (us)', 'extensions (us)',
+                     'spec (us)', 'spec peak mem (KB)'], rows)
+        if rows:
+            print("\nTotal spec parse time: %.2f ms" % (sum(r[4] for r in rows) / 1000))
+
+
+class BenchmarkCrudList(Command):
+    """
+    Compares CrudView object listing rendered from model instances
+    (with per row permission checks) to projected list rendering.
+    """
+    CMD_NAME = 'benchmark_crud_list'
+    HELP = 'Measures object listing render time of CrudView for various page sizes'
+    PARAMS = [
+        {'name': 'model', 'required': True, 'help': 'Model name'},
+        {'name': 'username', 'required': True, 'help': 'Username of the listing user'},
+        {'name': 'rows', 'default': '10,100,1000', 'help': 'Comma separated page sizes'},
+        {'name': 'number', 'default': 3, 'help': 'Number of renders per measurement'},
+    ]
+
+    def run(self):
+        from zengine.current import Current
+        from zengine.lib.benchmark import measure, print_table
+        from zengine.lib.cache import Session
+        from zengine.views.crud import CrudView, ListRenderer
+        number = int(self.manager.args.number)
+        user_model = get_object_from_path(settings.USER_MODEL)
+        session = Session()
+        session['user_id'] = user_model.objects.get(username=self.manager.args.username).key
+        current = Current(session=session, input={'model': self.manager.args.model})
+        view = CrudView(current)
+        list_fields = view.object.Meta.list_fields
+        rows = []
+        for page_size in [int(r) for r in self.manager.args.rows.split(',')]:
+            query = view.object.objects.all().order_by().set_params(rows=page_size)
+
+            def render_objects():
+                for obj in query:
+                    # permissions were checked for each row
+                    view._object_actions = None
+                    view._parse_object_actions(obj)
+
+            def render_projected():
+                view._object_actions = None
+                ListRenderer(view, list_fields).render(query)
+
+            rows.append((page_size, len(ListRenderer(view, list_fields).render(query)),
+                         measure(render_objects, number) / 1000,
+                         measure(render_projected, number) / 1000))
+        session.delete()
+        print_table(['page size', 'rows', 'model instances (ms)', 'projected (ms)'], rows)
@@ -6,16 +6,41 @@
 #
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
-import json
-
 import pika
 from passlib.handlers.pbkdf2 import pbkdf2_sha512
 
 from pyoko.conf import settings
+from pyoko.lib.utils import get_object_from_path
 from zengine.client_queue import BLOCKING_MQ_PARAMS, get_mq_connection
-from zengine.lib.cache import Cache
+from zengine.lib.cache import Cache, cache
+from zengine.lib import json_interface
 from zengine.log import log
 
+# KEYS[1]: counter, ARGV[1]: delta
+INCR_IF_EXISTS_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return redis.call('incrby', KEYS[1], ARGV[1])
+end
+"""
+
+_incr_if_exists = cache.register_script(INCR_IF_EXISTS_SCRIPT)
+
+# KEYS[1]: hash, ARGV: messages, fanout, latency, max fanout, max latency
+RECORD_PUBLISH_SCRIPT = """
+redis.call('hincrby', KEYS[1], 'messages', ARGV[1])
+redis.call('hincrby', KEYS[1], 'fanout', ARGV[2])
+redis.call('hincrby', KEYS[1], 'latency_us', ARGV[3])
+local fields = {'max_fanout', 'max_latency_us'}
+for i, field in ipairs(fields) do
+    local value = tonumber(ARGV[i + 3])
+    if value > tonumber(redis.call('hget', KEYS[1], field) or 0) then
+        redis.call('hset', KEYS[1], field, value)
+    end
+end
+"""
+
+_record_publish = cache.register_script(RECORD_PUBLISH_SCRIPT)
+
 
 class ConnectionStatus(Cache):
     """
@@ -29,6 +54,139 @@ class ConnectionStatus(Cache):
     def __init__(self, user_id):
         super(ConnectionStatus, self).__init__(user_id)
 
+    @classmethod
+    def get_many(cls, user_ids):
+        """
+        Online status of multiple users with a single cache call.
+
+        Args:
+            user_ids (list): User keys.
+
+        Returns:
+            Dict. User key -> boolean.
+        """
+        if not user_ids:
+            return {}
+        values = cache.mget([cls(user_id).key for user_id in user_ids])
+        return {user_id: bool(val and json_interface.loads(val))
+                for user_id, val in zip(user_ids, values)}
+
+
+class UserCard(Cache):
+    """
+    Cache object for the display data of users (name, avatar, avatar url).
+
+    Args:
+        user_id: User key.
+    """
+    PREFIX = 'UCARD'
+
+    def __init__(self, user_id):
+        super(UserCard, self).__init__(user_id)
+
+    @staticmethod
+    def make_card(user):
+        return {'name': user.full_name,
+                'avatar': user.avatar,
+                'avatar_url': user.get_avatar_url()}
+
+    @classmethod
+    def get_many(cls, user_ids):
+        """
+        Cards of multiple users. Missing cards are created
+        with a single db query and cached.
+
+        Args:
+            user_ids (list): User keys.
+
+        Returns:
+            Dict. User key -> card dict.
+        """
+        if not user_ids:
+            return {}
+        cards = {}
+        values = cache.mget([cls(user_id).key for user_id in user_ids])
+        for user_id, val in zip(user_ids, values):
+            if val is not None:
+                cards[user_id] = json_interface.loads(val)
+        missing = [user_id for user_id in user_ids if user_id not in cards]
+        if missing:
+            user_model = get_object_from_path(settings.USER_MODEL)
+            pipe = cache.pipeline(transaction=False)
+            for user in user_model.objects.filter(key__in=missing):
+                cards[user.key] = cls.make_card(user)
+                pipe.set(cls(user.key).key, json_interface.dumps(cards[user.key]),
+                         settings.MESSAGING_USER_CARD_LIFETIME)
+            pipe.execute()
+        return cards
+
+
+class MemberCount(Cache):
+    """
+    Cache object for the number of subscribers of a channel.
+
+    Args:
+        channel_key: Channel key.
+    """
+    PREFIX = 'MBRCNT'
+    SERIALIZE = False
+
+    def __init__(self, channel_key):
+        super(MemberCount, self).__init__(channel_key)
+
+    def update(self, delta):
+        """
+        Updates the count only if it's already cached.
+
+        Args:
+            delta (int): Change in number of members.
+        """
+        return _incr_if_exists(keys=[self.key], args=[delta])
+
+
+class PublishStats(Cache):
+    """
+    Counters of published messages of a channel type.
+
+    Stored as a hash of "messages", "fanout" and "latency_us" totals
+    and "max_fanout", "max_latency_us" values.
+
+    Args:
+        channel_type: Channel type, one of CHANNEL_TYPES.
+    """
+    PREFIX = 'PUBSTAT'
+    SERIALIZE = False
+
+    def __init__(self, channel_type):
+        super(PublishStats, self).__init__(str(channel_type))
+
+    def record(self, messages, fanout, latency_us, max_fanout, max_latency_us):
+        """
+        Adds a batch of publishes to the counters.
+
+        Args:
+            messages (int): Number of published messages.
+            fanout (int): Total number of recipients.
+            latency_us (int): Total publish time in microseconds.
+            max_fanout (int): Maximum recipients of a single message.
+            max_latency_us (int): Maximum publish time of a single message.
+        """
+        return _record_publish(keys=[self.key],
+                               args=[messages, fanout, latency_us, max_fanout, max_latency_us])
+
+    def get_stats(self):
+        """
+        Returns:
+            Dict of counters and averages.
+        """
+        stats = {k.decode() if isinstance(k, bytes) else k: int(v)
+                 for k, v in cache.hgetall(self.key).items()}
+        messages = stats.get('messages', 0)
+        if messages:
+            stats['avg_fanout'] = stats['fanout'] / float(messages)
+            stats['avg_latency_us'] = stats['latency_us'] / float(messages)
+        return stats
+
 
 class BaseUser(object):
     mq_connection = None
@@ -40,6 +198,24 @@ class BaseUser(object):
             cls.mq_connection, cls.mq_channel = get_mq_connection()
         return cls.mq_channel
 
+    def get_card(self):
+        """
+        Cached display data of the user.
+
+        Returns:
+            dict: name and avatar_url of the user.
+        """
+        card = UserCard(self.key)
+        return card.get() or card.set(UserCard.make_card(self),
+                                      settings.MESSAGING_USER_CARD_LIFETIME)
+
+    def clear_card(self):
+        """
+        Should be called after saving the user,
+        to reflect name or avatar changes to messaging.
+        """
+        UserCard(self.key).delete()
+
     def get_avatar_url(self):
         """
         Bu metot kullanıcıya ait avatar url'ini üretir.
@@ -77,7 +253,7 @@ class BaseUser(object):
                         sbs.channel.code_name.replace(self.key, '').replace('_', ''))
                     mq_channel.basic_publish(exchange=other_party,
                                              routing_key='',
-                                             body=json.dumps({
+                                             body=json_interface.dumps({
                                                  'cmd': 'user_status',
                                                  'channel_key': sbs.channel.key,
                                                  'channel_name': sbs.name,
@@ -195,8 +371,8 @@ class BaseUser(object):
         if via_queue:
             mq_channel.basic_publish(exchange='',
                                      routing_key=via_queue,
-                                     body=json.dumps(data))
+                                     body=json_interface.dumps(data))
         else:
             mq_channel.basic_publish(exchange=self.prv_exchange,
                                      routing_key='',
-                                     body=json.dumps(data))
+                                     body=json_interface.dumps(data))
@@ -6,7 +6,7 @@
 #
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
-import json
+from collections import OrderedDict, defaultdict
 from uuid import uuid4
 
 import pika
@@ -18,7 +18,12 @@ from pyoko.db.adapter.db_riak import BlockSave
 from pyoko.exceptions import IntegrityError
 from pyoko.fields import DATE_TIME_FORMAT
 from pyoko.lib.utils import get_object_from_path
-from zengine.client_queue import BLOCKING_MQ_PARAMS, get_mq_connection
+from zengine.client_queue import BLOCKING_MQ_PARAMS, get_mq_connection, JobPublisher
+from zengine.lib import json_interface
+from zengine.lib.cache import RecentMessages, WriteBehindQueue
+from zengine.lib.file_storage import LocalFileStorage
+from zengine.messaging.lib import ConnectionStatus, MemberCount, UserCard
+from zengine.messaging.publisher import MessagePublisher, MESSAGE_QUEUE
 from zengine.lib.utils import to_safe_str
 
 UserModel = get_object_from_path(settings.USER_MODEL)
@@ -52,6 +57,8 @@ class Channel(Model):
 
     mq_channel = None
     mq_connection = None
+    # channel types never change, so they're cached per process
+    _channel_types = {}
 
     typ = field.Integer("Tip", choices=CHANNEL_TYPES)
     name = field.String("Ad")
@@ -109,23 +116,213 @@ class Channel(Model):
 
     @classmethod
     def add_message(cls, channel_key, body, title=None, sender=None, url=None, typ=2,
-                    receiver=None):
-        mq_channel = cls._connect_mq()
+                    receiver=None, attachments=None):
+        """
+        Creates and publishes a new message.
+        Message is saved to db through :class:`~zengine.messaging.publisher.MessagePublisher`.
+
+        Args:
+            channel_key: Channel key.
+            body (str): Message text.
+            title (str): Message title.
+            sender: Sender user.
+            url (str): URL.
+            typ (int): Message type, one of MSG_TYPES.
+            receiver: Receiver user.
+            attachments (list): Dicts with "hash", "name" and "description" keys of
+                files which already stored in :data:`file_storage`.
+
+        Returns:
+            Message object.
+        """
         msg_object = Message(sender=sender, body=body, msg_title=title, url=url,
                              typ=typ, channel_id=channel_key, receiver=receiver, key=uuid4().hex)
         msg_object.setattr('unsaved', True)
-        mq_channel.basic_publish(exchange=channel_key,
-                                 routing_key='',
-                                 body=json.dumps(msg_object.serialize()))
-        return msg_object.save()
+        attachment_objects = [Attachment(channel_id=channel_key,
+                                         message=msg_object,
+                                         name=atch['name'],
+                                         description=atch.get('description', ''),
+                                         file_hash=atch['hash'],
+                                         size=file_storage.size(atch['hash']),
+                                         typ=1)
+                              for atch in attachments or []]
+        msg_data = msg_object.serialize()
+        if attachment_objects:
+            msg_data['attachments'] = [atch.serialize() for atch in attachment_objects]
+        channel_type, fanout = cls.get_fanout(channel_key)
+        MessagePublisher.publish([(channel_key, msg_data, fanout)], channel_type)
+        timestamp, = MessagePublisher.save([msg_object])
+        if attachment_objects:
+            for atch in attachment_objects:
+                atch.save()
+            # types will be detected from file contents
+            JobPublisher.publish('_zops_detect_attachment_types',
+                                 keys=[atch.key for atch in attachment_objects])
+        # same values with the ones we'll get when message is loaded from db
+        msg_data.update(is_update=True, updated_at=timestamp, timestamp=timestamp)
+        RecentMessages(channel_key).put(msg_data)
+        return msg_object
+
+    @classmethod
+    def add_notifications(cls, receivers, title, body, typ=1, url=None, sender=None):
+        """
+        Sends the same notification to private channels of many users.
+
+        Messages are published in a single batch and
+        queued to be saved together.
+
+        Args:
+            receivers (list): User objects.
+            title (str): Message title.
+            body (str): Message text.
+            typ (int): Message type, one of MSG_TYPES.
+            url (str): URL.
+            sender: Sender user.
+
+        Returns:
+            List of Message objects.
+        """
+        messages = []
+        publishes = []
+        for receiver in receivers:
+            channel_key = receiver.prv_exchange
+            msg_object = Message(sender=sender, body=body, msg_title=title, url=url,
+                                 typ=typ, channel_id=channel_key, receiver=receiver,
+                                 key=uuid4().hex)
+            msg_object.setattr('unsaved', True)
+            msg_data = msg_object.serialize()
+            publishes.append((channel_key, msg_data, 1))
+            messages.append(msg_object)
+        MessagePublisher.publish(publishes, 5)
+        timestamps = MessagePublisher.save(messages)
+        for (channel_key, msg_data, fanout), timestamp in zip(publishes, timestamps):
+            msg_data.update(is_update=True, updated_at=timestamp, timestamp=timestamp)
+            RecentMessages(channel_key).put(msg_data)
+        return messages
+
+    @classmethod
+    def get_fanout(cls, channel_key):
+        """
+        Type and number of subscribers of the channel,
+        read from cache for all channels but users' private channels.
+
+        Args:
+            channel_key: Channel key.
+
+        Returns:
+            (channel type, number of subscribers) tuple.
+        """
+        if channel_key.startswith('prv_'):
+            return 5, 1
+        typ = cls._channel_types.get(channel_key)
+        if typ is None:
+            typ = cls._channel_types[channel_key] = cls.objects.get(channel_key).typ
+        return typ, cls._get_member_count(channel_key)
+
+    @staticmethod
+    def _get_member_count(channel_key):
+        member_count = MemberCount(channel_key)
+        count = member_count.get()
+        if count is None:
+            count = member_count.set(Subscriber.objects.filter(channel_id=channel_key).count())
+        return int(count)
 
     def get_subscription_for_user(self, user_id):
         return self.subscriber_set.objects.get(user_id=user_id)
 
+    def get_member_count(self):
+        """
+        Number of subscribers. Cached and kept up to date by Subscriber hooks.
+
+        Returns:
+            int
+        """
+        return self._get_member_count(self.key)
+
+    def get_members(self, page=1, per_page=None):
+        """
+        Paginated member listing of the channel.
+
+        Names and avatars are read from cached user cards,
+        online statuses are read with a single cache call.
+
+        Args:
+            page (int): Page number, starting from 1.
+            per_page (int): Members per page.
+                Defaults to :attr:`~zengine.settings.MESSAGING_MEMBERS_PER_PAGE`.
+
+        Returns:
+            List of member dicts.
+        """
+        per_page = per_page or settings.MESSAGING_MEMBERS_PER_PAGE
+        user_ids = Subscriber.objects.filter(channel_id=self.key).order_by(
+            'timestamp').set_params(rows=per_page,
+                                    start=(page - 1) * per_page).values_list('user_id')
+        cards = UserCard.get_many(user_ids)
+        statuses = ConnectionStatus.get_many(user_ids)
+        return [{'key': user_id,
+                 'name': cards[user_id]['name'],
+                 'is_online': statuses[user_id],
+                 'avatar_url': cards[user_id]['avatar_url'],
+                 } for user_id in user_ids if user_id in cards]
+
     def get_last_messages(self):
         # TODO: Try to refactor this with https://github.com/rabbitmq/rabbitmq-recent-history-exchange
         return self.message_set.objects.order_by('-updated_at').all()[:20]
 
+    @classmethod
+    def get_recent_messages(cls, channel_key, before=None, amount=20, before_key=None):
+        """
+        Serialized latest messages of the channel from the
+        :class:`~zengine.lib.cache.RecentMessages` buffer.
+        Buffer will be filled from db if it's not exists.
+
+        While messages are waiting in the write-behind queue, buffer is not filled,
+        since db doesn't have them yet. Queued messages of the channel are added
+        to the ones read from db instead.
+
+        Args:
+            channel_key: Channel key.
+            before (str): Only return the messages older than this timestamp.
+            amount (int): Max number of messages.
+            before_key (str): Key of the message at ``before`` timestamp. If given, messages
+                with the same timestamp and a smaller key are returned too, as
+                :meth:`Message.paginate` does with a (timestamp, key) cursor.
+
+        Returns:
+            List of serialized messages, newest first.
+            None if buffer doesn't hold enough messages to answer.
+        """
+        if before is not None and not isinstance(before, six.string_types):
+            return None
+        recent_messages = RecentMessages(channel_key)
+        buffered = recent_messages.get_messages()
+        if buffered is None:
+            size = recent_messages.size
+            queue = WriteBehindQueue(MESSAGE_QUEUE)
+            pending = settings.MESSAGING_WRITE_BEHIND and queue.is_pending()
+            rows = list(Message.objects.filter(channel_id=channel_key).order_by(
+                '-updated_at').set_params(rows=size).data())
+            complete = len(rows) < size
+            if pending:
+                saved = set(key for data, key in rows)
+                rows = sorted(rows + [(item['data'], item['key']) for item in queue.get_items()
+                                      if item['data'].get('channel_id') == channel_key and
+                                      item['key'] not in saved],
+                              key=lambda row: (row[0]['updated_at'], row[1]), reverse=True)
+            messages = Message.serialize_rows(rows[:size])
+            buffered = messages, complete and len(rows) <= size
+            if not pending:
+                recent_messages.fill(*buffered)
+        messages, complete = buffered
+        if before is not None:
+            position = (before, before_key or '')
+            messages = sorted((msg for msg in messages
+                               if (msg['timestamp'] or '', msg['key']) < position),
+                              key=lambda msg: (msg['timestamp'] or '', msg['key']), reverse=True)
+        if len(messages) >= amount or complete:
+            return messages[:amount]
+
     @classmethod
     def _connect_mq(cls):
         if cls.mq_connection is None or cls.mq_connection.is_closed:
@@ -166,6 +363,8 @@ class Channel(Model):
 
     def post_delete(self):
         self.delete_exchange()
+        MemberCount(self.key).delete()
+        RecentMessages(self.key).delete()
 
     def post_save(self):
         self.create_exchange()
@@ -185,6 +384,8 @@ class Subscriber(Model):
 
     mq_channel = None
     mq_connection = None
+    # private exchanges declared by this process
+    _declared_exchanges = set()
 
     channel = Channel()
     typ = field.Integer("Tip", choices=CHANNEL_TYPES)
@@ -209,6 +410,8 @@ class Subscriber(Model):
     def _connect_mq(cls):
         if cls.mq_connection is None or cls.mq_connection.is_closed:
             cls.mq_connection, cls.mq_channel = get_mq_connection()
+            # exchanges may be gone with the previous connection (e.g. broker restart)
+            cls._declared_exchanges.clear()
         return cls.mq_channel
 
     def get_channel_listing(self):
@@ -270,10 +473,15 @@ class Subscriber(Model):
         But since this has a little performance cost,
         to be safe we always call it before binding to the channel we currently subscribe
         """
-        channel = self._connect_mq()
-        channel.exchange_declare(exchange=self.user.prv_exchange,
-                                 exchange_type='fanout',
-                                 durable=True)
+        self._declare_exchange(self._connect_mq(), UserModel.get_prv_exchange(self.user.key))
+
+    @classmethod
+    def _declare_exchange(cls, mq_channel, exchange):
+        if exchange not in cls._declared_exchanges:
+            mq_channel.exchange_declare(exchange=exchange,
+                                        exchange_type='fanout',
+                                        durable=True)
+            cls._declared_exchanges.add(exchange)
 
     @classmethod
     def mark_seen(cls, key, datetime_str):
@@ -293,17 +501,94 @@ class Subscriber(Model):
             self.user.send_client_cmd(self.get_channel_listing(), 'channel_subscription')
 
     def post_creation(self):
+        if hasattr(self, 'in_bulk'):
+            # done by bulk_subscribe
+            return
         self.create_exchange()
         self.bind_to_channel()
         self.inform_subscriber()
+        MemberCount(self.channel.key).update(1)
+
+    def post_delete(self):
+        MemberCount(self.channel.key).update(-1)
 
     def pre_creation(self):
-        if (self.channel.key == self.user.prv_exchange and
-                Subscriber.objects.filter(channel_id=self.user.prv_exchange).count()):
+        prv_exchange = UserModel.get_prv_exchange(self.user.key)
+        if (self.channel.key == prv_exchange and
+                Subscriber.objects.filter(channel_id=prv_exchange).count()):
             raise Exception("Duplicate private channel subscription for %s" % self.user)
         if not self.name:
             self.name = self.channel.name
 
+    @classmethod
+    def bulk_subscribe(cls, channel, user_keys, read_only=False, progress=None):
+        """
+        Subscribes many users to a channel.
+
+        Existing subscriptions are queried once per batch. New subscriptions
+        of a batch are saved in a block without per record hooks, then
+        private exchanges of new members are bound to the channel exchange
+        and informed with a channel listing. Listings are prepared once for
+        the owner and once for the other members. Member count is updated
+        once per batch.
+
+        Args:
+            channel (Channel): Channel object.
+            user_keys (list): Keys of users to be subscribed.
+            read_only (bool): Subscribe as read-only (broadcast) members.
+            progress (callable): Called with (processed, total) after each batch.
+
+        Returns:
+            (newly_added, existing) tuple of user key lists.
+        """
+        batch_size = settings.MESSAGING_SUBSCRIBE_BATCH_SIZE
+        user_keys = list(OrderedDict.fromkeys(user_keys))
+        newly_added, existing = [], []
+        listings = {}
+        mq_channel = cls._connect_mq()
+        for start in range(0, len(user_keys), batch_size):
+            batch = user_keys[start:start + batch_size]
+            found = set(cls.objects.filter(channel_id=channel.key,
+                                           user_id__in=batch).values_list('user_id'))
+            added = []
+            with BlockSave(cls, query_dict={'channel_id': channel.key}):
+                for user_key in batch:
+                    if user_key in found:
+                        existing.append(user_key)
+                        continue
+                    sb = cls(channel=channel, user_id=user_key, read_only=read_only,
+                             name=channel.name)
+                    sb.setattr('in_bulk', True)
+                    sb.save()
+                    added.append(user_key)
+
+            for user_key in added:
+                prv_exchange = UserModel.get_prv_exchange(user_key)
+                cls._declare_exchange(mq_channel, prv_exchange)
+                if channel.code_name != prv_exchange:
+                    mq_channel.exchange_bind(source=channel.code_name, destination=prv_exchange)
+
+            if channel.typ != 5:
+                for user_key in added:
+                    # actions depend on channel ownership, online status
+                    # depends on the other member of direct channels
+                    listing_key = (user_key if channel.typ == 10
+                                   else user_key == channel.owner_id)
+                    if listing_key not in listings:
+                        listing = cls(channel=channel, user_id=user_key, read_only=read_only,
+                                      name=channel.name).get_channel_listing()
+                        listing['cmd'] = 'channel_subscription'
+                        listings[listing_key] = json_interface.dumps(listing)
+                    mq_channel.basic_publish(exchange=UserModel.get_prv_exchange(user_key),
+                                             routing_key='',
+                                             body=listings[listing_key])
+
+            MemberCount(channel.key).update(len(added))
+            newly_added.extend(added)
+            if progress:
+                progress(start + len(batch), len(user_keys))
+        return newly_added, existing
+
 
 MSG_TYPES = (
     (1, "Info Notification"),
@@ -397,22 +682,138 @@ class Message(Model):
             'key': self.key,
         }
 
+    @classmethod
+    def serialize_rows(cls, rows):
+        """
+        Serializes raw message data in one pass, without creating model instances.
+        Senders and attachments of all messages are fetched in batch.
+
+        Args:
+            rows: (data, key) tuples, as returned from ``Message.objects.data()``
+
+        Returns:
+            List of message dicts. Same output with :meth:`serialize` of
+            messages loaded from db, timestamps are strings as stored in db.
+        """
+        rows = list(rows)
+        cards = UserCard.get_many(list({data['sender_id'] for data, key in rows
+                                        if data.get('sender_id')}))
+        attachments = Attachment.serialize_for_messages([key for data, key in rows])
+        result = []
+        for data, key in rows:
+            card = cards.get(data.get('sender_id'), {})
+            result.append({
+                'content': data.get('body'),
+                'type': data.get('typ'),
+                'updated_at': data.get('updated_at'),
+                'timestamp': data.get('updated_at'),
+                'is_update': True,
+                'attachments': attachments.get(key, []),
+                'title': data.get('msg_title'),
+                'url': data.get('url'),
+                'sender_name': card.get('name'),
+                'sender_key': data.get('sender_id'),
+                'channel_key': data.get('channel_id'),
+                'cmd': 'message',
+                'avatar_url': card.get('avatar'),
+                'key': key,
+            })
+        return result
+
+    @classmethod
+    def paginate(cls, query_set, cursor=None, per_page=20, with_count=False):
+        """
+        Cursor based pagination of messages, newest first.
+
+        Cursor is the (timestamp, key) pair of the last message of the previous page,
+        so pages doesn't shift when new messages arrive.
+
+        Args:
+            query_set: Message queryset.
+            cursor (dict): "timestamp" and "key" of the last message of previous page.
+                Key can be omitted. Returns the first page if not given.
+            per_page (int): Messages per page.
+            with_count (bool): Include total number of matching messages.
+                Requires an extra query.
+
+        Returns:
+            (messages, pagination) tuple. Messages are serialized, newest first.
+            Pagination dict has "next_cursor" which is None on the last page.
+        """
+        query_set = query_set.order_by('-updated_at', '-_yz_rk')
+        pagination = {'per_page': per_page}
+        if with_count:
+            pagination['total_objects'] = query_set.count()
+        # one more to see if there's a next page
+        rows_needed = per_page + 1
+        if cursor:
+            # lte, because pyoko's __lt filter is broken.
+            # Messages at or before the cursor position are filtered out below.
+            query_set = query_set.filter(updated_at__lte=cursor['timestamp'])
+            position = (cursor['timestamp'], cursor.get('key') or '')
+        while True:
+            fetched = list(query_set.set_params(rows=rows_needed).data())
+            rows = fetched
+            if cursor:
+                rows = [(data, key) for data, key in rows
+                        if (data['updated_at'], key) < position]
+            if len(rows) > per_page or len(fetched) < rows_needed:
+                break
+            # skipped rows share the timestamp of the cursor, fetch that many more
+            rows_needed = per_page + 1 + len(fetched) - len(rows)
+        messages = cls.serialize_rows(rows[:per_page])
+        pagination['next_cursor'] = ({'timestamp': messages[-1]['timestamp'],
+                                      'key': messages[-1]['key']}
+                                     if len(rows) > per_page else None)
+        return messages, pagination
+
+    @classmethod
+    def save_queued(cls, wait=False):
+        """
+        Saves the messages waiting in write-behind queue
+        in the same order they are sent.
+
+        Args:
+            wait (bool): If queue is being saved by another worker, wait for it to finish.
+
+        Returns:
+            Number of saved messages.
+        """
+
+        def save(items):
+            with BlockSave(cls):
+                for item in items:
+                    msg = cls(key=item['key']).set_data(item['data'], from_db=True)
+                    # already published
+                    msg.setattr('unsaved', True)
+                    msg.save()
+
+        return WriteBehindQueue(MESSAGE_QUEUE).drain(save,
+                                                     settings.MESSAGING_WRITE_BEHIND_BATCH_SIZE,
+                                                     wait=wait)
+
     def __unicode__(self):
         content = six.text_type(self.msg_title or self.body)
         return "%s%s" % (content[:30], '...' if len(content) > 30 else '')
 
     def _republish(self):
         """
-        Re-publishes updated message
+        Re-publishes updated message with the timestamp it's saved with,
+        so published and buffered data match the one loaded from db.
         """
-        mq_channel = self.channel._connect_mq()
-        mq_channel.basic_publish(exchange=self.channel.key, routing_key='',
-                                 body=json.dumps(self.serialize()))
+        msg_data = self.serialize()
+        msg_data.update(updated_at=self._data['updated_at'], timestamp=self._data['updated_at'])
+        channel_type, fanout = Channel.get_fanout(self.channel.key)
+        MessagePublisher.publish([(self.channel.key, msg_data, fanout)], channel_type)
+        RecentMessages(self.channel.key).put(msg_data, update_only=True)
 
-    def pre_save(self):
+    def post_save(self):
         if not hasattr(self, 'unsaved'):
             self._republish()
 
+    def post_delete(self):
+        RecentMessages(self.channel.key).remove(self.key)
+
 
 ATTACHMENT_TYPES = (
     (1, "Belge"),
@@ -423,11 +824,27 @@ ATTACHMENT_TYPES = (
 )
 
 
+#: Content addressed storage of uploaded attachments
+file_storage = LocalFileStorage(settings.FILE_STORAGE_ROOT, settings.FILE_STORAGE_URL)
+
+
+def _attachment_url(file_hash, file):
+    if file_hash:
+        return file_storage.url(file_hash)
+    return "%s%s" % (settings.S3_PUBLIC_URL, file)
+
+
 class Attachment(Model):
     """
     A model to store message attachments
+
+    Files are stored in :data:`file_storage` and referenced by their content hash.
+    "file" field is kept for the attachments which stored before.
     """
     file = field.File("Dosya", random_name=True, required=False)
+    file_hash = field.String("Dosya Özeti", index=True)
+    size = field.Integer("Boyut")
+    mime_type = field.String("İçerik Tipi")
     typ = field.Integer("Tip", choices=ATTACHMENT_TYPES)
     name = field.String("Dosya Adı")
     description = field.String("Tanım")
@@ -438,9 +855,48 @@ class Attachment(Model):
         return {
             'description': self.description,
             'file_name': self.name,
-            'url': "%s%s" % (settings.S3_PUBLIC_URL, self.file)
+            'hash': self.file_hash,
+            'size': self.size,
+            'url': _attachment_url(self.file_hash, self.file)
         }
 
+    @staticmethod
+    def get_type_for(mime_type):
+        """
+        Attachment type (one of ATTACHMENT_TYPES) for given mime type.
+        """
+        if mime_type == 'application/pdf':
+            return 33
+        if mime_type.startswith('image/'):
+            return 22
+        if ('spreadsheet' in mime_type or 'excel' in mime_type or
+                mime_type == 'text/csv'):
+            return 11
+        return 1
+
+    @classmethod
+    def serialize_for_messages(cls, message_keys):
+        """
+        Serialized attachments of given messages, fetched with a single query.
+
+        Args:
+            message_keys (list): Message keys.
+
+        Returns:
+            Dict. Message key -> list of serialized attachments.
+        """
+        result = defaultdict(list)
+        if message_keys:
+            for data, key in cls.objects.filter(message_id__in=message_keys).data():
+                result[data['message_id']].append({
+                    'description': data.get('description'),
+                    'file_name': data.get('name'),
+                    'hash': data.get('file_hash'),
+                    'size': data.get('size'),
+                    'url': _attachment_url(data.get('file_hash'), data.get('file'))
+                })
+        return result
+
     def __unicode__(self):
         return self.name
 
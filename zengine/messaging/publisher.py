@@ -0,0 +1,101 @@
+# -*-  coding: utf-8 -*-
+"""
+Message publishing service.
+
+Publishes serialized messages to channel exchanges with a single
+connection per process, records fan-out size and publish latency per
+channel type and saves messages through a write-behind queue.
+
+.. code-block:: python
+
+    MessagePublisher.publish([(channel_key, msg_data, fanout)], channel_type)
+    MessagePublisher.save([msg_object])
+
+Publish statistics can be displayed with ``manage.py messaging_stats`` command.
+"""
+
+# Copyright (C) 2015 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+import time
+
+from pika.exceptions import ConnectionClosed, ChannelClosed
+
+from pyoko.conf import settings
+from zengine.client_queue import get_mq_connection, JobPublisher
+from zengine.lib import json_interface
+from zengine.lib.cache import WriteBehindQueue
+from zengine.messaging.lib import PublishStats
+
+#: Name of the write-behind queue of messages
+MESSAGE_QUEUE = 'Message'
+
+
+class MessagePublisher(object):
+    """
+    Publishes messages and queues them to be saved.
+    """
+    mq_connection = None
+    mq_channel = None
+
+    @classmethod
+    def _connect_mq(cls):
+        if cls.mq_connection is None or cls.mq_connection.is_closed:
+            cls.mq_connection, cls.mq_channel = get_mq_connection()
+        return cls.mq_channel
+
+    @classmethod
+    def _basic_publish(cls, exchange, body):
+        try:
+            cls.mq_channel.basic_publish(exchange=exchange, routing_key='', body=body)
+        except (AttributeError, ConnectionClosed, ChannelClosed):
+            cls._connect_mq().basic_publish(exchange=exchange, routing_key='', body=body)
+
+    @classmethod
+    def publish(cls, messages, channel_type):
+        """
+        Publishes messages to their exchanges.
+
+        Statistics of all messages are recorded with a single cache call.
+
+        Args:
+            messages (list): (exchange, serialized message, fan-out size) tuples.
+            channel_type (int): Type of the channels, one of CHANNEL_TYPES.
+        """
+        total_fanout = total_latency = max_fanout = max_latency = 0
+        for exchange, msg_data, fanout in messages:
+            start = time.time()
+            cls._basic_publish(exchange, json_interface.dumps(msg_data))
+            latency = int((time.time() - start) * 1000000)
+            total_fanout += fanout
+            total_latency += latency
+            max_fanout = max(max_fanout, fanout)
+            max_latency = max(max_latency, latency)
+        if messages and settings.MESSAGING_PUBLISH_STATS:
+            PublishStats(channel_type).record(len(messages), total_fanout, total_latency,
+                                              max_fanout, max_latency)
+
+    @staticmethod
+    def save(messages):
+        """
+        Saves messages to db.
+
+        If :attr:`~zengine.settings.MESSAGING_WRITE_BEHIND` is enabled, messages are
+        pushed to a queue and saved in the same order by ``_zops_flush_messages`` job.
+        A new job is triggered unless one is already waiting to be run.
+
+        Args:
+            messages (list): Message objects.
+
+        Returns:
+            List of "updated_at" values of messages, as written to db or queue.
+        """
+        if not settings.MESSAGING_WRITE_BEHIND:
+            return [msg.save()._data['updated_at'] for msg in messages]
+        items = [{'key': msg.key, 'data': msg.clean_value()} for msg in messages]
+        queue = WriteBehindQueue(MESSAGE_QUEUE)
+        queue.push(items)
+        if queue.schedule():
+            JobPublisher.publish('_zops_flush_messages')
+        return [item['data']['updated_at'] for item in items]
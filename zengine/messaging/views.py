@@ -10,11 +10,12 @@ from pyoko.conf import settings
 from pyoko.db.adapter.db_riak import BlockSave
 from pyoko.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
 from pyoko.lib.utils import get_object_from_path
-from zengine.lib.decorators import view
+from zengine.client_queue import JobPublisher
+from zengine.lib.decorators import view, bg_job
 from zengine.log import log
 from zengine.lib.exceptions import HTTPError
 from zengine.messaging.model import Channel, Attachment, Subscriber, Message, Favorite, \
-    FlaggedMessage
+    FlaggedMessage, file_storage
 
 UserModel = get_object_from_path(settings.USER_MODEL)
 UnitModel = get_object_from_path(settings.UNIT_MODEL)
@@ -41,6 +42,8 @@ UnitModel = get_object_from_path(settings.UNIT_MODEL)
         'attachments': [{
                         'description': string,
                         'file_name': string,
+                        'hash': string,
+                        'size': int,
                         'url': string,
                     },]
 }
@@ -64,12 +67,7 @@ UnitModel = get_object_from_path(settings.UNIT_MODEL)
 """
 
 
-def _dedect_file_type(name, content):
-    # FIXME: Implement attachment type detection
-    return 1  # Return as Document for now
-
-
-def _paginate(self, current_page, query_set, per_page=10):
+def _paginate(current_page, query_set, per_page=10):
     """
     Handles pagination of object listings.
 
@@ -96,11 +94,40 @@ def _paginate(self, current_page, query_set, per_page=10):
     query_set = query_set.set_params(rows=current_per_page, start=(current_page - 1) * per_page)
     return query_set, pagination_data
 
+
+def _get_message(current, key, sender_id=None):
+    """
+    Loads a message. If it's not found, messages waiting in
+    the write-behind queue are saved and it's loaded again.
+
+    Args:
+        key: Message key.
+        sender_id: Key of the user who should be the sender of the message.
+
+    Raises:
+        ObjectDoesNotExist: If message doesn't exist or it's not sent by given user.
+    """
+    try:
+        msg = Message(current).objects.get(key)
+    except ObjectDoesNotExist:
+        if not settings.MESSAGING_WRITE_BEHIND:
+            raise
+        Message.save_queued(wait=True)
+        msg = Message(current).objects.get(key)
+    if sender_id and msg.sender_id != sender_id:
+        raise ObjectDoesNotExist("Message %s is not sent by %s" % (key, sender_id))
+    return msg
+
+
 @view()
 def create_message(current):
     """
     Creates a message for the given channel.
 
+    Files should be uploaded to the ``/upload`` endpoint of the gateway first,
+    then referenced by their hashes. Identical files are stored only once.
+    Base64 encoded "content" is still accepted in place of "hash".
+
     .. code-block:: python
 
         # request:
@@ -113,7 +140,7 @@ def create_message(current):
                 'attachments': [{
                     'description': string,  # can be blank,
                     'name': string,         # file name with extension,
-                    'content': string,      # base64 encoded file content
+                    'hash': string,         # returned from /upload
                     }]}
         # response:
             {
@@ -124,19 +151,66 @@ def create_message(current):
 
     """
     msg = current.input['message']
+    attachments = []
+    for atch in msg.get('attachments') or []:
+        if atch.get('content'):
+            file_hash, created = file_storage.store_base64(atch['content'])
+        else:
+            file_hash = atch.get('hash')
+            if not file_storage.exists(file_hash):
+                raise HTTPError(404, "File not found: %s" % atch.get('name'))
+        attachments.append({'hash': file_hash,
+                            'name': atch['name'],
+                            'description': atch.get('description', '')})
     msg_obj = Channel.add_message(msg['channel'], body=msg['body'], typ=msg['type'],
                                   sender=current.user,
-                                  title=msg['title'], receiver=msg['receiver'] or None)
+                                  title=msg['title'], receiver=msg['receiver'] or None,
+                                  attachments=attachments)
     current.output = {
         'msg_key': msg_obj.key,
         'status': 'Created',
         'code': 201
     }
-    if 'attachment' in msg:
-        for atch in msg['attachments']:
-            typ = current._dedect_file_type(atch['name'], atch['content'])
-            Attachment(channel_id=msg['channel'], msg=msg_obj, name=atch['name'],
-                       file=atch['content'], description=atch['description'], typ=typ).save()
+
+
+@bg_job("_zops_detect_attachment_types")
+def detect_attachment_types(current):
+    """
+    Detects types of newly added attachments from their contents.
+    Each distinct file is read once.
+
+    .. code-block:: python
+
+        # request:
+        {
+            'keys': [key,],  # of attachments
+        }
+    """
+    mime_types = {}
+    for atch in Attachment.objects.filter(key__in=current.input['keys']):
+        if not atch.file_hash:
+            continue
+        if atch.file_hash not in mime_types:
+            try:
+                mime_types[atch.file_hash] = file_storage.guess_mime_type(atch.file_hash,
+                                                                          atch.name)
+            except (IOError, OSError):
+                log.exception("Attachment file couldn't be read: %s" % atch.file_hash)
+                continue
+        atch.mime_type = mime_types[atch.file_hash]
+        atch.typ = Attachment.get_type_for(atch.mime_type)
+        atch.save()
+
+
+@bg_job("_zops_flush_messages")
+def flush_messages(current):
+    """
+    Saves the messages waiting in write-behind queue
+    in the same order they are sent.
+    """
+
+    Message.save_queued()
+
 
 @view()
 def show_channel(current, waited=False):
@@ -158,8 +232,9 @@ def show_channel(current, waited=False):
             'channel_key': key,
             'description': string,
             'no_of_members': int,
-            'member_list': [
-                {'name': string,
+            'member_list': [ # first page of members, see _zops_channel_members
+                {'key': key,
+                 'name': string,
                  'is_online': bool,
                  'avatar_url': string,
                 }],
@@ -176,17 +251,57 @@ def show_channel(current, waited=False):
                       'name': sbs.name,
                       'actions': sbs.get_actions(),
                       'avatar_url': ch.get_avatar(current.user),
-                      'no_of_members': len(ch.subscriber_set),
-                      'member_list': [{'name': sb.user.full_name,
-                                       'is_online': sb.user.is_online(),
-                                       'avatar_url': sb.user.get_avatar_url()
-                                       } for sb in ch.subscriber_set.objects.all()],
+                      'no_of_members': ch.get_member_count(),
+                      'member_list': ch.get_members(),
                       'last_messages': [],
                       'status': 'OK',
                       'code': 200
                       }
-    for msg in ch.get_last_messages():
-        current.output['last_messages'].insert(0, msg.serialize(current.user))
+    messages = Channel.get_recent_messages(ch.key)
+    if messages is None:
+        messages, pagination = Message.paginate(Message.objects.filter(channel_id=ch.key))
+    current.output['last_messages'] = messages[::-1]
+
+@view()
+def channel_members(current):
+    """
+    Paginated member listing of a channel.
+
+    .. code-block:: python
+
+        #  request:
+            {
+                'view':'_zops_channel_members',
+                'channel_key': key,
+                'page': int, # starts from 1
+            }
+
+        #  response:
+            {
+            'member_list': [
+                {'key': key,
+                 'name': string,
+                 'is_online': bool,
+                 'avatar_url': string,
+                }],
+            'no_of_members': int,
+            'page': int,
+            'per_page': int,
+            'status': 'OK',
+            'code': 200
+            }
+    """
+    ch = Channel(current).objects.get(current.input['channel_key'])
+    # only members can see other members
+    ch.get_subscription_for_user(current.user_id)
+    page = int(current.input.get('page') or 1)
+    current.output = {'member_list': ch.get_members(page),
+                      'no_of_members': ch.get_member_count(),
+                      'page': page,
+                      'per_page': settings.MESSAGING_MEMBERS_PER_PAGE,
+                      'status': 'OK',
+                      'code': 200
+                      }
 
 @view()
 def channel_history(current):
@@ -200,6 +315,7 @@ def channel_history(current):
                 'view':'_zops_channel_history,
                 'channel_key': key,
                 'timestamp': datetime, # timestamp data of oldest shown message
+                'key': key, # key of oldest shown message, optional
                 }
 
             #  response:
@@ -215,13 +331,15 @@ def channel_history(current):
         'messages': []
     }
 
-    for msg in list(Message.objects.filter(channel_id=current.input['channel_key'],
-                                      updated_at__lte=current.input['timestamp'])[:20]):
-        current.output['messages'].insert(0, msg.serialize(current.user))
-    # FIXME: looks like  pyoko's __lt is broken
-    # TODO: convert lte to lt and remove this block, when __lt filter fixed
-    if current.output['messages']:
-        current.output['messages'].pop(-1)
+    messages = Channel.get_recent_messages(current.input['channel_key'],
+                                           before=current.input['timestamp'],
+                                           before_key=current.input.get('key'))
+    if messages is None:
+        messages, pagination = Message.paginate(
+            Message.objects.filter(channel_id=current.input['channel_key']),
+            cursor={'timestamp': current.input['timestamp'],
+                    'key': current.input.get('key')})
+    current.output['messages'] = messages[::-1]
 
 @view()
 def report_last_seen_message(current):
@@ -383,15 +501,17 @@ def get_notifications(current):
         sbs = current.user.subscriptions.objects.filter(channel_id=current.user.prv_exchange)
         sbs[0].delete()
         notif_sbs = sbs[1]
-    for msg in notif_sbs.channel.message_set.objects.all()[:amount]:
-        current.output['notifications'].insert(0, {
-            'title': msg.msg_title,
-            'body': msg.body,
-            'type': msg.typ,
-            'url': msg.url,
-            'channel_key': msg.channel.key,
-            'message_key': msg.key,
-            'timestamp': msg.updated_at})
+    for data, key in Message.objects.filter(channel_id=notif_sbs.channel.key).set_params(
+            rows=amount).data():
+        current.output['notifications'].append({
+            'title': data.get('msg_title'),
+            'body': data.get('body'),
+            'type': data.get('typ'),
+            'url': data.get('url'),
+            'channel_key': data.get('channel_id'),
+            'message_key': key,
+            'timestamp': data.get('updated_at')})
+    current.output['notifications'].reverse()
 
 @view()
 def create_channel(current):
@@ -464,24 +584,16 @@ def add_members(current):
                 'status': 'Created',
                 'code': 201
                 }
-    """
-    newly_added, existing = [], []
-    read_only = current.input['read_only']
-    for member_key in current.input['members']:
-        sb, new = Subscriber(current).objects.get_or_create(user_id=member_key,
-                                                            read_only=read_only,
-                                                            channel_id=current.input['channel_key'])
-        if new:
-            newly_added.append(member_key)
-        else:
-            existing.append(member_key)
 
-    current.output = {
-        'existing': existing,
-        'newly_added': newly_added,
-        'status': 'OK',
-        'code': 201
-    }
+            #  response for large member lists, see _zops_bulk_subscribe job:
+                {
+                'total': int,
+                'status': 'Accepted',
+                'code': 202
+                }
+    """
+    _add_members(current, current.input['channel_key'], current.input['members'],
+                 current.input['read_only'])
 
 @view()
 def add_unit_to_channel(current):
@@ -508,18 +620,38 @@ def add_unit_to_channel(current):
                     'status': 'Created',
                     'code': 201
                     }
+
+                #  response for large units, see _zops_bulk_subscribe job:
+                    {
+                    'total': int,
+                    'status': 'Accepted',
+                    'code': 202
+                    }
     """
-    read_only = current.input['read_only']
-    newly_added, existing = [], []
-    for member_key in UnitModel.get_user_keys(current, current.input['unit_key']):
-        sb, new = Subscriber(current).objects.get_or_create(user_id=member_key,
-                                                            read_only=read_only,
-                                                            channel_id=current.input['channel_key'])
-        if new:
-            newly_added.append(member_key)
-        else:
-            existing.append(member_key)
+    _add_members(current, current.input['channel_key'],
+                 UnitModel.get_user_keys(current, current.input['unit_key']),
+                 current.input['read_only'])
+
 
+def _add_members(current, channel_key, member_keys, read_only):
+    """
+    Subscribes given users to the channel. Large member lists are
+    subscribed by the "_zops_bulk_subscribe" background job.
+    """
+    if len(member_keys) > settings.MESSAGING_BACKGROUND_SUBSCRIBE_LIMIT:
+        JobPublisher.publish('_zops_bulk_subscribe',
+                             channel_key=channel_key,
+                             members=list(member_keys),
+                             read_only=read_only,
+                             user_id=current.user_id)
+        current.output = {
+            'total': len(member_keys),
+            'status': 'Accepted',
+            'code': 202
+        }
+        return
+    channel = Channel(current).objects.get(channel_key)
+    newly_added, existing = Subscriber.bulk_subscribe(channel, member_keys, read_only)
     current.output = {
         'existing': existing,
         'newly_added': newly_added,
@@ -527,6 +659,53 @@ def add_unit_to_channel(current):
         'code': 201
     }
 
+
+@bg_job("_zops_bulk_subscribe")
+def bulk_subscribe(current):
+    """
+    BG Job for subscribing many users to a channel.
+
+    Requesting user is informed about the progress after each batch
+    with "channel_subscription_progress" client command, and with
+    "channel_subscription_done" when all members are processed.
+
+    .. code-block:: python
+
+            # progress:
+                {
+                'cmd': 'channel_subscription_progress',
+                'channel_key': key,
+                'processed': int,
+                'total': int,
+                }
+
+            # done:
+                {
+                'cmd': 'channel_subscription_done',
+                'channel_key': key,
+                'existing': [key,], # existing members
+                'newly_added': [key,], # newly added members
+                'status': 'OK',
+                'code': 201
+                }
+    """
+    data = current.input
+    user = UserModel.objects.get(data['user_id'])
+    channel = Channel.objects.get(data['channel_key'])
+
+    def progress(processed, total):
+        user.send_client_cmd({'channel_key': channel.key,
+                              'processed': processed,
+                              'total': total}, 'channel_subscription_progress')
+
+    newly_added, existing = Subscriber.bulk_subscribe(channel, data['members'],
+                                                      data['read_only'], progress)
+    user.send_client_cmd({'channel_key': channel.key,
+                          'existing': existing,
+                          'newly_added': newly_added,
+                          'status': 'OK',
+                          'code': 201}, 'channel_subscription_done')
+
 @view()
 def search_user(current):
     """
@@ -643,27 +822,26 @@ def find_message(current):
                 'view':'_zops_search_unit,
                 'channel_key': key,
                 'query': string,
-                'page': int,
+                'cursor': {'timestamp': datetime, 'key': key}, # next_cursor of previous
+                                                               # page, omit for first page
+                'count': boolean, # optional, include total_objects in pagination
+                'page': int, # deprecated, used only if "cursor" is not given. Response
+                             # pagination will have "page", "total_pages" and
+                             # "total_objects" instead of "next_cursor".
                 }
 
             #  response:
                 {
-                'results': [MSG_DICT, ],
+                'results': [MSG_DICT, ], # newest first
                 'pagination': {
-                    'page': int, # current page
-                    'total_pages': int,
-                    'total_objects': int,
+                    'next_cursor': {'timestamp': datetime, 'key': key}, # null on last page
+                    'total_objects': int, # only if "count" is requested
                     'per_page': int, # object per page
                     },
                 'status': 'OK',
                 'code': 200
                 }
     """
-    current.output = {
-        'results': [],
-        'status': 'OK',
-        'code': 201
-    }
     query_set = Message(current).objects.search_on(['msg_title', 'body', 'url'],
                                                    contains=current.input['query'])
     if current.input['channel_key']:
@@ -673,10 +851,22 @@ def find_message(current):
             "channel_id", flatten=True)
         query_set = query_set.filter(channel_id__in=subscribed_channels)
 
-    query_set, pagination_data = _paginate(current_page=current.input['page'], query_set=query_set)
-    current.output['pagination'] = pagination_data
-    for msg in query_set:
-        current.output['results'].append(msg.serialize(current.user))
+    if current.input.get('page') and not current.input.get('cursor'):
+        # page numbers of older clients
+        query_set, pagination = _paginate(current_page=current.input['page'],
+                                          query_set=query_set.order_by('-updated_at'))
+        results = Message.serialize_rows(query_set.data())
+    else:
+        results, pagination = Message.paginate(query_set,
+                                               cursor=current.input.get('cursor'),
+                                               per_page=10,
+                                               with_count=current.input.get('count', False))
+    current.output = {
+        'results': results,
+        'pagination': pagination,
+        'status': 'OK',
+        'code': 201
+    }
 
 @view()
 def delete_channel(current):
@@ -784,8 +974,7 @@ def delete_message(current):
                 }
     """
     try:
-        Message(current).objects.get(sender_id=current.user_id,
-                                     key=current.input['key']).delete()
+        _get_message(current, current.input['key'], sender_id=current.user_id).delete()
         current.output = {'status': 'Deleted', 'code': 200, 'key': current.input['key']}
     except ObjectDoesNotExist:
         raise HTTPError(404, "")
@@ -815,7 +1004,7 @@ def edit_message(current):
     current.output = {'status': 'OK', 'code': 200}
     in_msg = current.input['message']
     try:
-        msg = Message(current).objects.get(sender_id=current.user_id, key=in_msg['key'])
+        msg = _get_message(current, in_msg['key'], sender_id=current.user_id)
         msg.body = in_msg['body']
         msg.save()
     except ObjectDoesNotExist:
@@ -843,7 +1032,7 @@ def flag_message(current):
     """
     current.output = {'status': 'Created', 'code': 201}
     FlaggedMessage.objects.get_or_create(user_id=current.user_id,
-                                         message_id=current.input['key'])
+                                         message=_get_message(current, current.input['key']))
 
 @view()
 def unflag_message(current):
@@ -892,8 +1081,8 @@ def get_message_actions(current):
     """
     current.output = {'status': 'OK',
                       'code': 200,
-                      'actions': Message.objects.get(
-                          current.input['key']).get_actions_for(current.user)}
+                      'actions': _get_message(
+                          current, current.input['key']).get_actions_for(current.user)}
 
 @view()
 def add_to_favorites(current):
@@ -916,7 +1105,7 @@ def add_to_favorites(current):
             }
 
     """
-    msg = Message.objects.get(current.input['key'])
+    msg = _get_message(current, current.input['key'])
     current.output = {'status': 'Created', 'code': 201}
     fav, new = Favorite.objects.get_or_create(user_id=current.user_id, message=msg)
     current.output['favorite_key'] = fav.key
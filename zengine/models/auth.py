@@ -109,6 +109,9 @@ class User(Model, BaseUser):
     def pre_save(self):
         self.encrypt_password()
 
+    def post_save(self):
+        self.clear_card()
+
     def post_creation(self):
         self.prepare_channels()
 
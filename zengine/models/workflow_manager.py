@@ -7,9 +7,13 @@
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
 
-import json
+import re
+import time
 import types
-from datetime import datetime
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import pika
 import six
 from pika.exceptions import ChannelClosed
 from pika.exceptions import ConnectionClosed
@@ -18,10 +22,12 @@ from pyoko.conf import settings
 from pyoko.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
 from pyoko.fields import DATE_TIME_FORMAT
 from pyoko.lib.utils import get_object_from_path
-from SpiffWorkflow.bpmn.parser.util import BPMN_MODEL_NS, ATTRIBUTE_NS
 from pyoko.modelmeta import model_registry
 from zengine.client_queue import get_mq_connection
-from zengine.lib.cache import Cache
+from zengine.lib.cache import Cache, cache
+from zengine.lib import json_interface
+from zengine.lib.archive import JSONLinesArchive
+from zengine.lib.camunda_parser import DiagramExtensions, content_hash
 from zengine.lib.translation import gettext_lazy as __
 import xml.etree.ElementTree as ET
 
@@ -70,25 +76,21 @@ class RunningInstancesExist(Exception):
     pass
 
 
-NS = {'bpmn': BPMN_MODEL_NS,
-      'camunda': ATTRIBUTE_NS}
-
-
 class BPMNParser(object):
     """
-    Custom BPMN diagram parser
+    Custom BPMN diagram parser.
+
+    Reads the single pass extracted (and cached)
+    :class:`~zengine.lib.camunda_parser.DiagramExtensions` of the diagram,
+    which are also used while loading the workflow spec.
     """
 
     def __init__(self, xml_content=None, xml_file=None):
+        if not xml_content:
+            with open(xml_file) as fp:
+                xml_content = fp.read()
         try:
-            if xml_content:
-                try:
-                    from StringIO import StringIO
-                except ImportError:  # Python 3
-                    from io import StringIO
-                self.root = ET.parse(StringIO(xml_content))
-            else:
-                self.root = ET.parse(xml_file)
+            self.extensions = DiagramExtensions.from_xml(xml_content)
         except ET.ParseError:
             print(xml_content or xml_file)
             raise
@@ -100,13 +102,7 @@ class BPMNParser(object):
         Returns str: WF description
 
         """
-        paths = ['bpmn:collaboration/bpmn:participant/bpmn:documentation',
-                 'bpmn:collaboration/bpmn:documentation',
-                 'bpmn:process/bpmn:documentation']
-        for path in paths:
-            elm = self.root.find(path, NS)
-            if elm is not None and elm.text:
-                return elm.text
+        return self.extensions.get_description('participant', 'collaboration', 'process')
 
     def get_name(self):
         """
@@ -115,27 +111,10 @@ class BPMNParser(object):
         Returns:
             str. WF name.
         """
-        paths = ['bpmn:process',
-                 'bpmn:collaboration/bpmn:participant/',
-                 'bpmn:collaboration',
-                 ]
-        for path in paths:
-            tag = self.root.find(path, NS)
-            if tag is not None and len(tag):
-                name = tag.get('name')
-                if name:
-                    return name
+        return self.extensions.name
 
     def get_wf_extensions(self):
-        paths = [
-            'bpmn:collaboration/bpmn:participant/bpmn:extensionElements/camunda:properties/camunda:property',
-            'bpmn:collaboration/bpmn:extensionElements/camunda:properties/camunda:property',
-            'bpmn:process/bpmn:extensionElements/camunda:properties/camunda:property'
-        ]
-        elements = []
-        for path in paths:
-            elements.extend(self.root.findall(path, NS))
-        return [(el.get('name'), el.get('value')) for el in elements]
+        return list(self.extensions.wf_properties.items())
 
 
 class BPMNWorkflow(Model):
@@ -153,6 +132,8 @@ class BPMNWorkflow(Model):
     requires_object = field.Boolean(default=False)
     object_field_name = field.String(__(u"Object field name"))
     menu_category = field.String(__(u"Menu Category"))
+    # content hash of the xml, used to skip unchanged diagrams on load
+    content_hash = field.String(index=False)
 
     # field programmable is for task manager
     # to specify wf instances can be triggered automatically
@@ -195,6 +176,7 @@ class BPMNWorkflow(Model):
                 ))
         else:
             self.xml = diagram
+            self.content_hash = content_hash(diagram.body)
             parser = BPMNParser(diagram.body)
             self.description = parser.get_description()
             self.title = parser.get_name() or self.name.replace('_', ' ').title()
@@ -668,6 +650,466 @@ class TaskInvitation(Model):
         # TODO: Signal logged-in users to remove the task from their task list
         self.objects.filter(instance=self.instance).exclude(key=self.key).delete()
 
+    def post_save(self):
+        TaskSearchIndex.add(self)
+
+    def post_delete(self):
+        TaskSearchIndex.remove(self.key)
+
+
+# KEYS: doc hash, start dates zset, finish dates zset
+# ARGV: invitation key, new doc json (empty to remove), start date, finish date
+TASK_INDEX_UPDATE_SCRIPT = """
+local old_doc = redis.call('hget', KEYS[1], ARGV[1])
+if old_doc then
+    for _, set_key in ipairs(cjson.decode(old_doc)['sets'] or {}) do
+        redis.call('srem', set_key, ARGV[1])
+    end
+end
+redis.call('zrem', KEYS[2], ARGV[1])
+redis.call('zrem', KEYS[3], ARGV[1])
+if ARGV[2] == '' then
+    redis.call('hdel', KEYS[1], ARGV[1])
+    return 0
+end
+for _, set_key in ipairs(cjson.decode(ARGV[2])['sets']) do
+    redis.call('sadd', set_key, ARGV[1])
+end
+if ARGV[3] ~= '' then
+    redis.call('zadd', KEYS[2], ARGV[3], ARGV[1])
+end
+if ARGV[4] ~= '' then
+    redis.call('zadd', KEYS[3], ARGV[4], ARGV[1])
+end
+redis.call('hset', KEYS[1], ARGV[1], ARGV[2])
+return 1
+"""
+
+# KEYS: intersected sets, united set groups, excluded set, start dates zset, finish dates zset
+# ARGV: number of intersected sets, has excluded set, min start date, max finish date,
+#       max number of results, sizes of united set groups
+TASK_SEARCH_SCRIPT = """
+local n_inter = tonumber(ARGV[1])
+local min_start, max_finish = tonumber(ARGV[3]), tonumber(ARGV[4])
+local limit = tonumber(ARGV[5])
+local groups = {}
+local pos = n_inter
+for i = 6, #ARGV do
+    local size = tonumber(ARGV[i])
+    groups[#groups + 1] = {pos + 1, pos + size}
+    pos = pos + size
+end
+local excluded = ARGV[2] == '1' and KEYS[pos + 1]
+local start_key, finish_key = KEYS[#KEYS - 1], KEYS[#KEYS]
+local members
+if n_inter > 0 then
+    members = redis.call('sinter', unpack(KEYS, 1, n_inter))
+else
+    members = redis.call('sunion', unpack(KEYS, groups[1][1], groups[1][2]))
+end
+local result = {}
+for _, member in ipairs(members) do
+    local ok = true
+    for _, group in ipairs(groups) do
+        ok = false
+        for i = group[1], group[2] do
+            if redis.call('sismember', KEYS[i], member) == 1 then
+                ok = true
+                break
+            end
+        end
+        if not ok then
+            break
+        end
+    end
+    if ok and excluded then
+        ok = redis.call('sismember', excluded, member) == 0
+    end
+    if ok and min_start then
+        local score = redis.call('zscore', start_key, member)
+        ok = score and tonumber(score) >= min_start
+    end
+    if ok and max_finish then
+        local score = redis.call('zscore', finish_key, member)
+        ok = score and tonumber(score) <= max_finish
+    end
+    if ok then
+        result[#result + 1] = member
+        -- one more than the limit, to tell that there are more
+        if limit and #result > limit then
+            break
+        end
+    end
+end
+return result
+"""
+
+
+class TaskSearchIndex(Cache):
+    """
+    Prefix search index of task invitations.
+
+    Words of workflow name and title of invitations are split into prefixes,
+    each prefix is stored as a set of invitation keys. Invitation keys are also
+    stored in sets per role, workflow and progress state, and in sorted sets
+    by start and finish dates.
+
+    Index is updated by post save and delete hooks of :class:`TaskInvitation`.
+    Use ``rebuild_task_index`` management command to index existing invitations.
+
+    .. code-block:: python
+
+        keys = TaskSearchIndex.search('leave req', role_id=role.key, states=[20, 30])
+    """
+    PREFIX = 'TSKIDX'
+    MAX_PREFIX_LENGTH = 20
+    SPLIT_RE = re.compile(r'[\W_]+', re.UNICODE)
+
+    @classmethod
+    def _key(cls, *args):
+        return cls._make_key([six.text_type(arg) for arg in args])
+
+    @classmethod
+    def tokenize(cls, text):
+        """
+        Lower cased words of given text.
+        """
+        return [w for w in cls.SPLIT_RE.split(six.text_type(text or '').lower()) if w]
+
+    @classmethod
+    def _prefix_keys(cls, words):
+        prefixes = set()
+        for word in words:
+            word = word[:cls.MAX_PREFIX_LENGTH]
+            prefixes.update(word[:i] for i in range(1, len(word) + 1))
+        return [cls._key('p', prefix) for prefix in prefixes]
+
+    @staticmethod
+    def _timestamp(value):
+        if not value:
+            return None
+        if not isinstance(value, datetime):
+            value = datetime.strptime(value, DATE_TIME_FORMAT)
+        return time.mktime(value.timetuple())
+
+    @classmethod
+    def _update(cls, key, doc=None, start_date=None, finish_date=None, pipe=None):
+        """
+        Replaces the index entries of an invitation in a single atomic call.
+        """
+        timestamps = [cls._timestamp(start_date), cls._timestamp(finish_date)]
+        _update_task_index(keys=[cls._key('doc'), cls._key('start'), cls._key('finish')],
+                           args=[key, json_interface.dumps(doc) if doc else ''] +
+                                ['' if ts is None else ts for ts in timestamps],
+                           client=pipe)
+
+    @classmethod
+    def add(cls, inv, pipe=None):
+        """
+        Adds the invitation to index or updates the existing entry.
+
+        Args:
+            inv (TaskInvitation): Invitation object.
+            pipe: Redis pipeline. Changes are executed immediately if not given.
+        """
+        words = cls.tokenize('%s %s' % (inv.wf_name, inv.title))
+        doc = {'sets': cls._prefix_keys(words) + [cls._key('r', inv.role_id),
+                                                  cls._key('w', inv.wf_name),
+                                                  cls._key('s', inv.progress)]}
+        cls._update(inv.key, doc, inv.start_date, inv.finish_date, pipe=pipe)
+
+    @classmethod
+    def remove(cls, key):
+        """
+        Removes the invitation from index.
+
+        Args:
+            key: Key of invitation.
+        """
+        cls._update(key)
+
+    @classmethod
+    def search(cls, query, role_id=None, exclude_role_id=None, wf_names=None, states=None,
+               start_date=None, finish_date=None, limit=None):
+        """
+        Searches invitations which have words starting with each word of the query.
+
+        Args:
+            query (str): Search text.
+            role_id: Only return invitations of this role.
+            exclude_role_id: Exclude invitations of this role.
+            wf_names (list): Only return invitations of these workflows.
+            states (list): Only return invitations in these progress states.
+            start_date (datetime): Only return invitations start after this date.
+            finish_date (datetime): Only return invitations end before this date.
+            limit (int): Max number of keys.
+                Defaults to :attr:`~zengine.settings.TASK_SEARCH_MAX_KEYS`.
+
+        Returns:
+            List of invitation keys. None if more than ``limit`` invitations match.
+        """
+        limit = limit or settings.TASK_SEARCH_MAX_KEYS
+        words = cls.tokenize(query)
+        inter_keys = [cls._key('p', word[:cls.MAX_PREFIX_LENGTH]) for word in words]
+        if role_id:
+            inter_keys.append(cls._key('r', role_id))
+        groups = [[cls._key('w', name) for name in wf_names or []],
+                  [cls._key('s', state) for state in states or []]]
+        if (wf_names is not None and not wf_names) or (states is not None and not states):
+            return []
+        groups = [group for group in groups if group]
+        if not (inter_keys or groups):
+            return []
+        keys = inter_keys + [key for group in groups for key in group]
+        if exclude_role_id:
+            keys.append(cls._key('r', exclude_role_id))
+        keys.extend([cls._key('start'), cls._key('finish')])
+        args = [len(inter_keys), int(bool(exclude_role_id)),
+                cls._timestamp(start_date) or '', cls._timestamp(finish_date) or '',
+                limit] + [len(group) for group in groups]
+        result = _search_tasks(keys=keys, args=args)
+        if len(result) > limit:
+            return None
+        return [key.decode() if isinstance(key, bytes) else key for key in result]
+
+    @classmethod
+    def rebuild(cls, batch_size=500):
+        """
+        Clears the index and indexes all invitations.
+
+        Returns:
+            Number of indexed invitations.
+        """
+        cls.flush()
+        count = 0
+        pipe = cache.pipeline()
+        for inv in TaskInvitation.objects.all():
+            cls.add(inv, pipe)
+            count += 1
+            if not count % batch_size:
+                pipe.execute()
+        pipe.execute()
+        return count
+
+
+_update_task_index = cache.register_script(TASK_INDEX_UPDATE_SCRIPT)
+_search_tasks = cache.register_script(TASK_SEARCH_SCRIPT)
+
+
+class ArchiveIndex(Cache):
+    """
+    Archive file names of archived records.
+
+    Args:
+        name: Archive name.
+    """
+    PREFIX = 'ARCHIDX'
+
+    def __init__(self, name):
+        super(ArchiveIndex, self).__init__(name)
+
+    def add(self, keys, file_name):
+        pipe = cache.pipeline(transaction=False)
+        for key in keys:
+            pipe.hset(self.key, key, file_name)
+        pipe.execute()
+
+    def get_file(self, key):
+        file_name = cache.hget(self.key, key)
+        return file_name.decode() if isinstance(file_name, bytes) else file_name
+
+    def remove(self, key):
+        return cache.hdel(self.key, key)
+
+
+class WorkflowArchiver(object):
+    """
+    Moves finished workflow instances (with their task invitations) and
+    finished or expired task invitations older than retention period
+    from db to compressed archive files.
+
+    Archived records are removed from db, they can be restored with :meth:`restore`.
+
+    .. code-block:: python
+
+        stats = WorkflowArchiver().archive()
+        WorkflowArchiver().restore(wfi_key)
+
+    Args:
+        retention_days (int): Defaults to :attr:`~zengine.settings.WF_ARCHIVE_RETENTION_DAYS`.
+        batch_size (int): Records per archive file.
+            Defaults to :attr:`~zengine.settings.WF_ARCHIVE_BATCH_SIZE`.
+        root (str): Archive directory. Defaults to :attr:`~zengine.settings.WF_ARCHIVE_ROOT`.
+    """
+
+    def __init__(self, retention_days=None, batch_size=None, root=None):
+        self.retention_days = (settings.WF_ARCHIVE_RETENTION_DAYS if retention_days is None
+                               else retention_days)
+        self.batch_size = batch_size or settings.WF_ARCHIVE_BATCH_SIZE
+        self.archive_files = JSONLinesArchive(root or settings.WF_ARCHIVE_ROOT)
+
+    @staticmethod
+    def _hard_delete(model, keys):
+        # soft deleted objects would still occupy the bucket
+        for key in keys:
+            model.objects.adapter.bucket.delete(key)
+
+    def _batches(self, queryset):
+        """
+        Yields (data, key) lists of matching records, ordered by finish date and key.
+
+        Each batch starts after the (finish date, key) of the last record of the
+        previous one. Deleted records may be returned by the search index for
+        a short while, they are skipped since they're before that position.
+        """
+        queryset = queryset.data().order_by('finish_date', '_yz_rk')
+        position = None
+        while True:
+            rows_needed = self.batch_size
+            query = queryset
+            if position:
+                # gte, because pyoko's __gt filter is broken.
+                query = queryset.filter(
+                    finish_date__gte=datetime.strptime(position[0], DATE_TIME_FORMAT))
+            while True:
+                fetched = list(query.set_params(rows=rows_needed))
+                batch = [(data, key) for data, key in fetched
+                         if not position or (data['finish_date'], key) > position]
+                if len(batch) >= self.batch_size or len(fetched) < rows_needed:
+                    break
+                # skipped records are at or before the position, fetch that many more
+                rows_needed = self.batch_size + len(fetched) - len(batch)
+            batch = batch[:self.batch_size]
+            if not batch:
+                return
+            position = (batch[-1][0]['finish_date'], batch[-1][1])
+            yield batch
+
+    def _get_invitations(self, instance_keys):
+        """
+        Task invitations of given workflow instances, fetched in pages.
+
+        Returns:
+            Dict of instance key -> list of {'key', 'data'} dicts.
+        """
+        invitations = defaultdict(list)
+        query = TaskInvitation.objects.data().filter(
+            instance_id__in=instance_keys).order_by('_yz_rk')
+        start = 0
+        while True:
+            rows = list(query.set_params(rows=self.batch_size, start=start))
+            for data, key in rows:
+                invitations[data['instance_id']].append({'key': key, 'data': data})
+            if len(rows) < self.batch_size:
+                return invitations
+            start += self.batch_size
+
+    def _write(self, name, records, stats, dry):
+        stats['raw_bytes'] += sum(len(json_interface.dumps(r)) for r in records)
+        if not dry:
+            file_name, size = self.archive_files.write(name, records)
+            ArchiveIndex(name).add([r['key'] for r in records], file_name)
+            stats['archive_bytes'] += size
+
+    def archive(self, dry=False):
+        """
+        Archives old records.
+
+        Args:
+            dry (bool): Only measure, don't archive.
+
+        Returns:
+            Dict of "instances", "invitations", "raw_bytes" and "archive_bytes" counts.
+        """
+        cutoff = datetime.now() - timedelta(days=self.retention_days)
+        stats = dict(instances=0, invitations=0, raw_bytes=0, archive_bytes=0)
+        instances = WFInstance.objects.filter(finished=True, finish_date__lte=cutoff)
+        for batch in self._batches(instances):
+            keys = [key for _, key in batch]
+            invitations = self._get_invitations(keys)
+            records = [{'key': key, 'data': data, 'invitations': invitations[key]}
+                       for data, key in batch]
+            self._write('WFInstance', records, stats, dry)
+            inv_keys = [inv['key'] for invs in invitations.values() for inv in invs]
+            stats['instances'] += len(records)
+            stats['invitations'] += len(inv_keys)
+            if dry:
+                continue
+            self._hard_delete(TaskInvitation, inv_keys)
+            self._hard_delete(WFInstance, keys)
+            for key in inv_keys:
+                TaskSearchIndex.remove(key)
+
+        invitations = TaskInvitation.objects.filter(progress__in=[40, 90],
+                                                    finish_date__lte=cutoff)
+        for batch in self._batches(invitations):
+            records = [{'key': key, 'data': data} for data, key in batch]
+            self._write('TaskInvitation', records, stats, dry)
+            stats['invitations'] += len(records)
+            if dry:
+                continue
+            self._hard_delete(TaskInvitation, [key for _, key in batch])
+            for _, key in batch:
+                TaskSearchIndex.remove(key)
+        return stats
+
+    def restore(self, key):
+        """
+        Restores an archived workflow instance with it's task invitations,
+        or an archived task invitation.
+
+        Args:
+            key: Key of WFInstance or TaskInvitation.
+
+        Returns:
+            Restored object or None if it's not found in archive.
+        """
+        for model in (WFInstance, TaskInvitation):
+            index = ArchiveIndex(model.__name__)
+            file_name = index.get_file(key)
+            if not file_name:
+                continue
+            record = self.archive_files.find(file_name, key)
+            obj = model(key=key).set_data(record['data'], from_db=True).save()
+            for inv in record.get('invitations', []):
+                TaskInvitation(key=inv['key']).set_data(inv['data'], from_db=True).save()
+            self.archive_files.remove(file_name, [key])
+            index.remove(key)
+            return obj
+
+
+class ArchiveSchedule(Cache):
+    """
+    Time of the last scheduled archiving, shared by all workers.
+    """
+    PREFIX = 'ARCHSCHD'
+    SERIALIZE = False
+
+    def __init__(self):
+        super(ArchiveSchedule, self).__init__('last_run')
+
+    def claim(self, interval):
+        """
+        Claims the archiving of current period.
+
+        Args:
+            interval (int): Archiving period in seconds.
+
+        Returns:
+            True if archiving isn't done by another worker in this period.
+        """
+        return bool(cache.set(self.key, int(time.time()), ex=interval, nx=True))
+
+
+@bg_job("_zops_archive_workflows")
+def archive_workflows(current):
+    """
+    BG Job for archiving old workflow instances and task invitations.
+    Published by workers once per :attr:`~zengine.settings.WF_ARCHIVE_INTERVAL`.
+    """
+    stats = WorkflowArchiver().archive()
+    current.log.info("Archived workflows: %s" % stats)
+
 
 class WFCache(Cache):
     """
@@ -700,10 +1142,9 @@ class WFCache(Cache):
         _data = {'exchange': 'input_exc',
                  # 'routing_key': self.sess_id,
                  'routing_key': '',
-                 'body': json.dumps({
-                     'data': data,
-                     '_zops_source': 'Internal',
-                     '_zops_remote_ip': ''})}
+                 'properties': pika.BasicProperties(headers={'_zops_source': 'Internal',
+                                                             '_zops_remote_ip': ''}),
+                 'body': json_interface.dumps({'data': data})}
         try:
             self.mq_channel.basic_publish(**_data)
         except (AttributeError, ConnectionClosed, ChannelClosed):
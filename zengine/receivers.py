@@ -7,15 +7,27 @@
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
 
-from zengine.models import TaskInvitation, WFCache
+from pika.exceptions import AMQPError
+from redis.exceptions import RedisError
+from riak import RiakError
+from zengine.models import TaskInvitation, WFCache, Channel
 from pyoko.conf import settings
+from pyoko.db.adapter.db_riak import BlockSave
+from pyoko.fields import DATE_TIME_FORMAT
+from pyoko.lib.utils import get_object_from_path
+from zengine.client_queue import JobPublisher
+from zengine.lib.cache import LaneChangeVersion
+from zengine.lib.decorators import bg_job
 from zengine.dispatch.dispatcher import receiver
 from zengine.signals import lane_user_change, crud_post_save
+from zengine.log import log
 from datetime import datetime
 from datetime import timedelta
 
 __all__ = [
     'send_message_for_lane_change',
+    'lane_change_invitations',
+    'build_select_box_index',
     'set_password',
 ]
 
@@ -31,6 +43,11 @@ def send_message_for_lane_change(sender, **kwargs):
     Sends a message to possible owners of the current workflows
      next lane.
 
+    Invitations of the first
+    :attr:`~zengine.settings.LANE_CHANGE_INVITATION_SHARD_SIZE` owners are created
+    immediately, the rest are split into shards of the same size and
+    created by ``_zops_lane_change_invitations`` jobs.
+
     Args:
         **kwargs: ``current`` and ``possible_owners`` are required.
         sender (User): User object
@@ -47,30 +64,101 @@ def send_message_for_lane_change(sender, **kwargs):
     # Deletion of used passive task invitation which belongs to previous lane.
     TaskInvitation.objects.filter(instance=wfi, role=current.role, wf_name=wfi.wf.name).delete()
 
-    today = datetime.today()
-    for recipient in owners:
-        inv = TaskInvitation(
-            instance=wfi,
-            role=recipient,
-            wf_name=wfi.wf.name,
-            progress=30,
-            start_date=today,
-            finish_date=today + timedelta(15)
-        )
-        inv.title = current.task_data.get('INVITATION_TITLE') or wfi.wf.title
-        inv.save()
-
-        # try to send notification, if it fails go on
-        try:
-
-            recipient.send_notification(title=msg_context['title'],
-                                        message="%s %s" % (wfi.wf.title, msg_context['body']),
-                                        typ=1,  # info
-                                        url='',
-                                        sender=sender
-                                        )
-        except: # todo: specify which exception
-            pass
+    # role and user keys are read without loading the linked objects
+    owner_keys = [(role.key, role.user_id) for role in owners]
+    # shards of previous lane changes will be skipped
+    version = LaneChangeVersion(wfi.key).increment()
+    shard_size = settings.LANE_CHANGE_INVITATION_SHARD_SIZE
+    invitation = {
+        'wfi_key': wfi.key,
+        'wf_name': wfi.wf.name,
+        'title': current.task_data.get('INVITATION_TITLE') or wfi.wf.title,
+        'msg_title': msg_context['title'],
+        'msg_body': "%s %s" % (wfi.wf.title, msg_context['body']),
+        'sender_key': sender.key if sender else None,
+        'start_date': datetime.today().strftime(DATE_TIME_FORMAT),
+    }
+    create_invitations(owner_keys[:shard_size], **invitation)
+    for i in range(shard_size, len(owner_keys), shard_size):
+        JobPublisher.publish('_zops_lane_change_invitations',
+                             owners=owner_keys[i:i + shard_size],
+                             lane_change_version=version, **invitation)
+
+
+@bg_job('_zops_lane_change_invitations')
+def lane_change_invitations(current):
+    """
+    Creates a shard of lane change invitations.
+    Skipped if workflow instance moved to another lane since the job is published.
+    See :func:`send_message_for_lane_change`.
+    """
+    wfi_key = current.input['wfi_key']
+    if LaneChangeVersion(wfi_key).get_version() != current.input['lane_change_version']:
+        log.info("Skipped lane change invitations of %s, lane is changed again", wfi_key)
+        return
+    create_invitations(**current.input)
+
+
+@bg_job('_zops_build_select_box_index')
+def build_select_box_index(current):
+    """
+    Builds the select box search index of a model.
+    Published by :meth:`~zengine.views.crud.CrudView.select_list`
+    when the index doesn't exist.
+    """
+    from pyoko.modelmeta import model_registry
+    from zengine.views.crud import SelectBoxCache
+    model = model_registry.get_model(current.input['model'])
+    log.info("%s objects indexed for select boxes of %s" % (SelectBoxCache(model).build(),
+                                                           model.__name__))
+
+
+def create_invitations(owners, wfi_key, wf_name, title, msg_title, msg_body, sender_key,
+                       start_date, **kwargs):
+    """
+    Creates task invitations for given roles and sends
+    notifications to their users.
+
+    Args:
+        owners (list): (role key, user key) pairs.
+        wfi_key: Key of the workflow instance.
+        wf_name (str): Workflow name.
+        title (str): Invitation title.
+        msg_title (str): Notification title.
+        msg_body (str): Notification text.
+        sender_key: Key of the user who made the lane change.
+        start_date (str): Start date of invitations, in DATE_TIME_FORMAT.
+    """
+    if not owners:
+        return
+    start = datetime.strptime(start_date, DATE_TIME_FORMAT)
+    with BlockSave(TaskInvitation, query_dict={'instance_id': wfi_key}):
+        for role_key, user_key in owners:
+            TaskInvitation(
+                instance_id=wfi_key,
+                role_id=role_key,
+                wf_name=wf_name,
+                title=title,
+                progress=30,
+                start_date=start,
+                finish_date=start + timedelta(15)
+            ).save()
+
+    user_model = get_object_from_path(settings.USER_MODEL)
+    sender = user_model.objects.get(sender_key) if sender_key else None
+    receivers = list(user_model.objects.filter(
+        key__in=[user_key for _, user_key in owners]).set_params(rows=len(owners)))
+    # try to send notifications, if it fails go on
+    try:
+        Channel.add_notifications(receivers,
+                                  title=msg_title,
+                                  body=msg_body,
+                                  typ=1,  # info
+                                  url='',
+                                  sender=sender)
+    except (AMQPError, RedisError, RiakError):
+        log.exception("Lane change notifications couldn't be sent to %s",
+                      ', '.join(receiver.key for receiver in receivers))
 
 
 # encrypting password on save
@@ -33,6 +33,9 @@ TRANSLATIONS_DIR = os.path.join(BASE_DIR, 'locale')
 # with the value specifying the language their applications messages are in.
 TRANSLATION_DOMAINS = {'zengine': 'en'}
 
+#: Max. number of translated messages cached per language
+TRANSLATION_CACHE_SIZE = 10000
+
 #: Path of the activity modules which will be invoked by workflow tasks
 ACTIVITY_MODULES_IMPORT_PATHS = ['zengine.views']
 
@@ -79,6 +82,23 @@ LOG_LEVEL = os.environ.get('LOG_LEVEL', 'DEBUG')
 #: Log file path.
 LOG_FILE = os.environ.get('LOG_FILE', './zengine.log')
 
+#: Max length of logged request/response payloads. Set to 0 to disable truncation.
+LOG_PAYLOAD_MAX_LENGTH = int(os.environ.get('LOG_PAYLOAD_MAX_LENGTH', 5000))
+
+#: Only every n'th (debug/info) payload log record will be written.
+LOG_PAYLOAD_SAMPLING = int(os.environ.get('LOG_PAYLOAD_SAMPLING', 1))
+
+#: Write log records from a background thread, without blocking the request.
+#: Off by default for workers and management commands, tornado gateway
+#: has it's own default (on).
+LOG_ASYNC = bool(int(os.environ.get('LOG_ASYNC', 0)))
+
+#: Max. number of log records waiting to be written. Excess records will be dropped.
+LOG_ASYNC_BUFFER_SIZE = int(os.environ.get('LOG_ASYNC_BUFFER_SIZE', 10000))
+
+#: Max. number of log records written at once.
+LOG_ASYNC_BATCH_SIZE = int(os.environ.get('LOG_ASYNC_BATCH_SIZE', 200))
+
 #: Default cache expire time in seconds
 DEFAULT_CACHE_EXPIRE_TIME = 99999999
 
@@ -205,9 +225,23 @@ DATETIME_DEFAULT_FORMAT = "%d.%m.%YT%H:%M:%S.%fZ"
 #: UpdatePermissions command uses this object to get available permmissions
 PERMISSION_PROVIDER = 'zengine.auth.permissions.get_all_permissions'
 
+#: Number of permission tree levels sent to permission editing view at once.
+#: Deeper levels are loaded on demand. None sends the whole tree.
+PERMISSION_TREE_DEPTH = None
+
 #: Max number of items for non-filtered dropdown boxes.
 MAX_NUM_DROPDOWN_LINKED_MODELS = 20
 
+#: Max. number of items returned for searched dropdown boxes.
+MAX_NUM_SELECT_LIST_RESULTS = 50
+
+#: Minimum number of changed diagrams to parse and compile them in parallel processes.
+PARALLEL_PARSE_THRESHOLD = 4
+
+#: Max. number of compiled form layouts kept in memory of each worker.
+#: Set to 0 to disable form layout caching.
+FORM_LAYOUT_CACHE_SIZE = int(os.environ.get('FORM_LAYOUT_CACHE_SIZE', 500))
+
 #: Internal Server Error message description
 ERROR_MESSAGE_500 = 'Internal Server Error'
 
@@ -217,3 +251,63 @@ MESSAGING_USER_SEARCH_FIELDS = ['username', 'name', 'surname']
 #: Unit search method of messaging subsystem will work on these fields
 MESSAGING_UNIT_SEARCH_FIELDS = ['name',]
 
+#: Number of latest messages kept in cache for each channel.
+#: Channel display and first page of channel history are served from this cache.
+MESSAGING_RECENT_MESSAGES_SIZE = int(os.environ.get('MESSAGING_RECENT_MESSAGES_SIZE', 50))
+
+#: Number of channel members per page.
+MESSAGING_MEMBERS_PER_PAGE = int(os.environ.get('MESSAGING_MEMBERS_PER_PAGE', 50))
+
+#: Cache lifetime of user display data (name, avatar) in seconds.
+MESSAGING_USER_CARD_LIFETIME = int(os.environ.get('MESSAGING_USER_CARD_LIFETIME', 3600))
+
+#: Root directory of content addressed file storage (message attachments).
+#: Tornado gateway stores the uploaded files here, so it should be shared with workers.
+FILE_STORAGE_ROOT = os.environ.get('FILE_STORAGE_ROOT', 'files')
+
+#: URL prefix of the files in file storage.
+FILE_STORAGE_URL = os.environ.get('FILE_STORAGE_URL', '/files/')
+
+#: Number of members processed at once while adding many members to a channel.
+MESSAGING_SUBSCRIBE_BATCH_SIZE = int(os.environ.get('MESSAGING_SUBSCRIBE_BATCH_SIZE', 200))
+
+#: Member additions larger than this will be run as a background job.
+MESSAGING_BACKGROUND_SUBSCRIBE_LIMIT = int(os.environ.get('MESSAGING_BACKGROUND_SUBSCRIBE_LIMIT',
+                                                          100))
+
+
+#: Save messages through a write-behind queue instead of saving them before returning.
+#: Queued messages are saved in order by a background job.
+#: Messages which can't be saved are kept in "WBQ:Message:dead" redis list.
+MESSAGING_WRITE_BEHIND = bool(int(os.environ.get('MESSAGING_WRITE_BEHIND', 0)))
+
+#: Number of messages saved at once by write-behind job.
+MESSAGING_WRITE_BEHIND_BATCH_SIZE = int(os.environ.get('MESSAGING_WRITE_BEHIND_BATCH_SIZE', 100))
+
+#: Record fan-out size and publish latency of messages per channel type.
+#: See ``messaging_stats`` management command.
+MESSAGING_PUBLISH_STATS = bool(int(os.environ.get('MESSAGING_PUBLISH_STATS', 1)))
+
+#: Lane change invitations of this many owners are created in the request,
+#: the rest are created in shards of the same size by background jobs.
+LANE_CHANGE_INVITATION_SHARD_SIZE = int(os.environ.get('LANE_CHANGE_INVITATION_SHARD_SIZE', 50))
+
+#: Max number of task invitation keys returned from search index.
+#: Searches which match more invitations are run on Solr. Should be well below
+#: Solr's maxBooleanClauses (1024), since keys are queried with a single clause each.
+TASK_SEARCH_MAX_KEYS = int(os.environ.get('TASK_SEARCH_MAX_KEYS', 500))
+
+#: Directory of compressed archive files of finished workflows.
+WF_ARCHIVE_ROOT = os.environ.get('WF_ARCHIVE_ROOT', 'archive')
+
+#: Finished workflow instances and finished or expired task invitations
+#: older than this many days are moved to archive by ``archive_workflows`` command.
+WF_ARCHIVE_RETENTION_DAYS = int(os.environ.get('WF_ARCHIVE_RETENTION_DAYS', 90))
+
+#: Number of records per archive file.
+WF_ARCHIVE_BATCH_SIZE = int(os.environ.get('WF_ARCHIVE_BATCH_SIZE', 500))
+
+#: Run ``_zops_archive_workflows`` job once in this many seconds, by one of the workers.
+#: Disabled by default. Workers should share the same WF_ARCHIVE_ROOT when enabled,
+#: since archive files are written by the worker which runs the job.
+WF_ARCHIVE_INTERVAL = int(os.environ.get('WF_ARCHIVE_INTERVAL', 0))
@@ -6,8 +6,260 @@
 #
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
+import atexit
+import itertools
 import logging
 import os
+import threading
+from collections import defaultdict
+from pprint import pformat
+
+try:
+    from Queue import Queue, Full, Empty
+except ImportError:  # Python 3
+    from queue import Queue, Full, Empty
+
+
+class Payload(object):
+    """
+    Lazy log argument for hot paths.
+
+    Wrapped object is formatted only if the log record is actually emitted,
+    so building big log messages costs nothing when log level drops them.
+    If a callable is given, it will be called at formatting time.
+    Rendered text is cached, so the same payload can be logged more than once.
+
+    .. code-block:: python
+
+        log.debug("INPUT DATA: %s", Payload(current.input))
+        log.debug("READY TASKS: %s", Payload(lambda: workflow.get_tasks(Task.READY)))
+
+    Args:
+        obj: Object or callable to be formatted.
+        pretty (bool): Use pprint.pformat instead of plain string formatting.
+    """
+    __slots__ = ('obj', 'pretty', '_text')
+
+    def __init__(self, obj, pretty=False):
+        self.obj = obj
+        self.pretty = pretty
+        self._text = None
+
+    def __str__(self):
+        if self._text is None:
+            obj = self.obj() if callable(self.obj) else self.obj
+            self._text = pformat(obj) if self.pretty else '%s' % (obj,)
+        return self._text
+
+    def truncate(self, max_length):
+        """
+        Returns formatted payload, truncated to max_length.
+
+        Args:
+            max_length (int): Max. number of chars. 0 means no limit.
+
+        Returns:
+            String.
+        """
+        text = str(self)
+        if max_length and len(text) > max_length:
+            return "%s... [%s chars truncated]" % (text[:max_length], len(text) - max_length)
+        return text
+
+
+class PayloadFilter(logging.Filter):
+    """
+    Truncates :class:`Payload` arguments of log records
+    and samples payload carrying records below WARNING level.
+
+    Args:
+        max_length (int): Max. length of a formatted payload. 0 means no limit.
+        sample_every (int): Only every n'th payload carrying record will be emitted.
+    """
+
+    def __init__(self, max_length=0, sample_every=1):
+        super(PayloadFilter, self).__init__()
+        self.max_length = max_length
+        self.sample_every = max(sample_every, 1)
+        self._counter = itertools.count()
+
+    def filter(self, record):
+        if not isinstance(record.args, tuple):
+            return True
+        if not any(isinstance(arg, Payload) for arg in record.args):
+            return True
+        if (self.sample_every > 1 and record.levelno < logging.WARNING and
+                next(self._counter) % self.sample_every):
+            return False
+        record.args = tuple(arg.truncate(self.max_length) if isinstance(arg, Payload) else arg
+                            for arg in record.args)
+        return True
+
+
+class AsyncLogHandler(logging.Handler):
+    """
+    Non-blocking log handler.
+
+    Records are formatted in the caller's thread, put into a bounded in-memory
+    queue and written to the ``target`` handler by a background thread in batches.
+    So a slow disk doesn't stall the worker or the tornado IOLoop.
+
+    If the queue is full, incoming records are dropped and counted. Error records
+    take the place of the oldest queued record instead. Number of dropped records
+    are reported to the log itself.
+
+    In forked child processes (e.g. multiprocessing pools), a new queue and
+    background thread are created on first use. Records queued by the parent
+    are left to the parent.
+
+    Args:
+        target (logging.StreamHandler): Actual handler, which does the writing.
+        capacity (int): Max. number of records waiting in the queue.
+        batch_size (int): Max. number of records written at once.
+    """
+    _STOP = object()
+
+    def __init__(self, target, capacity=10000, batch_size=200):
+        super(AsyncLogHandler, self).__init__()
+        self.target = target
+        self.batch_size = batch_size
+        self._exc_formatter = logging.Formatter()
+        self._closed = False
+        self._start(capacity)
+        atexit.register(self.close)
+
+    def _start(self, capacity):
+        self._pid = os.getpid()
+        self.queue = Queue(maxsize=capacity)
+        self.written = 0
+        self.dropped = defaultdict(int)
+        self._reported_drops = 0
+        self._thread = threading.Thread(target=self._run, name='AsyncLogHandler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _check_fork(self):
+        """
+        Restarts the handler in a forked child process. Locks of the inherited
+        queue and target may be held by the parent's writer thread, so they are not used.
+        """
+        if self._pid == os.getpid() or self._closed:
+            return
+        self.target.createLock()
+        self._start(self.queue.maxsize)
+        # pool workers exit without running atexit handlers
+        from multiprocessing import util
+        util.Finalize(self, self.close, exitpriority=10)
+
+    def prepare(self, record):
+        """
+        Merges args into message and renders exception info, so that
+        the record doesn't hold references to mutable objects of the request.
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        self._check_fork()
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Full:
+            if record.levelno >= logging.ERROR and self._make_room():
+                try:
+                    self.queue.put_nowait(record)
+                except Full:  # filled by another thread
+                    self.dropped[record.levelname] += 1
+            else:
+                self.dropped[record.levelname] += 1
+        except Exception:
+            self.handleError(record)
+
+    def _make_room(self):
+        """
+        Drops the oldest queued record to make room for an error record.
+        """
+        try:
+            old = self.queue.get_nowait()
+        except Empty:
+            return False
+        if old is self._STOP:
+            self.queue.put_nowait(old)
+            return False
+        self.dropped[old.levelname] += 1
+        return True
+
+    def stats(self):
+        """
+        Returns:
+            Dict. Number of written, dropped and queued records.
+        """
+        return {'written': self.written,
+                'dropped': dict(self.dropped),
+                'queued': self.queue.qsize()}
+
+    def _get_batch(self):
+        batch = [self.queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    def _drop_report(self):
+        total = sum(self.dropped.values())
+        if total == self._reported_drops:
+            return
+        self._reported_drops = total
+        return logging.makeLogRecord({
+            'name': 'AsyncLogHandler', 'levelno': logging.WARNING, 'levelname': 'WARNING',
+            'msg': "Log buffer was full, %s record(s) dropped so far: %s" % (
+                total, dict(self.dropped))})
+
+    def _write(self, records):
+        target = self.target
+        records = [r for r in records if target.filter(r)]
+        text = ''.join('%s\n' % target.format(r) for r in records)
+        target.acquire()
+        try:
+            target.stream.write(text)
+            target.flush()
+        finally:
+            target.release()
+        self.written += len(records)
+
+    def _run(self):
+        while True:
+            batch = self._get_batch()
+            stop = self._STOP in batch
+            records = [r for r in batch if r is not self._STOP]
+            drop_report = self._drop_report()
+            if drop_report:
+                records.append(drop_report)
+            try:
+                self._write(records)
+            except Exception:
+                for record in records:
+                    self.target.handleError(record)
+            if stop:
+                return
+
+    def close(self):
+        """
+        Writes the remaining records then stops the background thread.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._pid == os.getpid() and self._thread.is_alive():
+            self.queue.put(self._STOP)
+            self._thread.join(5)
+        self.target.close()
+        super(AsyncLogHandler, self).close()
 
 
 def get_logger(settings):
@@ -34,6 +286,16 @@ def get_logger(settings):
     # add formatter to ch
     ch.setFormatter(formatter)
 
+    # write log records from a background thread
+    if getattr(settings, 'LOG_ASYNC', False):
+        ch = AsyncLogHandler(ch,
+                             capacity=getattr(settings, 'LOG_ASYNC_BUFFER_SIZE', 10000),
+                             batch_size=getattr(settings, 'LOG_ASYNC_BATCH_SIZE', 200))
+
     # add ch to logger
     logger.addHandler(ch)
+
+    # truncation and sampling of hot path payloads
+    logger.addFilter(PayloadFilter(getattr(settings, 'LOG_PAYLOAD_MAX_LENGTH', 0),
+                                   getattr(settings, 'LOG_PAYLOAD_SAMPLING', 1)))
     return logger
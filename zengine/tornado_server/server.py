@@ -6,16 +6,32 @@ tornado websocket proxy for WF worker daemons
 #
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
-import json
 import os, sys
 import traceback
 from uuid import uuid4
-from tornado import websocket, web, ioloop
-from tornado.escape import json_decode, json_encode
-from tornado.httpclient import HTTPError
+from concurrent.futures import ThreadPoolExecutor
+from tornado import websocket, web, ioloop, gen
+from tornado.web import HTTPError
 
 sys.path.insert(0, os.path.realpath(os.path.dirname(__file__)))
-from ws_to_queue import QueueManager, log, settings
+from ws_to_queue import QueueManager, log, settings, json_encode, Payload
+
+try:
+    from zengine.lib.json_interface import loads as json_decode
+except ImportError:
+    # gateway deployed without zengine
+    from tornado.escape import json_decode
+
+try:
+    from zengine.lib.cache import Session
+    from zengine.lib.file_storage import LocalFileStorage
+    file_storage = LocalFileStorage(settings.FILE_STORAGE_ROOT, settings.FILE_STORAGE_URL)
+except ImportError:
+    # gateway deployed without zengine, uploads are disabled
+    file_storage = None
+
+# hashing, storing and session lookups of files are kept off the IOLoop
+file_executor = ThreadPoolExecutor(settings.FILE_STORAGE_THREADS)
 
 COOKIE_NAME = 'zopsess'
 DEBUG = os.getenv("DEBUG", False)
@@ -52,15 +68,15 @@ class SocketHandler(websocket.WebSocketHandler):
         sess_id = self._get_sess_id()
         if sess_id:
             self.application.pc.websockets[self._get_sess_id()] = self
-            self.write_message(json.dumps({"cmd": "status", "status": "open"}))
+            self.write_message(json_encode({"cmd": "status", "status": "open"}))
         else:
-            self.write_message(json.dumps({"cmd": "error", "error": "Please login", "code": 401}))
+            self.write_message(json_encode({"cmd": "error", "error": "Please login", "code": 401}))
 
     def on_message(self, message):
         """
         called on new websocket message,
         """
-        log.debug("WS MSG for %s: %s" % (self._get_sess_id(), message))
+        log.debug("WS MSG for %s: %s", self._get_sess_id(), Payload(message))
         self.application.pc.redirect_incoming_message(self._get_sess_id(), message, self.request)
 
     def on_close(self):
@@ -127,9 +143,8 @@ class HttpHandler(web.RequestHandler):
         else:
             sess_id = self.get_cookie(COOKIE_NAME)
         # h_sess_id = "HTTP_%s" % sess_id
-        input_data = {'data': input_data,
-                      '_zops_remote_ip': self.request.remote_ip}
-        log.info("New Request for %s: %s" % (sess_id, input_data))
+        input_data = {'data': input_data}
+        log.info("New Request for %s: %s", sess_id, Payload(input_data))
 
         self.application.pc.register_websocket(sess_id, self)
         self.application.pc.redirect_incoming_message(sess_id,
@@ -137,7 +152,7 @@ class HttpHandler(web.RequestHandler):
                                                       self.request)
 
     def write_message(self, output):
-        log.debug("WRITE MESSAGE To CLIENT: %s" % output)
+        log.debug("WRITE MESSAGE To CLIENT: %s", Payload(output))
         # if 'login_process' not in output:
         #     # workaround for premature logout bug (empty login form).
         #     # FIXME: find a better way to handle HTTP and SOCKET connections for same sess_id.
@@ -148,12 +163,78 @@ class HttpHandler(web.RequestHandler):
 
 
 
+def get_session_user(sess_id):
+    """
+    Reads the logged in user of the session from session store.
+
+    Args:
+        sess_id: Session id, value of the session cookie.
+
+    Returns:
+        User key, None if session doesn't exist or it's not logged in.
+    """
+    return Session(sess_id).get('user_id') if sess_id else None
+
+
+# noinspection PyAbstractClass
+class UploadHandler(HttpHandler):
+    """
+    Stores the raw request body in content addressed file storage.
+    Returned hash can be used to attach the file to messages.
+
+    .. code-block:: python
+
+        # response:
+        {
+            'hash': string,     # SHA-256 digest of file content
+            'size': int,
+            'created': boolean, # false if same file already uploaded
+        }
+    """
+
+    @gen.coroutine
+    def post(self):
+        self._handle_headers()
+        if file_storage is None:
+            raise HTTPError(501, "File storage is not available")
+        if len(self.request.body) > settings.FILE_UPLOAD_MAX_SIZE:
+            raise HTTPError(413, "File is too large")
+        user_id = yield file_executor.submit(get_session_user, self.get_cookie(COOKIE_NAME))
+        if not user_id:
+            raise HTTPError(401, "Login required")
+        file_hash, created = yield file_executor.submit(file_storage.store, self.request.body)
+        log.info("File uploaded by %s: %s", user_id, file_hash)
+        self.finish(json_encode({'hash': file_hash,
+                                 'size': len(self.request.body),
+                                 'created': created}))
+
+
+# noinspection PyAbstractClass
+class FileHandler(web.StaticFileHandler):
+    """
+    Serves stored files to logged in users.
+
+    Files are addressed by the digest of their content, any logged in
+    user who knows the digest (e.g. from a message attachment) can read it.
+    """
+
+    @gen.coroutine
+    def prepare(self):
+        user_id = yield file_executor.submit(get_session_user, self.get_cookie(COOKIE_NAME))
+        if not user_id:
+            raise HTTPError(401, "Login required")
+
 
 URL_CONFS = [
     (r'/ws', SocketHandler),
+    (r'/upload', UploadHandler),
     (r'/(\w+)', HttpHandler),
 ]
 
+if file_storage is not None:
+    URL_CONFS.append((r'%s(.*)' % settings.FILE_STORAGE_URL, FileHandler,
+                      {'path': file_storage.root}))
+
 app = web.Application(URL_CONFS, debug=DEBUG, autoreload=False)
 
 
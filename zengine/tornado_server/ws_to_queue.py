@@ -6,7 +6,6 @@
 #
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
-import json
 from uuid import uuid4
 
 import os, sys
@@ -15,17 +14,27 @@ import pika
 import time
 from pika.adapters import TornadoConnection, BaseConnection
 from pika.exceptions import ChannelClosed, ConnectionClosed
-from tornado.escape import json_decode, json_encode
 
 try:
-    from .get_logger import get_logger
+    from .get_logger import get_logger, Payload
 except:
-    from get_logger import get_logger
+    from get_logger import get_logger, Payload
+
+try:
+    from zengine.lib.json_interface import dumps as json_encode
+except ImportError:
+    # gateway deployed without zengine
+    from tornado.escape import json_encode
 
 settings = type('settings', (object,), {
     'LOG_HANDLER': os.environ.get('LOG_HANDLER', 'file'),
     'LOG_FILE': os.environ.get('TORNADO_LOG_FILE', 'tornado.log'),
     'LOG_LEVEL': os.environ.get('LOG_LEVEL', 'DEBUG'),
+    'LOG_PAYLOAD_MAX_LENGTH': int(os.environ.get('LOG_PAYLOAD_MAX_LENGTH', 5000)),
+    'LOG_PAYLOAD_SAMPLING': int(os.environ.get('LOG_PAYLOAD_SAMPLING', 1)),
+    'LOG_ASYNC': bool(int(os.environ.get('LOG_ASYNC', 1))),
+    'LOG_ASYNC_BUFFER_SIZE': int(os.environ.get('LOG_ASYNC_BUFFER_SIZE', 10000)),
+    'LOG_ASYNC_BATCH_SIZE': int(os.environ.get('LOG_ASYNC_BATCH_SIZE', 200)),
     'MQ_HOST': os.environ.get('MQ_HOST', 'localhost'),
     'MQ_PORT': int(os.environ.get('MQ_PORT', '5672')),
     'MQ_USER': os.environ.get('MQ_USER', 'guest'),
@@ -33,6 +42,10 @@ settings = type('settings', (object,), {
     'DEBUG': bool(int(os.environ.get('DEBUG', 0))),
     'MQ_VHOST': os.environ.get('MQ_VHOST', '/'),
     'ALLOWED_ORIGINS': os.environ.get('ALLOWED_ORIGINS', 'http://127.0.0.1'),
+    'FILE_STORAGE_ROOT': os.environ.get('FILE_STORAGE_ROOT', 'files'),
+    'FILE_STORAGE_URL': os.environ.get('FILE_STORAGE_URL', '/files/'),
+    'FILE_UPLOAD_MAX_SIZE': int(os.environ.get('FILE_UPLOAD_MAX_SIZE', 20 * 1024 * 1024)),
+    'FILE_STORAGE_THREADS': int(os.environ.get('FILE_STORAGE_THREADS', 4)),
 })
 log = get_logger(settings)
 
@@ -52,6 +65,26 @@ NON_BLOCKING_MQ_PARAMS = pika.ConnectionParameters(
 )
 
 
+def make_message_properties(sess_id, remote_ip, source):
+    """
+    Creates AMQP message properties which carry the metadata of client message.
+
+    Workers read these headers instead of parsing the "_zops_*" keys from
+    message body, so client frames can be forwarded without decoding.
+
+    Args:
+        sess_id: Session id
+        remote_ip: IP address of client
+        source: "Remote" for client messages, "Internal" for system generated ones.
+
+    Returns:
+        pika.BasicProperties
+    """
+    return pika.BasicProperties(headers={'_zops_sess_id': sess_id,
+                                         '_zops_remote_ip': remote_ip,
+                                         '_zops_source': source})
+
+
 class QueueManager(object):
     """
     Async RabbitMQ & Tornado websocket connector
@@ -137,13 +170,13 @@ class QueueManager(object):
     def inform_disconnection(self, sess_id):
         self.in_channel.basic_publish(exchange='input_exc',
                                       routing_key=sess_id,
+                                      properties=make_message_properties(sess_id, '',
+                                                                         'Internal'),
                                       body=json_encode(dict(data={
                                           'view': '_zops_mark_offline_user',
-                                          'sess_id': sess_id,},
-                                          _zops_source= 'Internal',
-                                          _zops_remote_ip='')))
+                                          'sess_id': sess_id,})))
 
-        self.websockets[sess_id].write_message(json.dumps({"cmd": "status", "status": "closing"}))
+        self.websockets[sess_id].write_message(json_encode({"cmd": "status", "status": "closing"}))
 
     def unregister_websocket(self, sess_id):
         # user_id = sys.sessid_to_userid.get(sess_id, None)
@@ -181,26 +214,34 @@ class QueueManager(object):
 
 
     def redirect_incoming_message(self, sess_id, message, request):
-        message = json_decode(message)
-        message['_zops_sess_id'] = sess_id
-        message['_zops_remote_ip'] = request.remote_ip
-        message['_zops_source'] = 'Remote'
+        """
+        Forwards client message to workers as is,
+        metadata of the message is carried in AMQP headers.
+
+        Args:
+            sess_id: Session id
+            message: Raw JSON message of client
+            request: Tornado request object
+        """
         self.in_channel.basic_publish(exchange='input_exc',
                                       routing_key=sess_id,
-                                      body=json_encode(message))
+                                      properties=make_message_properties(sess_id,
+                                                                         request.remote_ip,
+                                                                         'Remote'),
+                                      body=message)
 
     def on_message(self, channel, method, header, body):
         sess_id = method.consumer_tag
-        log.debug("WS RPLY for %s" % sess_id)
-        log.debug("WS BODY for %s" % body)
+        log.debug("WS RPLY for %s", sess_id)
+        log.debug("WS BODY for %s", Payload(body))
         try:
             if sess_id in self.websockets:
                 log.info("write msg to client")
                 self.websockets[sess_id].write_message(body)
-                log.debug("WS OBJ %s" % self.websockets[sess_id])
+                log.debug("WS OBJ %s", self.websockets[sess_id])
             channel.basic_ack(delivery_tag=method.delivery_tag)
         except RuntimeError:
-            log.exception("CANT WRITE TO HTTP OR WS: %s\n \n%s" % (sess_id, body))
+            log.exception("CANT WRITE TO HTTP OR WS: %s\n \n%s", sess_id, Payload(body))
         except KeyError:
             self.unregister_websocket(sess_id)
-            log.exception("CANT FIND WS OR HTTP: %s" % sess_id)
+            log.exception("CANT FIND WS OR HTTP: %s", sess_id)
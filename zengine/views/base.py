@@ -66,15 +66,11 @@ class BaseView(object):
         """
         # since we dont have a method to modify properties of form that generated from models
         # I'm using an ugly workaround for now
-        try:
-            serialized_form['schema']['properties']['Permissions']['widget'] = 'filter_interface'
-        except KeyError:
-            pass
-        try:
-            serialized_form['schema']['properties']['RestrictedPermissions'][
-                'widget'] = 'filter_interface'
-        except KeyError:
-            pass
+        # properties are shared with the cached form layout, they're replaced, not modified
+        properties = serialized_form['schema']['properties']
+        for name in ('Permissions', 'RestrictedPermissions'):
+            if name in properties:
+                properties[name] = dict(properties[name], widget='filter_interface')
 
     def _add_meta_props(self, _form):
         if hasattr(_form, 'META_TO_FORM_META'):
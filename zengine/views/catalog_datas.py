@@ -8,7 +8,9 @@ This module consists view methods of add/edit catalog datas of framework.
 """
 __author__ = 'evren kutar'
 
+from pyoko.conf import settings
 from pyoko.db.connection import client
+from pyoko.lib.utils import get_object_from_path
 from pyoko import Model, field, ListNode
 from zengine.views.crud import CrudView
 from zengine import forms
@@ -117,6 +119,9 @@ class CatalogDataView(CrudView):
                 newobj = fixture_bucket.get(self.input["object_key"])
                 newobj.data = edited_object
                 newobj.store()
+                # refresh caches of all workers
+                get_object_from_path(settings.CATALOG_DATA_MANAGER).update(
+                    self.input["object_key"], edited_object)
 
                 # notify user by passing notify in output object
                 self.output["notify"] = "catalog: %s successfully updated." % self.input[
@@ -7,24 +7,29 @@
 This module holds CrudView and related classes that helps building
 CRUDS (Create Read Update Delete Search) type of views.
 """
+import datetime
 from collections import OrderedDict
 from operator import attrgetter
 
 import six
 
+from pyoko import fields as model_fields
 from pyoko.conf import settings
 from pyoko.exceptions import ObjectDoesNotExist
+from pyoko.lib.utils import un_camel_id
 from pyoko.model import Model, model_registry
 from zengine import signals
 from zengine.auth.permissions import PERM_REQ_TASK_TYPES
+from zengine.client_queue import JobPublisher
 from zengine.dispatch.dispatcher import receiver
 from zengine import forms
 from zengine.forms import fields
-from zengine.lib.cache import Cache
+from zengine.lib import json_interface
+from zengine.lib.cache import Cache, cache
 from zengine.lib.exceptions import HTTPError
 from zengine.lib.utils import date_to_solr, gettext_lazy as _
 from zengine.log import log
-from zengine.signals import crud_post_save
+from zengine.signals import crud_post_save, crud_post_delete
 from zengine.views.base import BaseView
 
 
@@ -166,21 +171,380 @@ def list_query(func):
 
 class SelectBoxCache(Cache):
     """
-    Cache object for queries that will be made to fill auto-complete
-    select boxes of relations.
+    Substring index of ``Meta.search_fields`` values of a model's objects,
+    to search auto-complete select boxes of relations.
+
+    Lower cased values of each object are stored in a hash, and every
+    suffix of them is stored in a lexicographically sorted set as
+    ``<suffix>\\x00<object key>``. So the first N objects that contain a
+    search text can be read from the sorted set without counting them.
+
+    Index is built by :meth:`build` in the ``_zops_build_select_box_index``
+    job or with ``build_select_box_index`` management command, then updated
+    on ``crud_post_save`` and ``crud_post_delete`` signals. It expires after
+    :attr:`~zengine.settings.DEFAULT_CACHE_EXPIRE_TIME` and can be
+    dropped with ``SelectBoxCache.flush(model_name)``.
+
+    Args:
+        model: Model class.
     """
     PREFIX = 'MDLST'
+    #: Indexed length of values, longer search queries are truncated.
+    MAX_ENTRY_LENGTH = 50
+    BUILD_TIMEOUT = 600
+
+    def __init__(self, model):
+        super(SelectBoxCache, self).__init__(model.__name__)
+        self.model = model
+        self.index_key = self._make_key((model.__name__, 'idx'))
+        self.doc_key = self._make_key((model.__name__, 'doc'))
+        self.build_key = self._make_key((model.__name__, 'build'))
+
+    def get_values(self, obj):
+        """
+        Lower cased, non-empty ``Meta.search_fields`` values of the object.
+        """
+        values = []
+        for field in self.model.Meta.search_fields or []:
+            value = getattr(obj, field, None)
+            if value is not None and not isinstance(value, Model):
+                value = six.text_type(value).lower()
+                if value:
+                    values.append(value)
+        return values
 
-    def __init__(self, model_name, query=''):
-        super(SelectBoxCache, self).__init__(model_name, query)
+    @classmethod
+    def _entries(cls, values, key):
+        return set(('%s\x00%s' % (value[i:i + cls.MAX_ENTRY_LENGTH], key)).encode('utf-8')
+                   for value in values for i in range(len(value)))
+
+    @staticmethod
+    def _decode(value):
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    def exists(self):
+        """
+        Whether the index is built and ready to be searched.
+        """
+        return bool(cache.exists(self.key))
 
+    def claim_build(self):
+        """
+        Claims building of the index, so it's built by only one job at a time.
 
-@receiver(crud_post_save)
+        Returns:
+            True if index isn't already being built.
+        """
+        return bool(cache.set(self.build_key, 1, ex=self.BUILD_TIMEOUT, nx=True))
+
+    def _add(self, pipe, obj):
+        old_values = cache.hget(self.doc_key, obj.key)
+        if old_values is not None:
+            pipe.zrem(self.index_key, *self._entries(
+                json_interface.loads(self._decode(old_values)), obj.key))
+        values = self.get_values(obj)
+        if values:
+            pipe.zadd(self.index_key, dict((entry, 0) for entry in self._entries(values, obj.key)))
+        pipe.hset(self.doc_key, obj.key, json_interface.dumps(values))
+
+    def build(self, batch_size=500):
+        """
+        Clears the index and indexes all objects of the model.
+
+        Objects saved while the index is being built are indexed too.
+
+        Returns:
+            Number of indexed objects.
+        """
+        cache.set(self.build_key, 1, ex=self.BUILD_TIMEOUT)
+        cache.delete(self.key, self.index_key, self.doc_key)
+        num = 0
+        pipe = cache.pipeline()
+        for obj in self.model.objects.all():
+            self._add(pipe, obj)
+            num += 1
+            if not num % batch_size:
+                pipe.execute()
+        pipe.set(self.key, num)
+        for key in (self.key, self.index_key, self.doc_key):
+            pipe.expire(key, settings.DEFAULT_CACHE_EXPIRE_TIME)
+        pipe.delete(self.build_key)
+        pipe.execute()
+        return num
+
+    def update(self, obj):
+        """
+        Adds the object to index or updates it's entry.
+        Does nothing if the index is not built or being built.
+        """
+        if cache.exists(self.key, self.build_key):
+            pipe = cache.pipeline()
+            self._add(pipe, obj)
+            pipe.execute()
+
+    def remove(self, key):
+        """
+        Removes the object from index.
+        """
+        old_values = cache.hget(self.doc_key, key)
+        if old_values is not None:
+            pipe = cache.pipeline()
+            pipe.zrem(self.index_key, *self._entries(
+                json_interface.loads(self._decode(old_values)), key))
+            pipe.hdel(self.doc_key, key)
+            pipe.execute()
+
+    def search(self, query, limit):
+        """
+        Finds objects which have a search field value containing the query.
+
+        Args:
+            query (str): Search text.
+            limit (int): Max. number of results.
+
+        Returns:
+            Up to ``limit`` object keys, ordered by matched text.
+        """
+        prefix = six.text_type(query).lower()[:self.MAX_ENTRY_LENGTH].encode('utf-8')
+        keys = []
+        start = 0
+        while len(keys) < limit:
+            # an object can match more than once with different suffixes
+            entries = cache.zrangebylex(self.index_key, b'[' + prefix, b'[' + prefix + b'\xff',
+                                        start=start, num=limit * 2)
+            for entry in entries:
+                key = self._decode(entry.rsplit(b'\x00', 1)[1])
+                if key not in keys:
+                    keys.append(key)
+            if len(entries) < limit * 2:
+                break
+            start += len(entries)
+        return keys[:limit]
+
+
+class ListFilterCache(Cache):
+    """
+    Cache object for list filter values of a model field.
+
+    Distinct values (with their counts) are cached for ordinary
+    fields, min and max values are cached for date fields.
+    """
+    PREFIX = 'LSTFLT'
+
+    def __init__(self, model_class, field_name):
+        self.model_class = model_class
+        self.field_name = field_name
+        super(ListFilterCache, self).__init__(model_class.__name__, field_name)
+
+    def get_data_to_cache(self):
+        queryset = self.model_class.objects.all()
+        if isinstance(self.model_class._fields[self.field_name], (fields.Date, fields.DateTime)):
+            result = queryset.adapter.riak_http_search_query(
+                queryset.adapter.index_name,
+                'stats=true&stats.field=%s&rows=0' % self.field_name)
+            stats = result['stats']['stats_fields'][self.field_name] or {}
+            return {'min': stats.get('min'), 'max': stats.get('max')}
+        return queryset.distinct_values_of(self.field_name)
+
+    def get_or_set(self, lifetime=None):
+        data = self.get()
+        return data if data is not None else self.set(self.get_data_to_cache(), lifetime)
+
+    def get_date_range(self):
+        """
+        Returns:
+            (min, max) tuple of dates in list filter (DD.MM.YYYY) format.
+        """
+        data = self.get_or_set()
+        return tuple('{d}.{m}.{y}'.format(y=v[:4], m=v[5:7], d=v[8:10]) if v else None
+                     for v in (data['min'], data['max']))
+
+
+@receiver([crud_post_save, crud_post_delete])
 def clear_model_list_cache(sender, *args, **kwargs):
     """
-    Invalidate permission cache on crud updates on Role and AbstractRole models
+    Update select box index and invalidate list filter caches of the model on crud updates
     """
-    SelectBoxCache.flush(sender.model_class.__name__)
+    model_class = sender.model_class
+    if 'object' in kwargs:
+        SelectBoxCache(model_class).update(kwargs['object'])
+    else:
+        SelectBoxCache(model_class).remove(sender.object.key)
+    for field_name in getattr(model_class.Meta, 'list_filters', None) or []:
+        ListFilterCache(model_class, field_name).delete()
+
+
+def get_list_field_value(obj, field_name):
+    """
+    Text representation of a list field of given object.
+
+    Args:
+        obj (:class:`Model<pyoko:pyoko.model.Model>`): Model instance.
+        field_name (str): Field, linked model, method name or a dotted path.
+
+    Returns:
+        Text of the field value.
+    """
+    field = getattr(obj, field_name, None)
+    if isinstance(field, Model):
+        return six.text_type(field)
+    elif callable(field):
+        return field()
+    elif '.' in field_name:
+        return six.text_type(attrgetter(field_name)(obj))
+    else:
+        return six.text_type(obj.get_humane_value(field_name))
+
+
+class _FieldValues(object):
+    """
+    Minimal value holder for loading db values with
+    pyoko field descriptors without creating a model instance.
+    """
+
+    def __init__(self):
+        self._field_values = {}
+
+    def _set_get_choice_display_method(self, *args):
+        pass
+
+
+class ListRenderer(object):
+    """
+    Renders object listing rows of a :class:`CrudView` from db data.
+
+    Model instances are only created when they are needed by a list field
+    (model methods, fields of nodes) or by custom ``@obj_filter`` methods of
+    the view. Linked models shown in the list are fetched with a single
+    query per link instead of a lazy fetch per row, and permitted actions
+    are calculated once per request.
+
+    Args:
+        view (:class:`CrudView`): View instance.
+        list_fields (list): Field names, linked model names, method names
+            or dotted paths of linked model attributes.
+    """
+
+    def __init__(self, view, list_fields=None):
+        self.view = view
+        self.model = view.object
+        self.list_fields = list_fields or []
+        self.links = dict((lnk['field'], lnk) for lnk in self.model.get_links(is_set=False))
+        self.columns = [self._get_column(f) for f in self.list_fields]
+        base_filter = CrudView.__dict__['_get_list_obj']
+        self.filters = [f for f in view.FILTER_METHODS if f is not base_filter]
+        self.needs_objects = bool(self.filters or not self.list_fields or
+                                  any(c[0] == 'object' for c in self.columns))
+        self._empty_links = {}
+
+    def _get_column(self, name):
+        """
+        Returns:
+            (kind, field name, rest of dotted path) tuple.
+        """
+        if name in self.links:
+            return 'link', name, None
+        if name in self.model._fields and not callable(getattr(self.model, name, None)):
+            return 'field', name, None
+        link, _, path = name.partition('.')
+        if path and link in self.links:
+            return 'link', link, path
+        return 'object', name, None
+
+    def _fetch_linked(self, rows):
+        """
+        Fetches linked models of listed rows.
+
+        Returns:
+            {field_name: {key: linked model instance}} dict.
+        """
+        linked = {}
+        for name in set(c[1] for c in self.columns if c[0] == 'link'):
+            id_field = un_camel_id(name)
+            keys = list(set(data.get(id_field) for data, _ in rows) - {None, ''})
+            linked[name] = {}
+            if keys:
+                query = self.links[name]['mdl'](self.view.current).objects.filter(key__in=keys)
+                for obj in query.set_params(rows=len(keys)):
+                    linked[name][obj.key] = obj
+        return linked
+
+    def _get_linked(self, name, data, linked):
+        obj = linked[name].get(data.get(un_camel_id(name)))
+        if obj is None:
+            # empty or missing relation
+            if name not in self._empty_links:
+                self._empty_links[name] = self.links[name]['mdl'](self.view.current)
+            obj = self._empty_links[name]
+        return obj
+
+    def _make_object(self, data, key, linked):
+        obj = self.model.__class__(self.view.current)
+        obj.setattr('key', key)
+        obj.set_data(data, from_db=True)
+        # replace lazy loaders with already fetched instances
+        for name, objects in linked.items():
+            if data.get(un_camel_id(name)) in objects:
+                obj.setattr(name, objects[data[un_camel_id(name)]])
+        return obj
+
+    def _get_field_value(self, name, data):
+        field = self.model._fields[name]
+        if name in data:
+            value = data[name]
+        else:
+            value = field.default() if callable(field.default) else field.default
+        if field.choices is not None:
+            return six.text_type(self.model._choices_manager(field.choices, value))
+        if value is not None:
+            holder = _FieldValues()
+            field._load_data(holder, value)
+            value = holder._field_values.get(field.name)
+        if isinstance(value, datetime.datetime):
+            value = value.strftime(settings.DATETIME_DEFAULT_FORMAT or
+                                   model_fields.DATE_TIME_FORMAT)
+        elif isinstance(value, datetime.date):
+            value = value.strftime(settings.DATE_DEFAULT_FORMAT or model_fields.DATE_FORMAT)
+        return six.text_type(value)
+
+    def _get_value(self, column, data, obj, linked):
+        kind, name, path = column
+        if kind == 'field':
+            return self._get_field_value(name, data)
+        elif kind == 'link':
+            linked_obj = self._get_linked(name, data, linked)
+            return six.text_type(attrgetter(path)(linked_obj) if path else linked_obj)
+        return get_list_field_value(obj, name)
+
+    def render(self, query, **kwargs):
+        """
+        Creates object listing rows.
+
+        Args:
+            query (:class:`QuerySet<pyoko:pyoko.db.queryset.QuerySet>`):
+                Object listing queryset.
+            **kwargs: Passed to ``@obj_filter`` methods.
+
+        Returns:
+            List of row dicts. See :meth:`CrudView._parse_object_actions`.
+        """
+        rows = [(data, key) for data, key in query.data() if data and not data.get('deleted')]
+        linked = self._fetch_linked(rows)
+        actions = self.view.get_object_actions()
+        result = []
+        for data, key in rows:
+            obj = self._make_object(data, key, linked) if self.needs_objects else None
+            row = {'key': key, 'fields': [], 'actions': list(actions)}
+            if self.list_fields:
+                row['fields'] = [self._get_value(c, data, obj, linked) for c in self.columns]
+            else:
+                row['fields'] = [six.text_type(obj)]
+            for method in self.filters:
+                method(self.view, obj, row, **kwargs)
+            if 'exclude' not in row:
+                row['actions'] = sorted(row['actions'], key=lambda x: x.get('name', ''))
+                result.append(row)
+        return result
 
 
 @six.add_metaclass(CrudMeta)
@@ -273,6 +637,7 @@ class CrudView(BaseView):
         self.FILTER_METHODS = []
         self.QUERY_METHODS = []
         self.VIEW_METHODS = {}
+        self._object_actions = None
         super(CrudView, self).__init__(current)
 
         self.cmd = getattr(self, 'cmd', None) or self.Meta.init_view
@@ -515,20 +880,37 @@ class CrudView(BaseView):
 
         if fields:
             for f in fields:
-                field = getattr(obj, f, None)
-                field_str = ''
-                if isinstance(field, Model):
-                    field_str = six.text_type(field)
-                elif callable(field):
-                    field_str = field()
-                elif '.' in f:
-                    field_str = six.text_type(attrgetter(f)(obj))
-                else:
-                    field_str = six.text_type(obj.get_humane_value(f))
-                result['fields'].append(field_str)
+                result['fields'].append(get_list_field_value(obj, f))
         else:
             result['fields'] = [six.text_type(obj)]
 
+    def get_object_actions(self):
+        """
+        Actions that will be shown on each row of object listing.
+
+        Permissions of actions are checked once per view instance
+        (that is, once per request), not for every listed object.
+
+        Returns:
+            List of action dicts.
+        """
+        if self._object_actions is None:
+            actions = []
+            # If override actions for the model is defined, then only show those actions
+            override_actions = getattr(self.object.Meta, 'crud_override_actions', None)
+            if override_actions is not None:
+                actions.extend(override_actions)
+            elif self.Meta.object_actions:
+                # If override actions is not defined, show the actions defined on the view
+                model_name = self.object.__class__.__name__
+                for perm, action in self.Meta.object_actions.items():
+                    if self.current.has_permission("%s.%s" % (model_name, perm)):
+                        actions.append(action)
+            # If there are extra actions for the model, add them
+            actions.extend(getattr(self.object.Meta, 'crud_extra_actions', []))
+            self._object_actions = actions
+        return self._object_actions
+
     def _parse_object_actions(self, obj, **kwargs):
         """
         Applies registered (with ``@obj_filter`` decorator)
@@ -576,22 +958,7 @@ class CrudView(BaseView):
 
         """
 
-        actions = []
-        # If override actions for the model is defined, then only show those actions
-        override_actions = getattr(self.object.Meta, 'crud_override_actions', None)
-        if override_actions is not None:
-            actions = override_actions
-        else:
-            # If override actions is not defined, show the actions defined on the view
-            if self.Meta.object_actions:
-                for perm, action in self.Meta.object_actions.items():
-                    permission = "%s.%s" % (self.object.__class__.__name__, perm)
-                    if self.current.has_permission(permission):
-                        actions.append(action)
-        # If there are extra actions for the model, add them
-        extra_actions = getattr(self.object.Meta, 'crud_extra_actions', [])
-        actions.extend(extra_actions)
-        result = {'key': obj.key, 'fields': [], 'actions': actions}.copy()
+        result = {'key': obj.key, 'fields': [], 'actions': list(self.get_object_actions())}
         for method in self.FILTER_METHODS:
             method(self, obj, result, **kwargs)
         return result
@@ -665,6 +1032,7 @@ class CrudView(BaseView):
             if isinstance(field, (fields.Date, fields.DateTime)):
                 f['type'] = 'date'
                 f['values'] = chosen_filters or chosen_filters.extend((None, None))
+                f['min'], f['max'] = ListFilterCache(model_class, field_name).get_date_range()
 
             elif isinstance(field, fields.Boolean):
                 f['values'] = [{'name': k, "value": k,
@@ -679,8 +1047,8 @@ class CrudView(BaseView):
                                self.object.get_choices_for(field_name)]
 
             else:
-                f['values'] = [{'name': k, 'value': k} for k, v in
-                               model_class.objects.distinct_values_of(field_name).items()]
+                f['values'] = [{'name': k, 'value': k} for k in
+                               ListFilterCache(model_class, field_name).get_or_set()]
 
             flt.append(f)
         self.output['list_filters'] = flt
@@ -706,11 +1074,8 @@ class CrudView(BaseView):
         self.output['objects'] = []
         self.make_list_header(**kwargs)
         self.display_list_filters()
-        for obj in query:
-            list_obj = self._parse_object_actions(obj, **kwargs)
-            list_obj['actions'] = sorted(list_obj['actions'], key=lambda x: x.get('name', ''))
-            if not ('exclude' in list_obj or obj.deleted):
-                self.output['objects'].append(list_obj)
+        renderer = ListRenderer(self, kwargs.get('list_fields', self.object.Meta.list_fields))
+        self.output['objects'].extend(renderer.render(query, **kwargs))
         title = getattr(self.object.Meta, 'verbose_name_plural', self.object.__class__.__name__)
         self.form_out(custom_form or self.ListForm(current=self.current, title=title))
 
@@ -743,25 +1108,42 @@ class CrudView(BaseView):
         If queryset doesn't return any items, it returns back
         ``[0]`` value.
 
+        Searched items are limited to
+        :attr:`~zengine.settings.MAX_NUM_SELECT_LIST_RESULTS`.
+
         Note:
-            Output of this method will be cached with
-            :class:`SelectBoxCache` object.
+            Searches are made on :class:`SelectBoxCache` index of the model
+            when it's built, unless model defines a ``row_level_access`` filter.
+            Otherwise building of the index is requested from job workers
+            and search is made on db.
 
         """
+        search_str = self.input.get('query') if 'query' in self.input else None
+        limit = settings.MAX_NUM_SELECT_LIST_RESULTS
+        max_items = settings.MAX_NUM_DROPDOWN_LINKED_MODELS
         query = self.object.objects.all()
-        query = self._apply_list_search(query)
-        num_of_rec = query.count()
-        searched = 'query' in self.input
-        if not searched and num_of_rec > settings.MAX_NUM_DROPDOWN_LINKED_MODELS:
+        if search_str and self.object.Meta.search_fields and self.Meta.allow_search:
+            index = SelectBoxCache(self.model_class)
+            if self.model_class.row_level_access is not Model.row_level_access:
+                # index is shared by all users, can't be used for models with row level filters
+                query = self._apply_list_search(query)
+            elif index.exists():
+                keys = index.search(search_str, limit)
+                query = query.filter(key__in=keys) if keys else None
+            else:
+                if index.claim_build():
+                    JobPublisher.publish('_zops_build_select_box_index',
+                                         model=self.model_class.__name__)
+                query = self._apply_list_search(query)
+        rows = limit if search_str is not None else max_items + 1
+        items = [{'key': obj.key, 'value': six.text_type(obj)}
+                 for obj in query.set_params(rows=rows)] if query is not None else []
+        if search_str is None and len(items) > max_items:
             self.output['objects'] = [-1]
-        elif not num_of_rec:
+        elif not items:
             self.output['objects'] = [0]
         else:
-            search_str = self.input.get('query', '')
-            cache = SelectBoxCache(self.model_class.__name__, search_str)
-            self.output['objects'] = cache.get() or cache.set(
-                [{'key': obj.key, 'value': six.text_type(obj)}
-                 for obj in query])
+            self.output['objects'] = sorted(items, key=lambda item: item['value'].lower())
 
     @view_method
     def object_name(self):
@@ -15,7 +15,6 @@ from collections import defaultdict
 from pyoko.lib.utils import get_object_from_path
 from pyoko.lib.utils import lazy_property
 from pyoko.model import model_registry
-from zengine.auth.permissions import _get_workflows
 from zengine.views.base import SysView
 from zengine.config import settings
 
@@ -3,9 +3,11 @@ from zengine import forms
 from zengine.forms import fields
 from zengine.lib.cache import Cache
 from zengine.config import settings
+from zengine.models.auth import PermissionCache
 from pyoko import ListNode
 from pyoko.lib.utils import get_object_from_path
 from collections import defaultdict
+from uuid import uuid4
 
 PermissionModel = get_object_from_path(settings.PERMISSION_MODEL)
 RoleModel = get_object_from_path(settings.ROLE_MODEL)
@@ -24,85 +26,134 @@ class PermissionForm(forms.JsonForm):
     save_edit = fields.Button("Save", cmd="finish")
 
 
-class PermissionTreeBuilder(object):
-    """A class to help permission trees to be built out of permission objects.
+class PermissionTree(object):
+    """Flattened permission tree.
 
-    The permission trees built by this class will be in the form of
+    Permission codes are split into steps, skipping empty steps such that
+    ``workflow..task`` is placed under ``workflow``. Missing parent steps
+    are added automatically, with their paths as their ids and names.
 
-    {
-        'id': 'workflow',
-        'name': 'Workflow Name',
-        'checked': True,
-        'children': {
-            'task': {
-                'id': 'workflow.task',
-                'name' 'Task Name',
-                'checked': False,
-                'children': {}
-            }
+    Nodes are kept in pre-order in parallel lists, so each node can be
+    addressed with it's index and the tree can be cached as a single
+    compact JSON document:
+
+    .. code-block:: python
+
+        {
+            'version': 'f1d2...',
+            'codes': ['workflow', 'workflow..task'],
+            'names': ['Workflow Name', 'Task Name'],
+            'parents': [-1, 0],
+            'keys': ['workflow_permission_key', 'task_permission_key'],
         }
-    }
-
-    Note that these permission trees are NOT sent to the UI in this form.
-    An additional formatting step is performed before sending these trees,
-    see `Permissions.edit_permissions` to see the actual trees that are
-    sent to the UI.
-
-    To build a permission tree, create an instance of this class, and call
-    the `insert` method to insert all permissions into the permission tree.
-    The order of the insertions is not important.
-    Missing permissions will be automatically created, for example only
-    inserting `workflow.task` will create a permission tree similar to the
-    example above, minus the human readable task name. Inserting the
-    `workflow` later will allow you to get the human readable name for
-    that permission as well.
+
+    Keys are None for the parent steps that were added automatically.
+
+    Permissions of a role are represented as a set of node indexes,
+    see :meth:`get_checked` and :meth:`get_checked_keys`.
     """
-    def __init__(self):
-        self._data = defaultdict(PermissionTreeBuilder)
-        self._permission = None
-
-    def insert(self, permission):
-        # Insert the permission, skipping empty steps, such that inserting workflow..task
-        # will make the task to be inserted under the workflow.
-        self._insert(permission, iter(filter(lambda s: s != '', permission.code.split('.'))))
-
-    def _insert(self, permission, path):
-        try:
-            step = path.next()
-            self._data[step]._insert(permission, path)
-        except StopIteration:  # Last step
-            self._permission = permission
-
-    def serialize(self, path=''):
-
-        def do_serialize(newstep, subtree):
-            newpath = '{}.{}'.format(path, newstep) if path else newstep
-            return newstep, subtree._serialize(newpath)
-
-        return dict(do_serialize(p, pt) for p, pt in self._data.items())
-
-    def _serialize(self, path):
-        if self._permission:
-            code = self._permission.code or path
-            name = self._permission.name or code
-        else:
-            code = name = path
-        children = self.serialize(path)
-        return {
-            'id': code,
-            'name': name,
-            'children': children,
-            'checked': False,
-        }
+
+    def __init__(self, codes, names, parents, keys=None, version=None):
+        self.codes = codes
+        self.names = names
+        self.parents = parents
+        self.keys = keys or [None] * len(codes)
+        self.version = version or uuid4().hex
+        self.index = {}
+        self.key_index = {}
+        self.children = defaultdict(list)
+        for i, code in enumerate(codes):
+            self.index[self.path_of(code)] = i
+            if self.keys[i]:
+                self.key_index[self.keys[i]] = i
+            self.children[parents[i]].append(i)
+
+    @staticmethod
+    def path_of(code):
+        """Normalized path of a permission code, e.g. ``workflow.task`` for ``workflow..task``."""
+        return '.'.join(step for step in code.split('.') if step != '')
+
+    @classmethod
+    def build(cls, permissions):
+        """Builds the tree from permission objects. The order of permissions is not important."""
+        nodes = {}
+        for permission in permissions:
+            steps = tuple(step for step in (permission.code or '').split('.') if step != '')
+            if not steps:
+                continue
+            for i in range(1, len(steps)):
+                nodes.setdefault(steps[:i], None)
+            nodes[steps] = permission
+        codes, names, parents, keys, position = [], [], [], [], {}
+        # sorted tuples of steps are in pre-order, parents come before their children
+        for i, steps in enumerate(sorted(nodes)):
+            position[steps] = i
+            path = '.'.join(steps)
+            permission = nodes[steps]
+            code = permission and permission.code or path
+            codes.append(code)
+            names.append(permission and permission.name or code)
+            parents.append(position[steps[:-1]] if len(steps) > 1 else -1)
+            keys.append(permission and permission.key or None)
+        return cls(codes, names, parents, keys)
+
+    def serialize(self):
+        return {'version': self.version, 'codes': self.codes, 'names': self.names,
+                'parents': self.parents, 'keys': self.keys}
+
+    def get_checked(self, codes):
+        """Returns indexes of the given permission codes as a set."""
+        return set(self.index[path] for path in map(self.path_of, codes) if path in self.index)
+
+    def get_checked_keys(self, keys):
+        """Returns indexes of the given permission keys as a set."""
+        return set(self.key_index[key] for key in keys if key in self.key_index)
+
+    def get_node(self, code):
+        """Returns index of the node with given id, or None."""
+        return self.index.get(self.path_of(code))
+
+    def format(self, checked, parent=-1, depth=None):
+        """Formats the children of a node to be sent to the UI.
+
+        Args:
+            checked (set): Node indexes of the permissions of the role.
+            parent (int): Index of the parent node, -1 for whole tree.
+            depth (int): Number of levels to include. Nodes at the last level are sent
+                with an empty children list and a ``has_children`` flag,
+                so their subtrees can be loaded later. All levels if not given.
+
+        Returns:
+            List of permission tree nodes.
+        """
+        nodes = []
+        for i in self.children[parent]:
+            node = {'id': self.codes[i], 'name': self.names[i], 'checked': i in checked}
+            if depth is None or depth > 1:
+                node['children'] = self.format(checked, i, depth and depth - 1)
+            else:
+                node['children'] = []
+                node['has_children'] = bool(self.children[i])
+            nodes.append(node)
+        return nodes
 
 
 class PermissionTreeCache(Cache):
+    """Cache of the flattened permission tree.
+
+    Version of the tree is stored separately, so workers can use their
+    in-memory copy of the tree without reading the whole tree from cache.
+    """
     PREFIX = 'PERMTREE'
-    # No key is set, we'll be only storing one object
+
+    def __init__(self, name='tree'):
+        super(PermissionTreeCache, self).__init__(name)
 
 
 class Permissions(BaseView):
     """View for editing permissions of roles."""
+    # in-memory copy of the last used permission tree
+    _tree = None
 
     def __init__(self, current=None):
         super(Permissions, self).__init__(current)
@@ -116,8 +167,8 @@ class Permissions(BaseView):
         .. code-block:: python
             {
                 "type": "tree-toggle",
-                "action": "set_permission",
-                "tree": [
+                "action": "apply_change",
+                "trees": [
                     {
                         "checked": true,
                         "name": "Workflow 1 Name",
@@ -142,27 +193,8 @@ class Permissions(BaseView):
                         "checked": true,
                         "name": "Workflow 2 Name",
                         "id": "workflow2",
-                        "children": [
-                            {
-                                "checked": true,
-                                "name": "Workflow 2 Lane 1 Name",
-                                "id": "workflow2.lane1",
-                                "children": [
-                                    {
-                                        "checked": true,
-                                        "name": "Workflow 2 Task 1 Name",
-                                        "id": "workflow2.lane1.task1",
-                                        "children": []
-                                    },
-                                    {
-                                        "checked": false,
-                                        "name": "Workflow 2 Task 2 Name",
-                                        "id": "workflow2.lane1.task2",
-                                        "children": []
-                                    }
-                                ]
-                            }
-                        ]
+                        "children": [],
+                        "has_children": true
                     }
                 ]
             }
@@ -174,76 +206,67 @@ class Permissions(BaseView):
         "id" field is used to make requests to the backend.
         "checked" field shows whether the role has the permission or not.
         "children" field is the sub-permissions of the permission.
+        "has_children" field is only set for nodes at the last level of
+        :attr:`~zengine.settings.PERMISSION_TREE_DEPTH`, their children can
+        be loaded with ``load_subtree`` command, giving node's id as ``subtree``.
+        In this case "trees" field contains the children of the requested node and
+        "parent" field is set to it's id.
         """
         # Get the role that was selected in the CRUD view
-        key = self.current.input['object_id']
-        self.current.task_data['role_id'] = key
-        role = RoleModel.objects.get(key=key)
-        # Get the cached permission tree, or build a new one if there is none cached
-        # TODO: Add an extra view in case there was no cache, as in 'please wait calculating permissions'
-        permission_tree = self._permission_trees(PermissionModel.objects)
-        # Apply the selected role to the permission tree, setting the 'checked' field
-        # of the permission the role has
-        role_tree = self._apply_role_tree(permission_tree, role)
-        # Apply final formatting, and output the tree to the UI
-        self.output['objects'] = [
-            {
-                'type': 'tree-toggle',
-                'action': 'apply_change',
-                'trees': self._format_tree_output(role_tree),
-            },
-        ]
+        if 'object_id' in self.current.input:
+            self.current.task_data['role_id'] = self.current.input['object_id']
+        role = RoleModel.objects.get(key=self.current.task_data['role_id'])
+        tree = self.get_permission_tree()
+        checked = tree.get_checked_keys(self.get_permission_keys(role))
+        subtree = self.input.get('subtree')
+        parent = tree.get_node(subtree) if subtree else None
+        output = {
+            'type': 'tree-toggle',
+            'action': 'apply_change',
+            'trees': tree.format(checked, -1 if parent is None else parent,
+                                 settings.PERMISSION_TREE_DEPTH),
+        }
+        if parent is not None:
+            output['parent'] = subtree
+        self.output['objects'] = [output]
         self.form_out(PermissionForm())
 
-    @staticmethod
-    def _permission_trees(permissions):
+    @classmethod
+    def get_permission_tree(cls):
         """Get the cached permission tree, or build a new one if necessary."""
-        treecache = PermissionTreeCache()
-        cached = treecache.get()
-        if not cached:
-            tree = PermissionTreeBuilder()
-            for permission in permissions:
-                tree.insert(permission)
-            result = tree.serialize()
-            treecache.set(result)
-            return result
-        return cached
-
-    def _apply_role_tree(self, perm_tree, role):
-        """In permission tree, sets `'checked': True` for the permissions that the role has."""
-        role_permissions = role.get_permissions()
-        for perm in role_permissions:
-            self._traverse_tree(perm_tree, perm)['checked'] = True
-        return perm_tree
+        version_cache = PermissionTreeCache('version')
+        version = version_cache.get()
+        if cls._tree is None or cls._tree.version != version:
+            cached = PermissionTreeCache().get() if version else None
+            # trees cached before permission keys were stored are rebuilt
+            if cached and cached['version'] == version and 'keys' in cached:
+                cls._tree = PermissionTree(**cached)
+            else:
+                # TODO: Add an extra view in case there was no cache,
+                # as in 'please wait calculating permissions'
+                cls._tree = PermissionTree.build(PermissionModel.objects.all())
+                PermissionTreeCache().set(cls._tree.serialize())
+                version_cache.set(cls._tree.version)
+        return cls._tree
 
     @staticmethod
-    def _traverse_tree(tree, path):
-        """Traverses the permission tree, returning the permission at given permission path."""
-        path_steps = (step for step in path.split('.') if step != '')
-        # Special handling for first step, because the first step isn't under 'objects'
-        first_step = path_steps.next()
-        subtree = tree[first_step]
-
-        for step in path_steps:
-            subtree = subtree['children'][step]
-        return subtree
-
-    def _format_tree_output(self, tree):
-        """Format the tree to be sent to the UI.
-
-        Internally, 'children' of each permission is a dictionary to allow
-        easier searches, but we will be sending them to the UI as a list,
-        in order to make it possible to control the order in which the children
-        appear.
-        """
-        return [self._format_subtree(subtree) for subtree in tree.values()]
+    def get_permission_keys(role):
+        """Keys of the permissions of the role.
 
-    def _format_subtree(self, subtree):
-        """Recursively format all subtrees."""
-        subtree['children'] = list(subtree['children'].values())
-        for child in subtree['children']:
-            self._format_subtree(child)
-        return subtree
+        Keys are read from the data of the ``Permissions`` list node,
+        without fetching the linked permission objects.
+
+        Args:
+            role: Role object.
+
+        Returns:
+            set: Permission keys.
+        """
+        permissions = role.Permissions
+        keys = set(data['permission_id'] for data in permissions._data or [])
+        # items that were already iterated or added are kept in the node stack
+        keys.update(item.permission.key for item in permissions.node_stack)
+        return keys
 
     def apply_change(self):
         """Applies changes to the permissions of the role.
@@ -253,24 +276,36 @@ class Permissions(BaseView):
 
         .. code-block:: python
             {
-                'change':
+                'change': [
                     {
                         'id': 'workflow2.lane1.task1',
                         'checked': false
                     },
+                ]
             }
 
         The 'id' field of the change is the id of the tree element
         that was sent to the UI (see `Permissions.edit_permissions`).
         'checked' field is the new state of the element.
+
+        All changes are applied with a single permission query and a single save,
+        :class:`~zengine.models.auth.PermissionCache` is flushed afterwards.
         """
-        changes = self.input['change']
-        key = self.current.task_data['role_id']
-        role = RoleModel.objects.get(key=key)
-        for change in changes:
-            permission = PermissionModel.objects.get(code=change['id'])
-            if change['checked'] is True:
-                role.add_permission(permission)
-            else:
-                role.remove_permission(permission)
-        role.save()
+        changes = dict((change['id'], change['checked'] is True)
+                       for change in self.input.get('change') or [])
+        if not changes:
+            return
+        role = RoleModel.objects.get(key=self.current.task_data['role_id'])
+        role_permissions = self.get_permission_keys(role)
+        changed = False
+        for permission in PermissionModel.objects.filter(code__in=list(changes)).set_params(
+                rows=len(changes)):
+            if changes[permission.code] and permission.key not in role_permissions:
+                role.Permissions(permission=permission)
+                changed = True
+            elif not changes[permission.code] and permission.key in role_permissions:
+                del role.Permissions[permission.key]
+                changed = True
+        if changed:
+            role.save()
+            PermissionCache.flush()
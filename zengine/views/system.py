@@ -6,10 +6,12 @@
 #
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
+from collections import Counter
+
 from pyoko.fields import DATE_FORMAT
 from datetime import datetime
 from zengine.lib.decorators import view
-from zengine.models import TaskInvitation, BPMNWorkflow
+from zengine.models import TaskInvitation, BPMNWorkflow, TaskSearchIndex
 from zengine.lib.utils import gettext_lazy as __
 from zengine.lib.translation import format_date
 
@@ -103,6 +105,18 @@ def get_task_actions(current):
     current.output['actions'] = actions
 
 
+def _get_task_facets(invitations):
+    """
+    Number of listed tasks per workflow type and per start month.
+    """
+    wf_types = Counter(inv.wf_name for inv in invitations)
+    months = Counter(inv.start_date.strftime('%Y-%m') for inv in invitations if inv.start_date)
+    return {
+        'wf_type': [{'value': k, 'count': v} for k, v in sorted(wf_types.items())],
+        'start_month': [{'value': k, 'count': v} for k, v in sorted(months.items())],
+    }
+
+
 @view()
 def get_tasks(current):
     """
@@ -117,7 +131,8 @@ def get_tasks(current):
                 'state': string, # one of these:
                                  # "active", "future", "finished", "expired"
                 'inverted': boolean, # search on other people's tasks
-                'query': string, # optional. for searching on user's tasks
+                'query': string, # optional. for searching on user's tasks,
+                                 # matches tasks having words starting with each word of query
                 'wf_type': string, # optional. only show tasks of selected wf_type
                 'start_date': datetime, # optional. only show tasks starts after this date
                 'finish_date': datetime, # optional. only show tasks should end before this date
@@ -137,6 +152,10 @@ def get_tasks(current):
                      'finish_date': string,  # end date
 
                      },],
+                'facets': {
+                    'wf_type': [{'value': string, 'count': int},],
+                    'start_month': [{'value': string, 'count': int},],  # "YYYY-MM"
+                    },
                 'active_task_count': int,
                 'future_task_count': int,
                 'finished_task_count': int,
@@ -153,28 +172,48 @@ def get_tasks(current):
         'expired': 90
     }
     state = STATE_DICT[current.input['state']]
+    search_scope = {'states': state if isinstance(state, list) else [state]}
     if isinstance(state, list):
         queryset = TaskInvitation.objects.filter(progress__in=state)
     else:
         queryset = TaskInvitation.objects.filter(progress=state)
 
+    start_date = finish_date = None
+    if 'start_date' in current.input:
+        start_date = datetime.strptime(current.input['start_date'], "%d.%m.%Y")
+        queryset = queryset.filter(start_date__gte=start_date)
+    if 'finish_date' in current.input:
+        finish_date = datetime.strptime(current.input['finish_date'], "%d.%m.%Y")
+        queryset = queryset.filter(finish_date__lte=finish_date)
+    if 'wf_type' in current.input:
+        queryset = queryset.filter(wf_name=current.input['wf_type'])
+
     if 'inverted' in current.input:
         # show other user's tasks
         allowed_workflows = [bpmn_wf.name for bpmn_wf in BPMNWorkflow.objects.all()
                              if current.has_permission(bpmn_wf.name)]
         queryset = queryset.exclude(role_id=current.role_id).filter(wf_name__in=allowed_workflows)
+        search_scope.update(exclude_role_id=current.role_id, wf_names=allowed_workflows)
     else:
         # show current user's tasks
         queryset = queryset.filter(role_id=current.role_id)
-
-    if 'query' in current.input:
-        queryset = queryset.filter(search_data__contains=current.input['query'].lower())
-    if 'wf_type' in current.input:
-        queryset = queryset.filter(wf_name=current.input['wf_type'])
-    if 'start_date' in current.input:
-        queryset = queryset.filter(start_date__gte=datetime.strptime(current.input['start_date'], "%d.%m.%Y"))
-    if 'finish_date' in current.input:
-        queryset = queryset.filter(finish_date__lte=datetime.strptime(current.input['finish_date'], "%d.%m.%Y"))
+        search_scope['role_id'] = current.role_id
+
+    if current.input.get('query'):
+        if 'wf_type' in current.input:
+            search_scope['wf_names'] = [wf_name for wf_name in
+                                        search_scope.get('wf_names', [current.input['wf_type']])
+                                        if wf_name == current.input['wf_type']]
+        task_keys = TaskSearchIndex.search(current.input['query'],
+                                           start_date=start_date,
+                                           finish_date=finish_date,
+                                           **search_scope)
+        if task_keys is None:
+            # too many matches to be queried by keys
+            queryset = queryset.filter(search_data__contains=current.input['query'].lower())
+        else:
+            queryset = queryset.filter(key__in=task_keys) if task_keys else []
+    invitations = list(queryset)
     current.output['task_list'] = [
         {
             'token': inv.instance.key,
@@ -186,8 +225,9 @@ def get_tasks(current):
             'finish_date': format_date(inv.finish_date),
             'description': inv.instance.wf.description,
             'status': inv.ownership}
-        for inv in queryset
+        for inv in invitations
         ]
+    current.output['facets'] = _get_task_facets(invitations)
     task_inv_list = TaskInvitation.objects.filter(role_id=current.role_id)
     current.output['task_count']= {
         'active': task_inv_list.filter(progress__in=STATE_DICT['active']).count(),
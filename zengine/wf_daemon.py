@@ -2,7 +2,6 @@
 """
 workflow worker daemon
 """
-import json
 import traceback
 from pprint import pformat
 
@@ -10,18 +9,18 @@ import signal
 from time import sleep, time
 
 import pika
-from tornado.escape import json_decode
 
 from pyoko.conf import settings
 from pyoko.lib.utils import get_object_from_path
-from zengine.client_queue import ClientQueue, BLOCKING_MQ_PARAMS
+from zengine.client_queue import ClientQueue, BLOCKING_MQ_PARAMS, JobPublisher
 from zengine.engine import ZEngine
 from zengine.current import Current
 from zengine.lib.cache import Session, KeepAlive
 from zengine.lib.exceptions import HTTPError, SecurityInfringementAttempt
 from zengine.lib.decorators import VIEW_METHODS, JOB_METHODS, runtime_importer
+from zengine.lib import json_interface
 
-from zengine.log import log
+from zengine.log import log, Payload
 import sys
 
 runtime_importer()
@@ -39,10 +38,15 @@ class Worker(object):
     """
     INPUT_QUEUE_NAME = 'in_queue'
     INPUT_EXCHANGE = 'input_exc'
+    #: Scheduled jobs are checked this often (seconds).
+    SCHEDULE_CHECK_INTERVAL = 600
 
     def __init__(self):
         self.connect()
         signal.signal(signal.SIGTERM, self.exit)
+        self.catalog_data_manager = get_object_from_path(settings.CATALOG_DATA_MANAGER)
+        self.catalog_data_manager.preload()
+        wf_engine.activities.preload()
         log.info("Worker starting")
 
     def exit(self, signal=None, frame=None):
@@ -86,6 +90,21 @@ class Worker(object):
             log.info(" Exiting")
             self.exit()
 
+    def schedule_archiving(self):
+        """
+        Publishes ``_zops_archive_workflows`` job once per
+        :attr:`~zengine.settings.WF_ARCHIVE_INTERVAL`, by whichever worker checks first.
+        """
+        from zengine.models import ArchiveSchedule
+        try:
+            if ArchiveSchedule().claim(settings.WF_ARCHIVE_INTERVAL):
+                JobPublisher.publish('_zops_archive_workflows')
+        except Exception:
+            log.exception("Archiving couldn't be scheduled")
+        self.connection.add_timeout(min(self.SCHEDULE_CHECK_INTERVAL,
+                                        settings.WF_ARCHIVE_INTERVAL),
+                                    self.schedule_archiving)
+
     def run(self):
         """
         actual consuming of incoming works starts here
@@ -94,6 +113,8 @@ class Worker(object):
                                          queue=self.INPUT_QUEUE_NAME,
                                          no_ack=True
                                          )
+        if settings.WF_ARCHIVE_INTERVAL:
+            self.schedule_archiving()
         try:
             self.input_channel.start_consuming()
         except (KeyboardInterrupt, SystemExit):
@@ -102,13 +123,16 @@ class Worker(object):
 
     def _prepare_error_msg(self, msg):
         try:
-            return \
-                msg + '\n\n' + \
+            data = \
                 "INPUT DATA: %s\n\n" % pformat(self.current.input) + \
-                "OUTPUT DATA: %s\n\n" % pformat(self.current.output) + \
-                sys._zops_wf_state_log
+                "OUTPUT DATA: %s\n\n" % pformat(self.current.output)
+        except:
+            data = ''
+        try:
+            wf_state = "%s" % sys._zops_wf_state_log
         except:
-            return msg
+            wf_state = "WF state cannot be rendered:\n%s" % traceback.format_exc()
+        return msg + '\n\n' + data + wf_state
 
     def _handle_ping_pong(self, data, session):
 
@@ -162,6 +186,21 @@ class Worker(object):
         #     self.connect()
         return wf_engine.current.output
 
+    @staticmethod
+    def _get_message_meta(properties, input):
+        """
+        Metadata of the message ("_zops_*" keys) is carried in AMQP headers.
+        Falls back to message body for publishers which still embed it there.
+
+        Args:
+            properties: AMQP message properties
+            input: Decoded message body
+
+        Returns:
+            Dict.
+        """
+        return getattr(properties, 'headers', None) or input
+
     def handle_message(self, ch, method, properties, body):
         """
         this is a pika.basic_consumer callback
@@ -175,10 +214,11 @@ class Worker(object):
         """
         input = {}
         headers = {}
+        self.catalog_data_manager.process_updates()
         try:
             self.sessid = method.routing_key
 
-            input = json_decode(body)
+            input = json_interface.loads(body)
             data = input['data']
 
             # since this comes as "path" we dont know if it's view or workflow yet
@@ -190,8 +230,9 @@ class Worker(object):
                     data['wf'] = data['path']
             session = Session(self.sessid)
 
-            headers = {'remote_ip': input['_zops_remote_ip'],
-                       'source': input['_zops_source']}
+            meta = self._get_message_meta(properties, input)
+            headers = {'remote_ip': meta['_zops_remote_ip'],
+                       'source': meta['_zops_source']}
 
             if 'wf' in data:
                 output = self._handle_workflow(session, data, headers)
@@ -216,10 +257,10 @@ class Worker(object):
                 raise
             err = traceback.format_exc()
             output = {"cmd": "error", "error": self._prepare_error_msg(err), "code": 500}
-            log.exception("Worker error occurred with messsage body:\n%s" % body)
+            log.exception("Worker error occurred with messsage body:\n%s", Payload(body))
         if 'callbackID' in input:
             output['callbackID'] = input['callbackID']
-        log.info("OUTPUT for %s: %s" % (self.sessid, output))
+        log.info("OUTPUT for %s: %s", self.sessid, Payload(output))
         output['reply_timestamp'] = time()
         self.send_output(output)
 